@@ -0,0 +1,91 @@
+"""
+Benchmark del percorso di lettura delle liste:
+- orm: query ORM + dict a mano + validazione response_model + JSON
+  (il vecchio percorso delle liste, ricostruito qui solo come riferimento)
+- rapido: SELECT Core con float + orjson, lo stesso di LetturaRapidaService
+  usato dalle route (senza cache)
+
+Uso (di default su SQLite in memoria, con dati sintetici):
+    python benchmark_letture.py [--righe 20] [--ripetizioni 2000]
+Per misurare sul DB reale impostare URL_PASSWORD_DB e --no-dati.
+"""
+
+import argparse
+import json
+import os
+import timeit
+
+os.environ.setdefault("URL_PASSWORD_DB", "sqlite://")
+
+from typing import List
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from fastapi.encoders import jsonable_encoder
+from database import SessionLocal
+import models
+import schemas
+import services
+from schema_db import crea_schema
+
+CASI = [
+    ("morfologia", schemas.MorfologiaSuolo),
+    ("edifici", schemas.Edifici),
+    ("industria", schemas.Industria),
+    ("mix", schemas.MixEnergetico),
+]
+
+
+def popola(db, righe: int):
+    for i in range(1, righe + 1):
+        db.add(models.Regioni(id_regione=i, nome=f"Regione {i}", superficie_kmq=1000 + i, pil=i))
+        db.add(models.MorfologiaSuolo(id_regione=i, pianura_pct=30, collina_pct=40, montagna_pct=30,
+                                      urbano_pct=5.5, agricolo_pct=60.25, forestale_pct=34.25))
+        db.add(models.Edifici(id_regione=i, anno=2023, consumo_medio_kwh_m2y=150.5, emissioni_procapite_tco2_ab=1.234,
+                              quota_elettrico_pct=20.5, quota_ape_classe_a_pct=4.75))
+        db.add(models.Industria(id_regione=i, anno=2023, emissioni_per_valore_aggiunto_tco2_per_mln_eur=210.1234,
+                                quota_elettrico_pct=35.5))
+        db.add(models.MixEnergetico(id_regione=i, anno=2023, carbone_pct=10.5, petrolio_pct=20.5, gas_pct=30.5,
+                                    rinnovabili_pct=38.5))
+    db.commit()
+
+
+def percorso_orm(model, adapter, db):
+    stmt = services._filtra_periodo(select(model), model)   # ultimo anno, come le route
+    righe = [services._riga(r) for r in db.execute(stmt).scalars()]
+    validate = adapter.validate_python(righe, from_attributes=True)
+    return json.dumps(jsonable_encoder(adapter.dump_python(validate))).encode()
+
+
+def percorso_rapido(model, db):
+    return services._json_rapido(model, db)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--righe", type=int, default=20)
+    parser.add_argument("--ripetizioni", type=int, default=2000)
+    parser.add_argument("--no-dati", action="store_true", help="non inserisce dati sintetici")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    if not args.no_dati:
+        crea_schema()
+        popola(db, args.righe)
+
+    print(f"{'tabella':<12}{'orm (µs)':>15}{'rapido (µs)':>15}{'speedup':>10}")
+    for nome, schema in CASI:
+        model = services.TABELLE[nome]
+        adapter = TypeAdapter(List[schema])
+        # i due percorsi devono produrre lo stesso contenuto
+        assert sorted(json.loads(percorso_orm(model, adapter, db)), key=lambda r: r["id_regione"]) == \
+            json.loads(percorso_rapido(model, db))
+        orm = min(timeit.repeat(lambda: percorso_orm(model, adapter, db), number=args.ripetizioni, repeat=3))
+        rapido = min(timeit.repeat(lambda: percorso_rapido(model, db), number=args.ripetizioni, repeat=3))
+        us_orm = orm / args.ripetizioni * 1e6
+        us_rapido = rapido / args.ripetizioni * 1e6
+        print(f"{nome:<12}{us_orm:>15.1f}{us_rapido:>15.1f}{us_orm / us_rapido:>9.1f}x")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Cache in memoria (per processo) dei risultati di lettura dei servizi.
+Dimensione massima (LRU), scadenza (TTL) e invalidazione esplicita per tabella
+dopo ogni scrittura. I contatori di hit/miss/evizioni sono esposti dall'API.
+
+Le letture concorrenti della stessa chiave non ancora in cache sono coalescenti
+(single-flight): la prima richiesta esegue la query, le altre attendono il suo
+risultato (o la sua eccezione) invece di ripetere la stessa SELECT.
+Con ASYNC_DB=1 i servizi girano in AsyncSession.run_sync sul thread del loop:
+lì l'attesa non può bloccare il thread (il calcolo in corso non ripartirebbe più),
+quindi si attende un future asyncio dal greenlet di SQLAlchemy (await_only).
+"""
+
+import asyncio
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+from metriche import SORGENTI_ESTERNE, richiesta_corrente
+
+
+class _Volo:
+    """Calcolo in corso per una chiave: le richieste che arrivano nel frattempo lo attendono."""
+
+    def __init__(self):
+        self.fatto = threading.Event()
+        self.valore = None
+        self.errore = None
+        self.superato = False     # invalidato durante il calcolo: il risultato non va in cache
+        self.futuri = []          # (loop, future) delle attese sul loop asyncio
+
+
+def _loop_corrente():
+    """Il loop asyncio in esecuzione in questo thread, None se non ce n'è uno."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _lettura_da_replica() -> bool:
+    """La richiesta in corso legge da una replica (database.sessione_per), forse in ritardo sul primario."""
+    stato = richiesta_corrente.get()
+    return stato is not None and stato.get("replica", False)
+
+
+def _risolvi(futuro):
+    if not futuro.done():
+        futuro.set_result(None)
+
+
+class CacheRisultati:
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._dati = OrderedDict()   # chiave -> (scadenza, valore)
+        self._in_volo = {}           # chiave -> _Volo
+        self._lock = threading.Lock()
+        self.hit = 0
+        self.miss = 0
+        self.evizioni = 0
+        self.scadute = 0
+        self.invalidazioni = 0
+        self.coalescenti = 0
+        self.da_replica = 0      # letture da una replica non salvate in cache
+
+    def leggi(self, chiave, calcola):
+        """
+        Restituisce il valore in cache per la chiave, altrimenti lo calcola e lo salva.
+        Se la stessa chiave è già in calcolo in un altro thread ne attende il risultato.
+        Le letture da una replica usano le voci presenti ma non salvano né condividono
+        il proprio risultato: dopo la finestra sticky una replica in ritardo
+        riempirebbe la cache con dati vecchi fino al TTL.
+        """
+        adesso = time.monotonic()
+        da_replica = _lettura_da_replica()
+        with self._lock:
+            voce = self._dati.get(chiave)
+            if voce is not None:
+                if voce[0] > adesso:
+                    self._dati.move_to_end(chiave)
+                    self.hit += 1
+                    return voce[1]
+                del self._dati[chiave]
+                self.scadute += 1
+            if da_replica:
+                self.da_replica += 1
+            volo = None if da_replica else self._in_volo.get(chiave)
+            loop = _loop_corrente()
+            futuro = None
+            if volo is not None and loop is not None:
+                if in_greenlet():
+                    futuro = loop.create_future()
+                    volo.futuri.append((loop, futuro))
+                else:
+                    volo = None          # codice sincrono sul loop: non può attendere, calcola da sé
+            in_attesa = volo is not None
+            if in_attesa:
+                self.coalescenti += 1
+            elif not da_replica:
+                volo = _Volo()
+                self._in_volo.setdefault(chiave, volo)
+                self.miss += 1
+
+        if da_replica:
+            return calcola()
+        if in_attesa:
+            if futuro is not None:
+                await_only(futuro)       # cede il loop: il calcolo in corso può proseguire
+            else:
+                volo.fatto.wait()
+            if volo.errore is not None:
+                raise volo.errore
+            return volo.valore
+
+        try:
+            volo.valore = calcola()
+        except BaseException as e:
+            volo.errore = e
+            raise
+        finally:
+            with self._lock:
+                if self._in_volo.get(chiave) is volo:
+                    del self._in_volo[chiave]
+                if volo.errore is None and not volo.superato:
+                    self._dati[chiave] = (time.monotonic() + self.ttl, volo.valore)
+                    self._dati.move_to_end(chiave)
+                    while len(self._dati) > self.maxsize:
+                        self._dati.popitem(last=False)
+                        self.evizioni += 1
+                futuri, volo.futuri = volo.futuri, []
+            volo.fatto.set()
+            for loop, futuro in futuri:
+                try:
+                    loop.call_soon_threadsafe(_risolvi, futuro)
+                except RuntimeError:     # loop già chiuso
+                    pass
+        return volo.valore
+
+    def invalida(self, *tabelle):
+        """
+        Rimuove le voci delle tabelle indicate (la tabella è il primo elemento della chiave).
+        I calcoli in corso su quelle tabelle potrebbero aver letto i dati vecchi: non finiranno
+        in cache e le richieste successive ne avviano uno nuovo invece di attenderli.
+        """
+        with self._lock:
+            for chiave in [k for k in self._dati if k[0] in tabelle]:
+                del self._dati[chiave]
+                self.invalidazioni += 1
+            for chiave in [k for k in self._in_volo if k[0] in tabelle]:
+                self._in_volo.pop(chiave).superato = True
+
+    def svuota(self):
+        with self._lock:
+            self.invalidazioni += len(self._dati)
+            self._dati.clear()
+            for volo in self._in_volo.values():
+                volo.superato = True
+            self._in_volo.clear()
+
+    def statistiche(self) -> dict:
+        with self._lock:
+            totale = self.hit + self.miss
+            return {
+                "voci": len(self._dati),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hit": self.hit,
+                "miss": self.miss,
+                "hit_ratio": round(self.hit / totale, 4) if totale else None,
+                "evizioni": self.evizioni,
+                "scadute": self.scadute,
+                "invalidazioni": self.invalidazioni,
+                "coalescenti": self.coalescenti,
+                "da_replica": self.da_replica,
+                "in_volo": len(self._in_volo),
+            }
+
+
+cache_risultati = CacheRisultati(
+    maxsize=int(os.getenv("CACHE_MAXSIZE", "256")),
+    ttl=float(os.getenv("CACHE_TTL", "300")),
+)
+
+
+def righe_prometheus():
+    """Statistiche della cache come metriche Prometheus (aggiunte a /metrics)."""
+    stat = cache_risultati.statistiche()
+    righe = []
+    for nome, chiave, tipo in [
+        ("can_cache_hits_total", "hit", "counter"),
+        ("can_cache_misses_total", "miss", "counter"),
+        ("can_cache_evictions_total", "evizioni", "counter"),
+        ("can_cache_expired_total", "scadute", "counter"),
+        ("can_cache_invalidations_total", "invalidazioni", "counter"),
+        ("can_cache_coalesced_total", "coalescenti", "counter"),
+        ("can_cache_inflight", "in_volo", "gauge"),
+        ("can_cache_entries", "voci", "gauge"),
+    ]:
+        righe.append(f"# TYPE {nome} {tipo}")
+        righe.append(f"{nome} {stat[chiave]}")
+    return righe
+
+
+SORGENTI_ESTERNE.append(righe_prometheus)
+
+
+def memoizza(tabella: str):
+    """
+    Decoratore read-through per i metodi di lettura dei servizi.
+    La chiave è (tabella, metodo, argomenti), esclusa la sessione DB.
+    I valori in cache devono essere dati semplici (dict/list), non oggetti ORM.
+    """
+    def decoratore(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            chiave = (
+                tabella,
+                fn.__qualname__,
+                tuple(a for a in args if not isinstance(a, Session)),
+                tuple(sorted((k, v) for k, v in kwargs.items() if not isinstance(v, Session))),
+            )
+            return cache_risultati.leggi(chiave, lambda: fn(*args, **kwargs))
+        return wrapper
+    return decoratore
@@ -0,0 +1,175 @@
+"""
+Compressione delle risposte (gzip / brotli) negoziata con l'header Accept-Encoding.
+
+- CompressioneMiddleware comprime al volo le risposte testuali (JSON, CSV, NDJSON,
+  Arrow) anche in streaming, svuotando il compressore a ogni blocco;
+- gli artefatti statici (le geometrie) sono compressi una volta sola al build
+  con scrivi_precompressi() e serviti così come sono, senza lavoro per richiesta.
+
+brotli è una dipendenza opzionale: se manca si usa solo gzip.
+
+frontend/compressione.py ripete scegli_codifica() e comprimi() per il server Flask:
+il contesto di build dell'immagine frontend non include backend/. Vanno modificati insieme.
+"""
+
+import gzip
+import os
+import zlib
+from typing import Iterable, Optional
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    brotli = None
+
+COMPRESSIONE_MIN_BYTE = int(os.getenv("COMPRESSIONE_MIN_BYTE", "1024"))
+GZIP_LIVELLO = int(os.getenv("GZIP_LIVELLO", "6"))
+BROTLI_QUALITA = int(os.getenv("BROTLI_QUALITA", "4"))
+
+# preferenza del server a parità di q: brotli comprime meglio i JSON
+CODIFICHE = ("br", "gzip") if brotli is not None else ("gzip",)
+ESTENSIONI = {"br": ".br", "gzip": ".gz"}
+TIPI_COMPRIMIBILI = (
+    "application/json", "application/geo+json", "application/x-ndjson",
+    "application/vnd.apache.arrow.stream", "text/",
+)
+
+
+def scegli_codifica(accept_encoding: Optional[str], disponibili: Iterable[str] = CODIFICHE) -> Optional[str]:
+    """Codifica da usare secondo Accept-Encoding (valori q inclusi), None se nessuna."""
+    if not accept_encoding:
+        return None
+    pesi = {}
+    for parte in accept_encoding.lower().split(","):
+        nome, _, parametri = parte.strip().partition(";")
+        q = 1.0
+        if parametri.strip().startswith("q="):
+            try:
+                q = float(parametri.strip()[2:])
+            except ValueError:
+                q = 0.0
+        pesi[nome.strip()] = q
+    migliore, peso_migliore = None, 0.0
+    for codifica in disponibili:
+        peso = pesi.get(codifica, pesi.get("*", 0.0))
+        if peso > peso_migliore:
+            migliore, peso_migliore = codifica, peso
+    return migliore
+
+
+def comprimi(dati: bytes, codifica: str, massima: bool = False) -> bytes:
+    """Compressione in un colpo solo; massima=True per gli artefatti di build."""
+    if codifica == "br":
+        return brotli.compress(dati, quality=11 if massima else BROTLI_QUALITA)
+    return gzip.compress(dati, compresslevel=9 if massima else GZIP_LIVELLO, mtime=0)
+
+
+def scrivi_precompressi(percorso: str) -> dict:
+    """Scrive accanto al file le varianti .gz e .br; restituisce le dimensioni."""
+    with open(percorso, "rb") as f:
+        dati = f.read()
+    dimensioni = {}
+    for codifica in CODIFICHE:
+        compresso = comprimi(dati, codifica, massima=True)
+        with open(percorso + ESTENSIONI[codifica], "wb") as f:
+            f.write(compresso)
+        dimensioni[codifica] = len(compresso)
+    return dimensioni
+
+
+def leggi_varianti(percorso: str) -> dict:
+    """{None: originale, "gzip": ..., "br": ...} con le sole varianti presenti su disco."""
+    with open(percorso, "rb") as f:
+        varianti = {None: f.read()}
+    for codifica, estensione in ESTENSIONI.items():
+        if os.path.exists(percorso + estensione):
+            with open(percorso + estensione, "rb") as f:
+                varianti[codifica] = f.read()
+    return varianti
+
+
+class _Compressore:
+    """Compressore incrementale: ogni blocco esce subito (flush), utile in streaming."""
+
+    def __init__(self, codifica: str):
+        if codifica == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITA)
+            self._gz = None
+        else:
+            self._br = None
+            self._gz = zlib.compressobj(GZIP_LIVELLO, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def blocco(self, dati: bytes, fine: bool) -> bytes:
+        if self._br is not None:
+            return self._br.process(dati) + (self._br.finish() if fine else self._br.flush())
+        return self._gz.compress(dati) + self._gz.flush(zlib.Z_FINISH if fine else zlib.Z_SYNC_FLUSH)
+
+
+def _comprimibile(headers: MutableHeaders) -> bool:
+    tipo = headers.get("content-type", "")
+    # gli eventi SSE sono piccoli e devono arrivare subito: niente compressione
+    return "content-encoding" not in headers and tipo.startswith(TIPI_COMPRIMIBILI) \
+        and not tipo.startswith("text/event-stream")
+
+
+class CompressioneMiddleware:
+    """
+    Comprime le risposte testuali se il client lo accetta. Le risposte già codificate
+    (artefatti precompressi) e quelle sotto COMPRESSIONE_MIN_BYTE passano invariate.
+    L'ETag di una risposta compressa diventa debole (W/...), come fanno i proxy:
+    l'ETagMiddleware confronta gli ETag ignorando il prefisso, quindi i 304 restano validi.
+    """
+
+    def __init__(self, app, minimo: int = COMPRESSIONE_MIN_BYTE):
+        self.app = app
+        self.minimo = minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        codifica = scegli_codifica(Headers(scope=scope).get("accept-encoding"))
+        stato = {"inizio": None, "compressore": None, "diretto": False}
+
+        async def send_compresso(message):
+            if stato["diretto"]:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if message["status"] in (204, 304) or not _comprimibile(headers):
+                    stato["diretto"] = True
+                    await send(message)
+                    return
+                headers.add_vary_header("Accept-Encoding")
+                stato["inizio"] = message          # trattenuto fino al primo blocco
+                return
+
+            corpo = message.get("body", b"")
+            altri = message.get("more_body", False)
+            if stato["compressore"] is None:
+                inizio = stato["inizio"]
+                if codifica is None or (not altri and len(corpo) < self.minimo):
+                    stato["diretto"] = True
+                    await send(inizio)
+                    await send(message)
+                    return
+                headers = MutableHeaders(raw=inizio["headers"])
+                headers["Content-Encoding"] = codifica
+                if "content-length" in headers:
+                    del headers["content-length"]
+                if headers.get("etag", "").startswith('"'):
+                    headers["ETag"] = "W/" + headers["etag"]
+                stato["compressore"] = _Compressore(codifica)
+                await send(inizio)
+
+            await send({
+                "type": "http.response.body",
+                "body": stato["compressore"].blocco(corpo, fine=not altri),
+                "more_body": altri,
+            })
+
+        await self.app(scope, receive, send_compresso)
@@ -1,27 +1,296 @@
 """
 Crea la connessione a MySQL e il motore SQLAlchemy.
 Espone la sessione da usare in routes e services.
+Con ASYNC_DB=1 crea anche un motore asincrono (aiomysql / aiosqlite).
+Con REPLICHE_URL_DB le letture delle richieste GET vanno sulle repliche
+(solo le rotte sincrone: le rotte async leggono sempre dal primario).
+
+Il pool di connessioni si configura con le variabili d'ambiente
+DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE e DB_POOL_PRE_PING;
+le statistiche live sono esposte su /pool e /metrics.
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import itertools
+import logging
+import threading
+import time
+from fastapi import Request, Response
+from sqlalchemy import create_engine, event, exc, Select
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
 # importa file env
 from dotenv import load_dotenv
 import os
+from metriche import strumenta_engine, attesa_pool, timeout_pool, richiesta_corrente, SORGENTI_ESTERNE
+from versione import versione_dati
 load_dotenv()
+logger = logging.getLogger("can.db")
 URL_PASSWORD_DB = os.getenv("URL_PASSWORD_DB")
 SQLALCHEMY_DATABASE_URL = URL_PASSWORD_DB
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# =====================================================
+# POOL DI CONNESSIONI
+# =====================================================
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+# il ping a ogni checkout costa un round trip: disattivabile se DB_POOL_RECYCLE
+# è inferiore al wait_timeout di MySQL
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+
+class _MisuraAttesa:
+    """Misura il tempo di attesa per ottenere una connessione dal pool."""
+
+    def _do_get(self):
+        inizio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timeout_pool.incrementa(pool=self._orig_logging_name or "-")
+            raise
+        finally:
+            attesa_pool.osserva(time.perf_counter() - inizio, pool=self._orig_logging_name or "-")
+
+
+class PoolMisurato(_MisuraAttesa, QueuePool):
+    pass
+
+
+class PoolMisuratoAsync(_MisuraAttesa, AsyncAdaptedQueuePool):
+    pass
+
+
+def opzioni_pool(url: str, nome: str, asincrono: bool = False) -> dict:
+    """Argomenti di create_engine per il pool (SQLite usa il suo pool di default)."""
+    opzioni = {"pool_pre_ping": POOL_PRE_PING, "pool_logging_name": nome}
+    if url.startswith("sqlite"):
+        return opzioni
+    opzioni.update(
+        poolclass=PoolMisuratoAsync if asincrono else PoolMisurato,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+    )
+    return opzioni
+
+
+# motori per nome, per le statistiche del pool
+ENGINE_REGISTRATI = {}
+
+
+def statistiche_pool() -> dict:
+    """Stato live di ogni pool: connessioni in uso, libere, overflow."""
+    stato = {}
+    for nome, eng in ENGINE_REGISTRATI.items():
+        pool = eng.pool
+        if isinstance(pool, QueuePool):
+            stato[nome] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "max_overflow": pool._max_overflow,
+                "timeout_s": pool.timeout(),
+            }
+        else:
+            stato[nome] = {"status": pool.status()}
+        if eng in REPLICHE:
+            stato[nome]["in_servizio"] = selettore_repliche.in_servizio(eng)
+    return stato
+
+
+def righe_prometheus_pool():
+    righe = []
+    for nome, gauge, chiave in [
+        ("can_db_pool_size", "gauge", "size"),
+        ("can_db_pool_checked_out", "gauge", "checked_out"),
+        ("can_db_pool_checked_in", "gauge", "checked_in"),
+        ("can_db_pool_overflow", "gauge", "overflow"),
+    ]:
+        righe.append(f"# TYPE {nome} {gauge}")
+        for pool, stato in statistiche_pool().items():
+            if chiave in stato:
+                righe.append(f'{nome}{{pool="{pool}"}} {stato[chiave]}')
+    return righe
+
+
+SORGENTI_ESTERNE.append(righe_prometheus_pool)
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **opzioni_pool(SQLALCHEMY_DATABASE_URL, "primario"))
+strumenta_engine(engine)
+ENGINE_REGISTRATI["primario"] = engine
+
+
+# =====================================================
+# REPLICHE DI LETTURA
+# =====================================================
+# URL separati da virgola, es. "mysql+pymysql://...@replica1/can,mysql+pymysql://...@replica2/can"
+REPLICHE_URL_DB = [u.strip() for u in os.getenv("REPLICHE_URL_DB", "").split(",") if u.strip()]
+# dopo una scrittura il client legge dal primario per questi secondi (read-your-writes)
+REPLICA_STICKY_S = float(os.getenv("REPLICA_STICKY_S", "5"))
+# una replica in errore resta esclusa per questi secondi
+REPLICA_PAUSA_S = float(os.getenv("REPLICA_PAUSA_S", "30"))
+COOKIE_SCRITTURA = "can_scrittura"
+
+
+class SelettoreRepliche:
+    """Round robin sulle repliche in servizio; quelle in errore vengono saltate per REPLICA_PAUSA_S."""
+
+    def __init__(self, repliche, pausa_s: float):
+        self._repliche = list(repliche)
+        self._turno = itertools.count()
+        self._pausa_s = pausa_s
+        self._esclusa_fino = {}
+        self._lock = threading.Lock()
+
+    def in_servizio(self, replica) -> bool:
+        return self._esclusa_fino.get(replica, 0) <= time.monotonic()
+
+    def scegli(self):
+        """Prossima replica in servizio, None se non ce ne sono (si legge dal primario)."""
+        for _ in range(len(self._repliche)):
+            with self._lock:
+                replica = self._repliche[next(self._turno) % len(self._repliche)]
+            if self.in_servizio(replica):
+                return replica
+        return None
+
+    def segnala_errore(self, replica):
+        self._esclusa_fino[replica] = time.monotonic() + self._pausa_s
+
+
+REPLICHE = []
+for i, url in enumerate(REPLICHE_URL_DB, start=1):
+    replica = create_engine(url, **opzioni_pool(url, f"replica{i}"))
+    strumenta_engine(replica)
+    ENGINE_REGISTRATI[f"replica{i}"] = replica
+    REPLICHE.append(replica)
+
+selettore_repliche = SelettoreRepliche(REPLICHE, REPLICA_PAUSA_S)
+
+for replica in REPLICHE:
+    @event.listens_for(replica, "handle_error")
+    def _replica_in_errore(contesto, replica=replica):
+        # connessione persa o rifiutata, tabella mancante, ecc.: la replica esce dal giro
+        if contesto.is_disconnect or isinstance(contesto.sqlalchemy_exception, exc.OperationalError):
+            selettore_repliche.segnala_errore(replica)
+
+
+class SessionInstradata(Session):
+    """
+    Sessione che legge dalla replica assegnata (info["replica"]) e scrive sul primario.
+    Solo le SELECT vanno alla replica; flush, INSERT/UPDATE/DELETE e testo SQL usano il primario.
+    Dopo la prima scrittura anche le letture della stessa sessione tornano sul primario.
+    """
+
+    def execute(self, statement, *args, **kw):
+        """Se la replica non risponde (o non ha la tabella) la lettura si ripete sul primario."""
+        replica = self.info.get("replica")
+        try:
+            return super().execute(statement, *args, **kw)
+        except exc.DBAPIError as e:
+            if replica is None or self.info.get("replica") is not replica:
+                raise
+            if not (e.connection_invalidated or isinstance(e, exc.OperationalError)):
+                raise
+            selettore_repliche.segnala_errore(replica)
+            self.info["replica"] = None
+            self.rollback()          # la sessione di una GET non ha scritture da perdere
+            return super().execute(statement, *args, **kw)
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is not None:
+            if not self._flushing and isinstance(clause, Select):
+                return replica
+            if self._flushing or clause is not None:
+                self.info["replica"] = None
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=SessionInstradata)
 
 Base = declarative_base()
 
-# Dependency per le rotte
-def get_db():
+
+def _scrittura_recente(request: Request) -> bool:
+    """Il client (cookie) o questo processo hanno scritto negli ultimi REPLICA_STICKY_S secondi."""
+    adesso = time.time()
+    if versione_dati.valore and adesso - versione_dati.ultima_modifica < REPLICA_STICKY_S:
+        return True
+    try:
+        return adesso - float(request.cookies.get(COOKIE_SCRITTURA, 0)) < REPLICA_STICKY_S
+    except ValueError:
+        return False
+
+
+def sessione_per(request: Request) -> Session:
+    """
+    Nuova sessione per la richiesta: le letture (GET/HEAD) vanno a una replica se possibile.
+    La richiesta viene marcata (richiesta_corrente["replica"]): i dati forse in ritardo
+    non entrano nella cache delle letture e la risposta non riceve ETag.
+    """
     db = SessionLocal()
+    if REPLICHE and request.method in ("GET", "HEAD") and not _scrittura_recente(request):
+        db.info["replica"] = selettore_repliche.scegli()
+        stato = richiesta_corrente.get()
+        if stato is not None and db.info["replica"] is not None:
+            stato["replica"] = True
+    return db
+
+
+# Dependency per le rotte
+def get_db(request: Request, response: Response):
+    db = sessione_per(request)
+    if REPLICHE and request.method not in ("GET", "HEAD"):
+        # segna il client: le sue prossime letture vanno al primario
+        response.set_cookie(COOKIE_SCRITTURA, str(time.time()), max_age=max(1, int(REPLICA_STICKY_S)), httponly=True)
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# =====================================================
+# MODALITÀ ASYNC (opzionale)
+# =====================================================
+ASYNC_DB = os.getenv("ASYNC_DB", "0") == "1"
+
+# driver asincrono corrispondente a quello sincrono
+DRIVER_ASYNC = {
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def url_async(url: str) -> str:
+    """Converte l'URL sincrono nell'equivalente con driver async."""
+    driver, resto = url.split("://", 1)
+    return f"{DRIVER_ASYNC.get(driver, driver)}://{resto}"
+
+
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DB:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    ASYNC_DATABASE_URL = os.getenv("ASYNC_URL_DB") or url_async(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **opzioni_pool(ASYNC_DATABASE_URL, "async", asincrono=True))
+    strumenta_engine(async_engine.sync_engine)
+    ENGINE_REGISTRATI["async"] = async_engine.sync_engine
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    if REPLICHE:
+        # il motore async è uno solo, sul primario: le repliche servono solo le rotte sincrone
+        logger.warning("ASYNC_DB=1: le rotte async leggono dal primario, REPLICHE_URL_DB vale solo per le rotte sincrone")
+
+
+# Dependency per le rotte async
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
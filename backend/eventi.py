@@ -0,0 +1,92 @@
+"""
+Notifiche delle scritture ai client tramite Server-Sent Events (GET /eventi).
+
+Ogni commit dei servizi pubblica un evento {"table", "id_regione", "version"} per
+tabella e regione toccate (id_regione null = tutta la tabella). I servizi girano nel
+threadpool, gli iscritti sono code asyncio: la consegna passa da call_soon_threadsafe
+sul loop di ciascun iscritto.
+
+Un client lento che riempie la sua coda, o che si riconnette con un Last-Event-ID non
+più nello storico, riceve un evento {"table": "*"}: deve considerare cambiato tutto.
+
+Come la versione dei dati, il bus vive nel processo: con più worker uvicorn ogni
+connessione riceve solo le scritture del worker che la serve.
+"""
+
+import asyncio
+import os
+import threading
+from collections import deque
+
+import orjson
+
+EVENTI_CODA = int(os.getenv("EVENTI_CODA", "256"))
+EVENTI_STORICO = int(os.getenv("EVENTI_STORICO", "1000"))
+EVENTI_PING_S = float(os.getenv("EVENTI_PING_S", "15"))
+TUTTE = "*"
+
+
+def evento_reset(versione: int) -> dict:
+    return {"table": TUTTE, "id_regione": None, "version": versione}
+
+
+def formatta_sse(evento: dict) -> bytes:
+    """Messaggio SSE: l'id è la versione dei dati, usata dal client come Last-Event-ID."""
+    return b"id: %d\ndata: %s\n\n" % (evento["version"], orjson.dumps(evento))
+
+
+class BusEventi:
+    def __init__(self, dimensione_coda: int = EVENTI_CODA, storico: int = EVENTI_STORICO):
+        self._lock = threading.Lock()
+        self._iscritti = set()
+        self._storico = deque(maxlen=storico)
+        self.dimensione_coda = dimensione_coda
+
+    def pubblica(self, tabelle, regioni, versione: int) -> None:
+        """Chiamata dai servizi dopo il commit, da qualsiasi thread."""
+        ids = sorted(set(regioni)) if regioni else [None]
+        eventi = [{"table": t, "id_regione": i, "version": versione} for t in tabelle for i in ids]
+        with self._lock:
+            self._storico.extend(eventi)
+            iscritti = list(self._iscritti)
+        for loop, coda in iscritti:
+            try:
+                loop.call_soon_threadsafe(self._consegna, coda, eventi)
+            except RuntimeError:      # loop già chiuso: la connessione sta terminando
+                pass
+
+    @staticmethod
+    def _consegna(coda: asyncio.Queue, eventi: list) -> None:
+        for evento in eventi:
+            if coda.full():
+                # client troppo lento: gli eventi in attesa diventano un solo reset
+                while not coda.empty():
+                    coda.get_nowait()
+                coda.put_nowait(evento_reset(eventi[-1]["version"]))
+                return
+            coda.put_nowait(evento)
+
+    def iscrivi(self, dopo: int = None, versione_corrente: int = 0) -> asyncio.Queue:
+        """
+        Nuova coda sul loop corrente. Con dopo (Last-Event-ID) rimette in coda gli
+        eventi successivi ancora nello storico, oppure un reset se non bastano.
+        """
+        coda = asyncio.Queue(maxsize=self.dimensione_coda)
+        with self._lock:
+            self._iscritti.add((asyncio.get_running_loop(), coda))
+            if dopo is not None and dopo != versione_corrente:
+                mancanti = [e for e in self._storico if e["version"] > dopo]
+                completo = dopo < versione_corrente and self._storico and self._storico[0]["version"] <= dopo + 1
+                self._consegna(coda, mancanti if completo else [evento_reset(versione_corrente)])
+        return coda
+
+    def disiscrivi(self, coda: asyncio.Queue) -> None:
+        with self._lock:
+            self._iscritti = {(l, c) for l, c in self._iscritti if c is not coda}
+
+    @property
+    def connessi(self) -> int:
+        return len(self._iscritti)
+
+
+bus_eventi = BusEventi()
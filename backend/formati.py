@@ -0,0 +1,97 @@
+"""
+Formati di risposta tabellari scelti con l'header Accept:
+Apache Arrow (IPC stream) e Parquet, per client che lavorano con pandas/pyarrow.
+pyarrow è una dipendenza opzionale: se manca, questi formati rispondono 406.
+"""
+
+from typing import Optional
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    pa = None
+    pq = None
+
+MEDIA_ARROW = "application/vnd.apache.arrow.stream"
+MEDIA_PARQUET = "application/x-parquet"
+FORMATI = {MEDIA_ARROW: "arrow", MEDIA_PARQUET: "parquet"}
+RIGHE_PER_BATCH = 65536
+
+
+def formato_tabellare(accept: Optional[str]) -> Optional[str]:
+    """
+    "arrow" o "parquet" se l'header Accept li chiede prima di JSON, altrimenti None.
+    """
+    if not accept:
+        return None
+    for parte in accept.split(","):
+        media = parte.split(";")[0].strip().lower()
+        if media in FORMATI:
+            return FORMATI[media]
+        if media in ("application/json", "*/*"):
+            return None
+    return None
+
+
+class _Raccoglitore:
+    """Sink minimale per pyarrow: accumula i byte scritti tra un batch e l'altro."""
+    closed = False
+
+    def __init__(self):
+        self.parti = []
+
+    def write(self, dati):
+        self.parti.append(bytes(dati))
+        return len(dati)
+
+    def flush(self):
+        pass
+
+    def svuota(self) -> bytes:
+        dati = b"".join(self.parti)
+        self.parti.clear()
+        return dati
+
+
+def _stream_arrow(tabella):
+    sink = _Raccoglitore()
+    with pa.ipc.new_stream(sink, tabella.schema) as writer:
+        for batch in tabella.to_batches(max_chunksize=RIGHE_PER_BATCH):
+            writer.write_batch(batch)
+            yield sink.svuota()
+    yield sink.svuota()
+
+
+def risposta_json(risultato) -> Response:
+    """
+    Risposta per una lista già serializzata: (corpo JSON, cursore successivo).
+    Se la pagina è piena, l'header X-Next-Cursor contiene il cursore successivo.
+    """
+    corpo, prossimo = risultato
+    headers = {"X-Next-Cursor": str(prossimo)} if prossimo is not None else None
+    return Response(content=corpo, media_type="application/json", headers=headers)
+
+
+def risposta_tabellare(colonne: dict, formato: str, limit: Optional[int] = None,
+                       chiave: tuple = ("id_regione", "anno")) -> Response:
+    """
+    Risposta Arrow/Parquet costruita direttamente dalle colonne della query
+    (un array per colonna, nessuna validazione Pydantic riga per riga).
+    """
+    if pa is None:
+        raise HTTPException(status_code=406, detail="Formato non disponibile: pyarrow non installato")
+
+    tabella = pa.table({nome: pa.array(valori) for nome, valori in colonne.items()})
+    headers = {"Vary": "Accept"}
+    ids = colonne.get(chiave[0], [])
+    if limit is not None and len(ids) == limit:
+        headers["X-Next-Cursor"] = ":".join(str(colonne[c][-1]) for c in chiave if c in colonne)
+
+    if formato == "parquet":
+        buffer = pa.BufferOutputStream()
+        pq.write_table(tabella, buffer)
+        return Response(content=buffer.getvalue().to_pybytes(), media_type=MEDIA_PARQUET, headers=headers)
+    return StreamingResponse(_stream_arrow(tabella), media_type=MEDIA_ARROW, headers=headers)
@@ -0,0 +1,268 @@
+"""
+Geometrie delle regioni semplificate a più livelli di dettaglio, in formato TopoJSON.
+
+Il GeoJSON originale (frontend/limits_IT_regions.geojson, ~2.8 MB) viene convertito
+una volta sola con il comando di build:
+
+    python geometrie.py costruisci [--sorgente ../frontend/limits_IT_regions.geojson]
+
+Il comando:
+- spezza gli anelli dei poligoni in archi nei punti di giunzione, così il confine
+  tra due regioni è un solo arco condiviso (topologia preservata: niente buchi
+  o sovrapposizioni dopo la semplificazione);
+- semplifica ogni arco con Douglas-Peucker a diverse tolleranze;
+- quantizza le coordinate su una griglia intera e le codifica a differenze (delta);
+- scrive accanto a ogni file le varianti precompresse .gz e .br.
+
+I file prodotti (cartella geometrie/) sono serviti da /geometrie/regioni?zoom=,
+che sceglie il livello di dettaglio in base allo zoom della mappa.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+from compressione import leggi_varianti, scrivi_precompressi
+
+CARTELLA = os.path.join(os.path.dirname(__file__), "geometrie")
+SORGENTE = os.path.join(os.path.dirname(__file__), "..", "frontend", "limits_IT_regions.geojson")
+
+# (nome, tolleranza in gradi, passi della griglia di quantizzazione, zoom massimo)
+LIVELLI = (
+    ("bassa", 0.01, 10_000, 6),
+    ("media", 0.002, 50_000, 8),
+    ("alta", 0.0004, 200_000, None),
+)
+
+
+def livello_per_zoom(zoom: float) -> str:
+    """Nome del livello di dettaglio adatto allo zoom della mappa."""
+    for nome, _, _, zoom_max in LIVELLI:
+        if zoom_max is None or zoom < zoom_max:
+            return nome
+    return LIVELLI[-1][0]
+
+
+# ==========================================================
+# TOPOLOGIA
+# ==========================================================
+
+def _poligoni(geometria) -> list:
+    """Lista di poligoni (liste di anelli senza il punto di chiusura ripetuto)."""
+    poligoni = [geometria["coordinates"]] if geometria["type"] == "Polygon" else geometria["coordinates"]
+    return [[[tuple(p) for p in anello[:-1]] for anello in poligono] for poligono in poligoni]
+
+
+def _giunzioni(anelli) -> set:
+    """Punti in cui un confine si separa: stesso punto con vicini diversi."""
+    vicini = {}
+    for anello in anelli:
+        n = len(anello)
+        for i, punto in enumerate(anello):
+            coppia = frozenset((anello[i - 1], anello[(i + 1) % n]))
+            vicini.setdefault(punto, set()).add(coppia)
+    return {punto for punto, coppie in vicini.items() if len(coppie) > 1}
+
+
+def _taglia(anello, giunzioni) -> list:
+    """Spezza un anello in archi (liste di punti) nei punti di giunzione."""
+    indici = [i for i, p in enumerate(anello) if p in giunzioni]
+    if not indici:
+        # anello isolato (isola o enclave): un solo arco chiuso, ruotato sul punto minimo
+        inizio = anello.index(min(anello))
+        ruotato = anello[inizio:] + anello[:inizio]
+        return [ruotato + [ruotato[0]]]
+    ruotato = anello[indici[0]:] + anello[:indici[0]] + [anello[indici[0]]]
+    archi, corrente = [], [ruotato[0]]
+    for punto in ruotato[1:]:
+        corrente.append(punto)
+        if punto in giunzioni:
+            archi.append(corrente)
+            corrente = [punto]
+    return archi
+
+
+def topologia(geojson) -> dict:
+    """
+    Converte una FeatureCollection in archi condivisi.
+    Restituisce {"archi": [...], "oggetti": [(proprietà, poligoni di indici d'arco)]}:
+    un indice negativo ~i indica l'arco i percorso al contrario, come in TopoJSON.
+    """
+    feature = [(f["properties"], _poligoni(f["geometry"])) for f in geojson["features"]]
+    giunzioni = _giunzioni(anello for _, poligoni in feature for poligono in poligoni for anello in poligono)
+
+    archi, indice_arco = [], {}
+
+    def registra(arco):
+        chiave = tuple(arco)
+        if chiave in indice_arco:
+            return indice_arco[chiave]
+        inverso = tuple(reversed(arco))
+        if inverso in indice_arco:
+            return ~indice_arco[inverso]
+        indice_arco[chiave] = len(archi)
+        archi.append(arco)
+        return indice_arco[chiave]
+
+    oggetti = [
+        (proprieta, [[[registra(a) for a in _taglia(anello, giunzioni)] for anello in poligono] for poligono in poligoni])
+        for proprieta, poligoni in feature
+    ]
+    return {"archi": archi, "oggetti": oggetti}
+
+
+# ==========================================================
+# SEMPLIFICAZIONE E QUANTIZZAZIONE
+# ==========================================================
+
+def _distanza2(p, a, b) -> float:
+    """Quadrato della distanza del punto p dal segmento a-b."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == 0 and dy == 0:
+        return (p[0] - a[0]) ** 2 + (p[1] - a[1]) ** 2
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)))
+    return (p[0] - a[0] - t * dx) ** 2 + (p[1] - a[1] - t * dy) ** 2
+
+
+def _douglas_peucker(punti, tolleranza) -> list:
+    """Douglas-Peucker iterativo: gli estremi dell'arco restano sempre fissi."""
+    tenuti = {0, len(punti) - 1}
+    tol2 = tolleranza * tolleranza
+    pila = [(0, len(punti) - 1)]
+    while pila:
+        inizio, fine = pila.pop()
+        massimo, indice = 0.0, None
+        for i in range(inizio + 1, fine):
+            d = _distanza2(punti[i], punti[inizio], punti[fine])
+            if d > massimo:
+                massimo, indice = d, i
+        if indice is not None and massimo > tol2:
+            tenuti.add(indice)
+            pila += [(inizio, indice), (indice, fine)]
+    return [punti[i] for i in sorted(tenuti)]
+
+
+def semplifica_arco(arco, tolleranza) -> list:
+    """
+    Semplifica un arco; un arco chiuso viene diviso nel punto più lontano
+    dall'inizio e conserva almeno quattro punti (un triangolo chiuso).
+    """
+    if arco[0] != arco[-1] or len(arco) <= 4:
+        return _douglas_peucker(arco, tolleranza)
+    lontano = max(range(len(arco)), key=lambda i: _distanza2(arco[i], arco[0], arco[0]))
+    semplificato = _douglas_peucker(arco[:lontano + 1], tolleranza)[:-1] + _douglas_peucker(arco[lontano:], tolleranza)
+    if len(semplificato) < 4:
+        medio = max(range(1, len(arco) - 1), key=lambda i: _distanza2(arco[i], arco[0], arco[lontano]))
+        semplificato = [arco[i] for i in sorted({0, medio, lontano, len(arco) - 1})]
+    return semplificato
+
+
+def _estensione(arco) -> float:
+    xs, ys = [p[0] for p in arco], [p[1] for p in arco]
+    return max(max(xs) - min(xs), max(ys) - min(ys))
+
+
+def costruisci_livello(topo, bbox, tolleranza, passi) -> dict:
+    """
+    Documento TopoJSON di un livello. Si scartano le isole e le enclave più piccole
+    della tolleranza e gli anelli ridotti a meno di tre punti distinti dalla
+    semplificazione (mai l'ultimo poligono di una regione).
+    """
+    x0, y0, x1, y1 = bbox
+    kx, ky = (x1 - x0) / (passi - 1), (y1 - y0) / (passi - 1)
+
+    quantizzati = []
+    for arco in topo["archi"]:
+        punti = []
+        for x, y in semplifica_arco(arco, tolleranza):
+            punto = (round((x - x0) / kx), round((y - y0) / ky))
+            if not punti or punto != punti[-1]:
+                punti.append(punto)
+        quantizzati.append(punti if len(punti) > 1 else punti * 2)
+
+    def scartato(anello):
+        originale = topo["archi"][_indice(anello[0])]
+        if len(anello) == 1 and originale[0] == originale[-1] and _estensione(originale) < tolleranza:
+            return True
+        return len({p for i in anello for p in quantizzati[_indice(i)]}) < 3
+
+    geometrie, usati = [], {}
+    for proprieta, poligoni in topo["oggetti"]:
+        tenuti = [[a for a in p if not scartato(a)] for p in poligoni if not scartato(p[0])]
+        if not tenuti:
+            tenuti = [max(poligoni, key=lambda p: _estensione(topo["archi"][_indice(p[0][0])]))]
+        rinumera = [[[_rinumera(i, usati) for i in anello] for anello in poligono] for poligono in tenuti]
+        if len(rinumera) == 1:
+            geometrie.append({"type": "Polygon", "arcs": rinumera[0], "properties": proprieta})
+        else:
+            geometrie.append({"type": "MultiPolygon", "arcs": rinumera, "properties": proprieta})
+
+    archi = []
+    for originale in sorted(usati, key=usati.get):
+        punti = quantizzati[originale]
+        archi.append([list(punti[0])] + [[b[0] - a[0], b[1] - a[1]] for a, b in zip(punti, punti[1:])])
+
+    return {
+        "type": "Topology",
+        "bbox": list(bbox),
+        "transform": {"scale": [kx, ky], "translate": [x0, y0]},
+        "objects": {"regioni": {"type": "GeometryCollection", "geometries": geometrie}},
+        "arcs": archi,
+    }
+
+
+def _indice(i: int) -> int:
+    return ~i if i < 0 else i
+
+
+def _rinumera(i: int, usati: dict) -> int:
+    """Indici d'arco compatti per il livello (gli archi scartati non vengono scritti)."""
+    nuovo = usati.setdefault(_indice(i), len(usati))
+    return ~nuovo if i < 0 else nuovo
+
+
+def costruisci(sorgente: str = SORGENTE, cartella: str = CARTELLA) -> dict:
+    """Scrive un file TopoJSON (più le varianti compresse) per livello; restituisce le dimensioni in byte."""
+    with open(sorgente, encoding="utf-8") as f:
+        geojson = json.load(f)
+    topo = topologia(geojson)
+    os.makedirs(cartella, exist_ok=True)
+    dimensioni = {}
+    for nome, tolleranza, passi, _ in LIVELLI:
+        documento = costruisci_livello(topo, geojson["bbox"], tolleranza, passi)
+        percorso = os.path.join(cartella, f"regioni_{nome}.json")
+        with open(percorso, "w", encoding="utf-8") as f:
+            json.dump(documento, f, ensure_ascii=False, separators=(",", ":"))
+        dimensioni[nome] = {"json": os.path.getsize(percorso), **scrivi_precompressi(percorso)}
+    return dimensioni
+
+
+# ==========================================================
+# LETTURA (usata dalla route)
+# ==========================================================
+
+@lru_cache(maxsize=None)
+def geometria(livello: str):
+    """
+    (varianti, etag) di un livello, letti una volta per processo; None se manca.
+    varianti: {None: JSON, "gzip": ..., "br": ...} secondo i file precompressi presenti.
+    """
+    percorso = os.path.join(CARTELLA, f"regioni_{livello}.json")
+    if not os.path.exists(percorso):
+        return None
+    varianti = leggi_varianti(percorso)
+    return varianti, hashlib.sha256(varianti[None]).hexdigest()[:32]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("comando", choices=["costruisci"])
+    parser.add_argument("--sorgente", default=SORGENTE)
+    parser.add_argument("--cartella", default=CARTELLA)
+    args = parser.parse_args()
+    originale = os.path.getsize(args.sorgente)
+    for nome, dimensioni in costruisci(args.sorgente, args.cartella).items():
+        varianti = "  ".join(f"{codifica} {byte / 1024:.1f} KB" for codifica, byte in dimensioni.items())
+        print(f"{nome:<6} {varianti}  ({originale / dimensioni['json']:.0f}x più piccolo)")
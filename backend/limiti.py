@@ -0,0 +1,256 @@
+"""
+Limitazione delle richieste per client e protezione dal sovraccarico.
+
+- Token bucket per client: ogni
+  richiesta consuma un gettone, i gettoni si ricaricano a LIMITE_RICHIESTE_S al
+  secondo fino a LIMITE_BURST. Senza gettoni si risponde 429 con Retry-After.
+- Tetto globale alle richieste in corso (LIMITE_CONCORRENZA, di default la
+  dimensione del pool di connessioni): oltre, dopo al massimo LIMITE_ATTESA_S
+  di attesa, si risponde 503 con Retry-After. Così uno script che martella
+  /regioni non esaurisce threadpool e pool del DB usati dalla dashboard.
+
+Il client è l'IP; solo le chiavi X-API-Key configurate (LIMITI_CHIAVI, o esenti in
+LIMITI_ESENTI) hanno un bucket proprio. Una chiave qualsiasi non conta: altrimenti
+basterebbe cambiarla a ogni richiesta per avere sempre un bucket pieno.
+
+I limiti si possono ridefinire per prefisso di route con LIMITI_ROTTE, ad esempio
+"/export/=1:5,/regioni=50:100" (richieste al secondo : burst, 0 = nessun limite);
+ogni prefisso ha un bucket separato per client.
+
+I bucket vivono nel processo; con LIMITI_REDIS_URL (e il pacchetto redis, opzionale)
+sono condivisi tra worker e istanze. Se Redis non risponde si torna ai bucket locali.
+Il tetto di concorrenza resta sempre per processo: protegge il pool di questo processo.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from database import POOL_SIZE, POOL_MAX_OVERFLOW
+from metriche import SORGENTI_ESTERNE, richieste_rifiutate
+
+try:
+    import redis.asyncio as redis_async
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    redis_async = None
+
+logger = logging.getLogger("can.limiti")
+
+LIMITE_RICHIESTE_S = float(os.getenv("LIMITE_RICHIESTE_S", "20"))
+LIMITE_BURST = float(os.getenv("LIMITE_BURST", "40"))
+LIMITE_CONCORRENZA = int(os.getenv("LIMITE_CONCORRENZA", str(POOL_SIZE + POOL_MAX_OVERFLOW)))
+LIMITE_ATTESA_S = float(os.getenv("LIMITE_ATTESA_S", "0.5"))
+LIMITI_ROTTE = os.getenv("LIMITI_ROTTE", "")
+LIMITI_ESENTI = {v.strip() for v in os.getenv("LIMITI_ESENTI", "").split(",") if v.strip()}
+LIMITI_CHIAVI = {v.strip() for v in os.getenv("LIMITI_CHIAVI", "").split(",") if v.strip()}
+LIMITI_PROXY = os.getenv("LIMITI_PROXY", "0") == "1"
+LIMITI_REDIS_URL = os.getenv("LIMITI_REDIS_URL")
+LIMITI_MAX_CLIENT = 10_000
+RETRY_SOVRACCARICO_S = 1
+
+# monitoraggio e documentazione: mai limitati
+ESCLUSI = ("/metrics", "/pool", "/cache/statistiche", "/docs", "/redoc", "/openapi.json")
+# connessioni lunghe (SSE): limitate all'apertura, fuori dal tetto di concorrenza
+SENZA_CONCORRENZA = ("/eventi",)
+
+
+def leggi_regole(testo: str = LIMITI_ROTTE) -> list:
+    """[(prefisso, richieste al secondo, burst)] dal più lungo al più corto."""
+    regole = []
+    for voce in testo.split(","):
+        if not voce.strip():
+            continue
+        prefisso, _, valori = voce.strip().partition("=")
+        tasso, _, burst = valori.partition(":")
+        regole.append((prefisso, float(tasso), float(burst or tasso)))
+    return sorted(regole, key=lambda r: len(r[0]), reverse=True)
+
+
+def regola_per(percorso: str, regole: list) -> tuple:
+    """(gruppo, richieste al secondo, burst) della route; gruppo "*" per i limiti predefiniti."""
+    for prefisso, tasso, burst in regole:
+        if percorso.startswith(prefisso):
+            return prefisso, tasso, burst
+    return "*", LIMITE_RICHIESTE_S, LIMITE_BURST
+
+
+def identifica_client(scope) -> tuple:
+    """(chiave del bucket, identità in chiaro per LIMITI_ESENTI); le chiavi non configurate si ignorano."""
+    headers = Headers(scope=scope)
+    api_key = headers.get("x-api-key")
+    if api_key and (api_key in LIMITI_CHIAVI or api_key in LIMITI_ESENTI):
+        return "k:" + hashlib.sha256(api_key.encode()).hexdigest()[:16], api_key
+    ip = None
+    if LIMITI_PROXY:
+        ip = (headers.get("x-forwarded-for") or "").split(",")[0].strip() or None
+    if ip is None:
+        ip = scope["client"][0] if scope.get("client") else "-"
+    return "ip:" + ip, ip
+
+
+# ==========================================================
+# TOKEN BUCKET
+# ==========================================================
+
+class BucketLocali:
+    """Bucket in memoria; il middleware gira sul loop asyncio, quindi senza lock."""
+
+    def __init__(self, max_client: int = LIMITI_MAX_CLIENT):
+        # chiave -> (gettoni, istante dell'ultimo aggiornamento, richieste al secondo, burst)
+        self._secchi = {}
+        self.max_client = max_client
+
+    async def consuma(self, chiave: str, tasso: float, burst: float) -> float:
+        """0 se la richiesta passa, altrimenti i secondi da attendere per un gettone."""
+        adesso = time.monotonic()
+        gettoni, prima, _, _ = self._secchi.get(chiave, (burst, adesso, tasso, burst))
+        gettoni = min(burst, gettoni + (adesso - prima) * tasso)
+        if gettoni >= 1:
+            self._secchi[chiave] = (gettoni - 1, adesso, tasso, burst)
+            attesa = 0.0
+        else:
+            self._secchi[chiave] = (gettoni, adesso, tasso, burst)
+            attesa = (1 - gettoni) / tasso
+        if len(self._secchi) > self.max_client:
+            self._pulisci(adesso)
+        return attesa
+
+    def _pulisci(self, adesso: float):
+        """
+        Toglie i bucket già ricaricati del tutto: ricrearli pieni è equivalente.
+        Ognuno con il proprio tasso e burst (i gruppi di LIMITI_ROTTE sono diversi).
+        """
+        pieni = [k for k, (g, t, tasso, burst) in self._secchi.items() if g + (adesso - t) * tasso >= burst]
+        for chiave in pieni:
+            del self._secchi[chiave]
+
+
+# Script Lua: lettura, ricarica e consumo atomici sul server Redis
+_SCRIPT_BUCKET = """
+local tasso, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local ora = redis.call('TIME')
+local adesso = tonumber(ora[1]) + tonumber(ora[2]) / 1000000
+local stato = redis.call('HMGET', KEYS[1], 'g', 't')
+local gettoni = tonumber(stato[1]) or burst
+local prima = tonumber(stato[2]) or adesso
+gettoni = math.min(burst, gettoni + (adesso - prima) * tasso)
+local attesa = 0
+if gettoni >= 1 then gettoni = gettoni - 1 else attesa = (1 - gettoni) / tasso end
+redis.call('HSET', KEYS[1], 'g', gettoni, 't', adesso)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / tasso * 1000) + 1000)
+return tostring(attesa)
+"""
+
+
+class BucketRedis:
+    """Bucket condivisi su Redis; in caso di errore decide il bucket locale di riserva."""
+
+    def __init__(self, url: str, riserva: BucketLocali):
+        self._client = redis_async.from_url(url)
+        self._script = self._client.register_script(_SCRIPT_BUCKET)
+        self._riserva = riserva
+
+    async def consuma(self, chiave: str, tasso: float, burst: float) -> float:
+        try:
+            return float(await self._script(keys=["can:limiti:" + chiave], args=[tasso, burst]))
+        except Exception:
+            logger.warning("Redis non disponibile per i limiti: uso i bucket locali", exc_info=True)
+            return await self._riserva.consuma(chiave, tasso, burst)
+
+
+def crea_bucket(url: str = LIMITI_REDIS_URL):
+    locali = BucketLocali()
+    if not url:
+        return locali
+    if redis_async is None:
+        logger.warning("LIMITI_REDIS_URL impostato ma il pacchetto redis non è installato: bucket locali")
+        return locali
+    return BucketRedis(url, locali)
+
+
+# ==========================================================
+# MIDDLEWARE
+# ==========================================================
+
+class LimitiMiddleware:
+    """
+    Applica il token bucket del client e il tetto di concorrenza prima che la
+    richiesta entri nelle route (e quindi prima di occupare thread e connessioni).
+    """
+
+    def __init__(self, app, concorrenza: int = LIMITE_CONCORRENZA, attesa_s: float = LIMITE_ATTESA_S,
+                 regole: list = None, bucket=None):
+        self.app = app
+        self.concorrenza = concorrenza
+        self.attesa_s = attesa_s
+        self.regole = leggi_regole() if regole is None else regole
+        self.bucket = bucket if bucket is not None else crea_bucket()
+        self.in_corso = 0
+        self._semaforo = None
+        # una sola sorgente per processo: un'app ricostruita (es. nei test) sostituisce la precedente
+        SORGENTI_ESTERNE[:] = [s for s in SORGENTI_ESTERNE if getattr(s, "__func__", None) is not LimitiMiddleware.righe_prometheus]
+        SORGENTI_ESTERNE.append(self.righe_prometheus)
+
+    async def __call__(self, scope, receive, send):
+        percorso = scope.get("path", "")
+        if scope["type"] != "http" or percorso.startswith(ESCLUSI):
+            await self.app(scope, receive, send)
+            return
+
+        gruppo, tasso, burst = regola_per(percorso, self.regole)
+        chiave, identita = identifica_client(scope)
+        if tasso > 0 and identita not in LIMITI_ESENTI:
+            attesa = await self.bucket.consuma(f"{gruppo}|{chiave}", tasso, burst)
+            if attesa > 0:
+                richieste_rifiutate.incrementa(motivo="limite", gruppo=gruppo)
+                await self._rifiuta(scope, receive, send, 429, "Troppe richieste", attesa)
+                return
+
+        if self.concorrenza <= 0 or percorso.startswith(SENZA_CONCORRENZA):
+            await self.app(scope, receive, send)
+            return
+
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.concorrenza)
+        if not await self._occupa_posto():
+            richieste_rifiutate.incrementa(motivo="sovraccarico", gruppo=gruppo)
+            await self._rifiuta(scope, receive, send, 503, "Servizio sovraccarico, riprovare", RETRY_SOVRACCARICO_S)
+            return
+        self.in_corso += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_corso -= 1
+            self._semaforo.release()
+
+    async def _occupa_posto(self) -> bool:
+        """Un posto tra le richieste in corso, attendendo al massimo attesa_s secondi."""
+        if not self._semaforo.locked():
+            await self._semaforo.acquire()      # posto libero: non sospende
+            return True
+        if self.attesa_s <= 0:
+            return False
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), self.attesa_s)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @staticmethod
+    async def _rifiuta(scope, receive, send, status: int, messaggio: str, attesa: float):
+        secondi = max(1, math.ceil(attesa))
+        risposta = JSONResponse({"detail": messaggio}, status_code=status, headers={"Retry-After": str(secondi)})
+        await risposta(scope, receive, send)
+
+    def righe_prometheus(self):
+        return [
+            "# TYPE can_http_requests_in_progress gauge",
+            f"can_http_requests_in_progress {self.in_corso}",
+            "# TYPE can_http_concurrency_limit gauge",
+            f"can_http_concurrency_limit {self.concorrenza}",
+        ]
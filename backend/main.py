@@ -6,30 +6,78 @@ Autori: Team CAN - Carlotta Forlino, Andrea Calabrò e Nicolò Giraudo
 Versione: 1.0.0
 """
 
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-import models
-from database import engine
+from database import ASYNC_DB
+from compressione import CompressioneMiddleware
+from limiti import LimitiMiddleware
+from middleware import ETagMiddleware, MetricheMiddleware, ProfilerMiddleware
 from routes import router as regioni_router
+from schema_db import avvio as avvio_schema
+from services import ClassificaService, ricalcolo_classifiche
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Lo schema non si crea più all'import: di default solo verifica dell'impronta
+    # (una SELECT). Creazione esplicita con `python schema_db.py crea`.
+    avvio_schema(os.getenv("SCHEMA_AVVIO", "verifica"))
+    # classifiche mai calcolate: ricalcolo in background, non dentro la prima GET
+    ClassificaService.inizializza()
+    yield
+    ricalcolo_classifiche.attendi(timeout=10)
 
-# Creazione delle tabelle
-models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="CAN API",
     description="API CRUD per gestire dati energetici delle regioni",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
+# GET condizionali (ETag / Last-Modified) guidati dalla versione dei dati.
+# Registrato prima di CORS così anche le risposte 304 ricevono gli header CORS.
+app.add_middleware(ETagMiddleware)
+
+# Compressione gzip/brotli secondo Accept-Encoding. Esterna all'ETag, così
+# anche le risposte appena marcate con l'ETag vengono compresse.
+app.add_middleware(CompressioneMiddleware)
+
+# Limite di richieste per client (429) e tetto alle richieste in corso (503),
+# prima di route, threadpool e pool del DB. Interno alle metriche: i rifiuti
+# compaiono nelle durate con il loro status.
+app.add_middleware(LimitiMiddleware)
+
+# Durata delle richieste e query SQL per richiesta (esposte su /metrics).
+# Più esterno dell'ETag: conta anche le risposte 304.
+app.add_middleware(MetricheMiddleware)
+
 # Abilita CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Livello-Dettaglio", "Retry-After"],
 )
 
+# Profiler per singola richiesta (header X-Profilo). Registrato per ultimo,
+# quindi è il più esterno e misura anche CORS e gli altri middleware.
+if os.getenv("PROFILER_TOKEN"):
+    app.add_middleware(
+        ProfilerMiddleware,
+        token=os.getenv("PROFILER_TOKEN"),
+        cartella=os.getenv("PROFILER_DIR", "/tmp/can_profili"),
+        intervallo_s=float(os.getenv("PROFILER_INTERVALLO_MS", "1")) / 1000,
+    )
+
 # Includi router
+if ASYNC_DB:
+    # rotte async prima: hanno la precedenza su quelle sincrone con lo stesso path
+    from routes_async import router as regioni_async_router
+    app.include_router(regioni_async_router)
 app.include_router(regioni_router)         # API dati regionali
 
 #test per verificare che l'API sia attiva
@@ -0,0 +1,167 @@
+"""
+Metriche dell'applicazione in formato Prometheus (endpoint /metrics).
+
+Strumenta il motore SQLAlchemy con gli eventi before/after_cursor_execute:
+latenza per istruzione, righe restituite/modificate e numero di query per
+richiesta, con etichetta della route che le ha generate. Le query più lente
+di SLOW_QUERY_MS millisecondi vengono scritte nel log "can.sql".
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from sqlalchemy import event
+
+logger = logging.getLogger("can.sql")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+BUCKET_SECONDI = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKET_QUERY = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+# richiesta HTTP in corso: scope ASGI e numero di query eseguite
+richiesta_corrente = contextvars.ContextVar("richiesta_corrente", default=None)
+
+
+def _escape(valore) -> str:
+    return str(valore).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etichette(coppie) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in coppie)
+
+
+class Contatore:
+    tipo = "counter"
+
+    def __init__(self, nome: str, descrizione: str):
+        self.nome = nome
+        self.descrizione = descrizione
+        self._valori = {}
+        self._lock = threading.Lock()
+
+    def incrementa(self, valore: float = 1, **etichette):
+        chiave = tuple(sorted(etichette.items()))
+        with self._lock:
+            self._valori[chiave] = self._valori.get(chiave, 0) + valore
+
+    def righe(self):
+        with self._lock:
+            valori = dict(self._valori)
+        for chiave, valore in sorted(valori.items()):
+            yield f"{self.nome}{{{_etichette(chiave)}}} {valore}"
+
+
+class Istogramma:
+    tipo = "histogram"
+
+    def __init__(self, nome: str, descrizione: str, bucket=BUCKET_SECONDI):
+        self.nome = nome
+        self.descrizione = descrizione
+        self.bucket = bucket
+        self._serie = {}   # etichette -> [conteggi per bucket, somma, totale]
+        self._lock = threading.Lock()
+
+    def osserva(self, valore: float, **etichette):
+        chiave = tuple(sorted(etichette.items()))
+        with self._lock:
+            serie = self._serie.get(chiave)
+            if serie is None:
+                serie = self._serie[chiave] = [[0] * len(self.bucket), 0.0, 0]
+            for i, limite in enumerate(self.bucket):
+                if valore <= limite:
+                    serie[0][i] += 1
+            serie[1] += valore
+            serie[2] += 1
+
+    def righe(self):
+        with self._lock:
+            copia = {k: (list(v[0]), v[1], v[2]) for k, v in self._serie.items()}
+        for chiave, (conteggi, somma, totale) in sorted(copia.items()):
+            for limite, n in zip(self.bucket, conteggi):
+                yield f"{self.nome}_bucket{{{_etichette(chiave + (('le', limite),))}}} {n}"
+            yield f"{self.nome}_bucket{{{_etichette(chiave + (('le', '+Inf'),))}}} {totale}"
+            yield f"{self.nome}_sum{{{_etichette(chiave)}}} {somma}"
+            yield f"{self.nome}_count{{{_etichette(chiave)}}} {totale}"
+
+
+durata_query = Istogramma("can_db_query_seconds", "Durata delle istruzioni SQL")
+righe_query = Contatore("can_db_rows_total", "Righe restituite o modificate dalle istruzioni SQL")
+query_lente = Contatore("can_db_slow_queries_total", f"Istruzioni SQL oltre {SLOW_QUERY_MS:g} ms")
+query_per_richiesta = Istogramma("can_db_queries_per_request", "Istruzioni SQL eseguite per richiesta HTTP", BUCKET_QUERY)
+durata_richieste = Istogramma("can_http_request_seconds", "Durata delle richieste HTTP")
+attesa_pool = Istogramma("can_db_pool_wait_seconds", "Attesa per ottenere una connessione dal pool")
+timeout_pool = Contatore("can_db_pool_timeouts_total", "Checkout falliti per timeout del pool")
+richieste_rifiutate = Contatore("can_http_rejected_total", "Richieste respinte con 429 (limite del client) o 503 (sovraccarico)")
+ricalcoli_classifiche = Contatore("can_rankings_recomputes_total", "Ricalcoli delle classifiche in background per esito")
+
+METRICHE = [durata_query, righe_query, query_lente, query_per_richiesta, durata_richieste, attesa_pool, timeout_pool,
+            richieste_rifiutate, ricalcoli_classifiche]
+
+# funzioni che restituiscono righe aggiuntive (es. statistiche della cache)
+SORGENTI_ESTERNE = []
+
+
+def route_corrente() -> str:
+    """
+    Template della route della richiesta in corso ("-" fuori da una richiesta HTTP).
+    Mai il path effettivo: prima dell'instradamento (o senza route) vale
+    "non_instradata", altrimenti ogni URL diverso creerebbe una serie nuova.
+    """
+    stato = richiesta_corrente.get()
+    if stato is None:
+        return "-"
+    return getattr(stato["scope"].get("route"), "path", "non_instradata")
+
+
+def _operazione(statement: str) -> str:
+    parola = statement.lstrip().split(None, 1)
+    return parola[0].upper() if parola else "-"
+
+
+def _prima_della_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("can_inizio_query", []).append(time.perf_counter())
+
+
+def _dopo_la_query(conn, cursor, statement, parameters, context, executemany):
+    durata = time.perf_counter() - conn.info["can_inizio_query"].pop()
+    route = route_corrente()
+    operazione = _operazione(statement)
+
+    durata_query.osserva(durata, operazione=operazione, route=route)
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        righe_query.incrementa(cursor.rowcount, operazione=operazione, route=route)
+    stato = richiesta_corrente.get()
+    if stato is not None:
+        stato["query"] += 1
+    if durata * 1000 >= SLOW_QUERY_MS:
+        query_lente.incrementa(operazione=operazione, route=route)
+        logger.warning("Query lenta (%.1f ms) su %s: %s", durata * 1000, route, " ".join(statement.split())[:1000])
+
+
+def _query_fallita(contesto):
+    """La query non arriva ad after_cursor_execute: si toglie il suo istante di inizio."""
+    conn = contesto.connection
+    if conn is not None and conn.info.get("can_inizio_query"):
+        conn.info["can_inizio_query"].pop()
+
+
+def strumenta_engine(engine):
+    """Collega gli eventi di misura a un Engine sincrono (per quelli async: engine.sync_engine)."""
+    event.listen(engine, "before_cursor_execute", _prima_della_query)
+    event.listen(engine, "after_cursor_execute", _dopo_la_query)
+    event.listen(engine, "handle_error", _query_fallita)
+
+
+def esporta() -> str:
+    """Tutte le metriche nel formato testuale di Prometheus (version 0.0.4)."""
+    righe = []
+    for metrica in METRICHE:
+        righe.append(f"# HELP {metrica.nome} {metrica.descrizione}")
+        righe.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+        righe.extend(metrica.righe())
+    for sorgente in SORGENTI_ESTERNE:
+        righe.extend(sorgente())
+    return "\n".join(righe) + "\n"
@@ -0,0 +1,261 @@
+"""
+Middleware ASGI dell'applicazione.
+Vengono registrati in main.py con app.add_middleware().
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+import time
+from urllib.parse import parse_qs
+from email.utils import formatdate, parsedate_to_datetime
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from cache import cache_risultati
+from database import engine
+from models import SequenzaRegistro
+from versione import versione_dati
+from formati import formato_tabellare
+from metriche import richiesta_corrente, durata_richieste, query_per_richiesta
+from profilatore import Campionatore, salva_profilo
+
+# endpoint che non dipendono dalla versione dei dati: mai ETag né 304
+SENZA_ETAG = ("/metrics", "/pool", "/cache/", "/docs", "/redoc", "/openapi.json", "/geometrie/", "/eventi", "/changes")
+
+logger = logging.getLogger("can.etag")
+
+ETAG_VERIFICA_S = float(os.getenv("ETAG_VERIFICA_S", "1"))
+
+
+class VersioneCondivisa:
+    """
+    Versione dei dati comune a tutti i worker: il contatore di sequenza_registro,
+    incrementato nella stessa transazione di ogni scrittura registrata.
+
+    Il contatore di versione.py è per processo e non basta per l'ETag: con più
+    worker, o dopo una scrittura fatta da un altro processo, darebbe 304 su dati
+    vecchi. Il valore si rilegge dal primario al massimo ogni ETAG_VERIFICA_S
+    secondi, e subito dopo una scrittura fatta da questo processo; se è cambiato
+    senza scritture locali si svuota anche la cache delle letture del processo.
+    """
+
+    def __init__(self, intervallo: float = ETAG_VERIFICA_S):
+        self.intervallo = intervallo
+        self.valore = None
+        self.ultima_modifica = time.time()
+        self._letto = float("-inf")
+        self._locale = None
+        self._lettura = None      # task della rilettura in corso (una per volta)
+
+    async def corrente(self):
+        """Numero di scritture registrate, None se il DB non risponde (niente ETag)."""
+        if versione_dati.corrente() == self._locale and time.monotonic() - self._letto < self.intervallo:
+            return self.valore
+        # richieste concorrenti attendono la stessa rilettura (single-flight)
+        lettura = self._lettura
+        if lettura is None or lettura.done() or lettura.get_loop() is not asyncio.get_running_loop():
+            lettura = self._lettura = asyncio.ensure_future(self._rileggi())
+        return await asyncio.shield(lettura)
+
+    async def _rileggi(self):
+        # fuori dalla richiesta che l'ha avviata: la query non entra nelle sue metriche
+        # (query per richiesta, etichetta route)
+        richiesta_corrente.set(None)
+        locale_prima, locale = self._locale, versione_dati.corrente()
+        valore = await run_in_threadpool(self._leggi)
+        self._letto, self._locale = time.monotonic(), locale
+        if valore != self.valore:
+            if None not in (valore, self.valore) and locale == locale_prima:
+                # scrittura di un altro processo: la cache locale non è stata invalidata
+                cache_risultati.svuota()
+            self.valore = valore
+            self.ultima_modifica = time.time()
+        return self.valore
+
+    @staticmethod
+    def _leggi():
+        try:
+            with engine.connect() as conn:
+                query = select(SequenzaRegistro.scritture).where(SequenzaRegistro.id == 1)
+                return conn.execute(query).scalar() or 0
+        except SQLAlchemyError:
+            logger.warning("Versione dei dati non leggibile: risposte senza ETag", exc_info=True)
+            return None
+
+
+versione_condivisa = VersioneCondivisa()
+
+
+def etag_corrente(versione: int, variante: str = None) -> str:
+    """ETag forte; la variante distingue le rappresentazioni tabellari (Arrow/Parquet) dal JSON."""
+    etag = f"v{versione}"
+    return f'"{etag}-{variante}"' if variante else f'"{etag}"'
+
+
+def _etag_corrisponde(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidati = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidati
+
+
+def _non_modificato_dal(if_modified_since: str, ultima_modifica: float) -> bool:
+    try:
+        return int(ultima_modifica) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+class ETagMiddleware:
+    """
+    GET condizionali basati sulla versione dei dati condivisa (VersioneCondivisa).
+
+    Ogni risposta 200 a una GET riceve ETag e Last-Modified; se il client manda
+    If-None-Match (o If-Modified-Since) ancora valido si risponde subito 304,
+    senza entrare nelle route e quindi senza aprire sessioni sul DB.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or scope["path"].startswith(SENZA_ETAG)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        versione = await versione_condivisa.corrente()
+        if versione is None:
+            await self.app(scope, receive, send)
+            return
+
+        richiesta = Headers(scope=scope)
+        etag = etag_corrente(versione, formato_tabellare(richiesta.get("accept")))
+        ultima_modifica = versione_condivisa.ultima_modifica
+        last_modified = formatdate(ultima_modifica, usegmt=True)
+
+        if_none_match = richiesta.get("if-none-match")
+        if_modified_since = richiesta.get("if-modified-since")
+        if if_none_match is not None:
+            non_modificato = _etag_corrisponde(if_none_match, etag)
+        else:
+            non_modificato = if_modified_since is not None and _non_modificato_dal(if_modified_since, ultima_modifica)
+
+        if non_modificato:
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [
+                    (b"etag", etag.encode()),
+                    (b"last-modified", last_modified.encode()),
+                    (b"cache-control", b"no-cache"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_con_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(raw=message["headers"])
+                stato = richiesta_corrente.get()
+                if stato is not None and stato.get("replica"):
+                    # letta da una replica forse in ritardo: niente validatore della versione attuale
+                    headers.setdefault("Cache-Control", "no-cache")
+                elif "etag" not in headers:
+                    headers["ETag"] = etag
+                    headers["Last-Modified"] = last_modified
+                    headers.setdefault("Cache-Control", "no-cache")
+                    headers.setdefault("Vary", "Accept")
+            await send(message)
+
+        await self.app(scope, receive, send_con_etag)
+
+
+class MetricheMiddleware:
+    """
+    Misura la durata di ogni richiesta e conta le query SQL che ha eseguito.
+    Le etichette usano il template della route (es. /regioni/{regione_id}),
+    non il path effettivo, per non moltiplicare le serie.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stato = {"scope": scope, "query": 0, "status": 500}
+        token = richiesta_corrente.set(stato)
+        inizio = time.perf_counter()
+
+        async def send_con_stato(message):
+            if message["type"] == "http.response.start":
+                stato["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_stato)
+        finally:
+            route = getattr(scope.get("route"), "path", "non_trovata")
+            durata_richieste.osserva(
+                time.perf_counter() - inizio,
+                route=route, metodo=scope["method"], status=stato["status"],
+            )
+            query_per_richiesta.osserva(stato["query"], route=route)
+            richiesta_corrente.reset(token)
+
+
+class ProfilerMiddleware:
+    """
+    Profilo a campionamento di una singola richiesta, su richiesta esplicita:
+    header "X-Profilo: <token>" oppure parametro "?profilo=<token>", con il token
+    di PROFILER_TOKEN. Il profilo (formato folded, pronto per un flame graph) viene
+    salvato in PROFILER_DIR e il nome del file restituito nell'header X-Profilo-File.
+
+    Il middleware è registrato solo se PROFILER_TOKEN è impostato: da spento non costa nulla.
+    """
+
+    def __init__(self, app, token: str, cartella: str, intervallo_s: float = 0.001):
+        self.app = app
+        self.token = token.encode()
+        self.cartella = cartella
+        self.intervallo_s = intervallo_s
+
+    def _autorizzata(self, scope) -> bool:
+        richiesto = Headers(scope=scope).get("x-profilo")
+        if richiesto is None and b"profilo=" in scope.get("query_string", b""):
+            richiesto = parse_qs(scope["query_string"].decode()).get("profilo", [None])[0]
+        return richiesto is not None and hmac.compare_digest(richiesto.encode(), self.token)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._autorizzata(scope):
+            await self.app(scope, receive, send)
+            return
+
+        campionatore = Campionatore(self.intervallo_s).avvia()
+        nome_file = None
+
+        async def send_con_profilo(message):
+            nonlocal nome_file
+            if message["type"] == "http.response.start":
+                # il profilo copre tutto fino all'invio degli header della risposta
+                campionatore.ferma()
+                nome_file = salva_profilo(campionatore, self.cartella, scope["method"], scope["path"])
+                headers = MutableHeaders(raw=message["headers"])
+                headers["X-Profilo-File"] = nome_file
+                headers["X-Profilo-Campioni"] = str(campionatore.campioni)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_profilo)
+        finally:
+            if nome_file is None:
+                campionatore.ferma()
@@ -3,12 +3,22 @@ Modelli SQLAlchemy che rappresentano le tabelle del database.
 Ogni classe = una tabella con le sue colonne.
 """
 #modellazione del DB e creazione tabelle
-from sqlalchemy import Engine, create_engine, Column, Integer, String, Numeric, ForeignKey, Text, CheckConstraint
+from sqlalchemy import Engine, create_engine, Column, Integer, BigInteger, SmallInteger, String, Numeric, Float, ForeignKey, Text, CheckConstraint, Index, DateTime
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 from database import Base, engine
+from datetime import datetime
 
 REGIONI_ID_FK = "regioni.id_regione"
 
+
+def indice_anno(tabella: str, *misure: str) -> Index:
+    """
+    Indice coprente (anno, id_regione, misure...): i filtri per anno o intervallo
+    di anni si risolvono leggendo solo l'indice, senza accedere alle righe.
+    La chiave primaria (id_regione, anno) copre invece le letture per regione.
+    """
+    return Index(f"ix_{tabella}_anno", "anno", "id_regione", *misure)
+
 # Regioni
 
 class Regioni(Base):
@@ -21,12 +31,17 @@ class Regioni(Base):
 
     # relazioni 1:1
     morfologia = relationship("MorfologiaSuolo", back_populates="regione", uselist=False)
-    emissioni_totali = relationship("EmissioniTotali", back_populates="regione", uselist=False)
-    edifici = relationship("Edifici", back_populates="regione", uselist=False)
-    industria = relationship("Industria", back_populates="regione", uselist=False)
-    mix = relationship("MixEnergetico", back_populates="regione", uselist=False)
     assorbimenti = relationship("Assorbimenti", back_populates="regione", uselist=False)
-    azioni = relationship("Azioni", back_populates="regione", uselist=False)
+
+    # relazioni 1:N, una riga per anno (la più recente per prima)
+    emissioni_totali = relationship("EmissioniTotali", back_populates="regione", order_by="desc(EmissioniTotali.anno)")
+    edifici = relationship("Edifici", back_populates="regione", order_by="desc(Edifici.anno)")
+    industria = relationship("Industria", back_populates="regione", order_by="desc(Industria.anno)")
+    mix = relationship("MixEnergetico", back_populates="regione", order_by="desc(MixEnergetico.anno)")
+    azioni = relationship("Azioni", back_populates="regione", order_by="desc(Azioni.anno)")
+
+    # gerarchia territoriale: regione -> province -> comuni
+    province = relationship("Province", back_populates="regione")
 
 
 # Morfologia suolo
@@ -50,15 +65,21 @@ class EmissioniTotali(Base):
     __tablename__ = "emissioni_totali"
 
     id_regione = Column(Integer, ForeignKey(REGIONI_ID_FK), primary_key=True)
+    anno = Column(SmallInteger, primary_key=True)
     co2eq_mln_t = Column(Numeric(12,3))  # milioni di tonnellate CO2eq
 
     regione = relationship("Regioni", back_populates="emissioni_totali")
 
+    __table_args__ = (
+        indice_anno("emissioni_totali", "co2eq_mln_t"),
+    )
+
 # Edifici
 class Edifici(Base):
     __tablename__ = "edifici"
 
     id_regione = Column(Integer, ForeignKey(REGIONI_ID_FK), primary_key=True)
+    anno = Column(SmallInteger, primary_key=True)
     consumo_medio_kwh_m2y = Column(Numeric(12,2))
     emissioni_procapite_tco2_ab = Column(Numeric(12,3))
     quota_elettrico_pct = Column(Numeric(5,2))
@@ -66,21 +87,31 @@ class Edifici(Base):
 
     regione = relationship("Regioni", back_populates="edifici")
 
+    __table_args__ = (
+        indice_anno("edifici", "consumo_medio_kwh_m2y", "emissioni_procapite_tco2_ab", "quota_elettrico_pct", "quota_ape_classe_a_pct"),
+    )
+
 # Industria
 class Industria(Base):
     __tablename__ = "industria"
 
     id_regione = Column(Integer, ForeignKey(REGIONI_ID_FK), primary_key=True)
+    anno = Column(SmallInteger, primary_key=True)
     emissioni_per_valore_aggiunto_tco2_per_mln_eur = Column(Numeric(12,4))
     quota_elettrico_pct = Column(Numeric(5,2))
 
     regione = relationship("Regioni", back_populates="industria")
 
+    __table_args__ = (
+        indice_anno("industria", "emissioni_per_valore_aggiunto_tco2_per_mln_eur", "quota_elettrico_pct"),
+    )
+
 # Mix energetico
 class MixEnergetico(Base):
     __tablename__ = "mix_energetico"
 
     id_regione = Column(Integer, ForeignKey(REGIONI_ID_FK), primary_key=True)
+    anno = Column(SmallInteger, primary_key=True)
     carbone_pct = Column(Numeric(5,2))
     petrolio_pct = Column(Numeric(5,2))
     gas_pct = Column(Numeric(5,2))
@@ -94,6 +125,7 @@ class MixEnergetico(Base):
             "(carbone_pct + petrolio_pct + gas_pct + rinnovabili_pct) BETWEEN 99.0 AND 101.0",
             name="chk_mix_somma_~100"
         ),
+        indice_anno("mix_energetico", "carbone_pct", "petrolio_pct", "gas_pct", "rinnovabili_pct"),
     )
 
 # Assorbimenti
@@ -111,6 +143,7 @@ class Azioni(Base):
     __tablename__ = "azioni"
 
     id_regione = Column(Integer, ForeignKey(REGIONI_ID_FK), primary_key=True)
+    anno = Column(SmallInteger, primary_key=True)
     fotovoltaico_capacita_gw = Column(Numeric(10,3))
     quota_produzione_fer_pct = Column(Numeric(5,2))
     quota_auto_elettriche_pct = Column(Numeric(5,2))
@@ -118,5 +151,100 @@ class Azioni(Base):
 
     regione = relationship("Regioni", back_populates="azioni")
 
-#Creazione tabelle 
-Base.metadata.create_all(engine)
\ No newline at end of file
+    __table_args__ = (
+        indice_anno("azioni", "fotovoltaico_capacita_gw", "quota_produzione_fer_pct", "quota_auto_elettriche_pct", "risparmi_energetici_mtep_mln"),
+    )
+
+
+# Province (codice ISTAT)
+class Province(Base):
+    __tablename__ = "province"
+
+    id_provincia = Column(Integer, primary_key=True, autoincrement=False)
+    id_regione = Column(Integer, ForeignKey(REGIONI_ID_FK), nullable=False)
+    sigla = Column(String(2), unique=True, nullable=False)
+    nome = Column(String(80), nullable=False)
+
+    regione = relationship("Regioni", back_populates="province")
+    comuni = relationship("Comuni", back_populates="provincia")
+
+    __table_args__ = (
+        Index("ix_province_regione", "id_regione", "id_provincia"),
+    )
+
+# Comuni (codice ISTAT)
+class Comuni(Base):
+    __tablename__ = "comuni"
+
+    id_comune = Column(Integer, primary_key=True, autoincrement=False)
+    id_provincia = Column(Integer, ForeignKey("province.id_provincia"), nullable=False)
+    id_regione = Column(Integer, ForeignKey(REGIONI_ID_FK), nullable=False)  # copiato dalla provincia
+    nome = Column(String(120), nullable=False)
+    popolazione = Column(Integer)
+    superficie_kmq = Column(Numeric(10,2))
+    co2eq_t = Column(Numeric(14,2))  # tonnellate CO2eq
+
+    provincia = relationship("Province", back_populates="comuni")
+
+    __table_args__ = (
+        # drill-down paginato per provincia o per regione senza ordinamenti
+        Index("ix_comuni_provincia", "id_provincia", "id_comune"),
+        Index("ix_comuni_regione", "id_regione", "id_comune"),
+    )
+
+# Aggregati dei comuni per provincia, regione e nazione (id_territorio = 0),
+# aggiornati in modo incrementale a ogni scrittura sui comuni
+class AggregatiTerritorio(Base):
+    __tablename__ = "aggregati_territorio"
+
+    livello = Column(String(10), primary_key=True)  # provincia | regione | nazione
+    id_territorio = Column(Integer, primary_key=True, autoincrement=False)
+    n_comuni = Column(Integer, nullable=False, default=0)
+    popolazione = Column(BigInteger, nullable=False, default=0)
+    superficie_kmq = Column(Numeric(14,2), nullable=False, default=0)
+    co2eq_t = Column(Numeric(18,2), nullable=False, default=0)
+
+
+# Classifiche materializzate: per ogni indicatore numerico (ultimo anno) posizione,
+# percentile e z-score di ogni regione, ricalcolati quando cambiano i dati.
+# Tabella derivata: niente chiave esterna, si ricostruisce dalle tabelle sorgente.
+class Classifiche(Base):
+    __tablename__ = "classifiche"
+
+    indicatore = Column(String(80), primary_key=True)
+    id_regione = Column(Integer, primary_key=True, autoincrement=False)
+    valore = Column(Float, nullable=False)
+    posizione = Column(Integer, nullable=False)    # 1 = valore più alto
+    percentile = Column(Float, nullable=False)     # % di regioni con valore <= a questo
+    z_score = Column(Float)                        # None se tutti i valori coincidono
+
+    __table_args__ = (
+        Index("ix_classifiche_posizione", "indicatore", "posizione", "id_regione"),
+    )
+
+
+# Registro delle modifiche (change log) per la sincronizzazione incrementale dei client:
+# una riga per ogni chiave inserita, aggiornata o eliminata, scritta nella stessa
+# transazione della modifica. L'id è la versione durevole restituita da /changes.
+class RegistroModifiche(Base):
+    __tablename__ = "registro_modifiche"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    tabella = Column(String(30), nullable=False)      # nome dell'endpoint (emissioni, comuni, ...)
+    chiave = Column(String(100))                      # chiave primaria in JSON, None per "reset"
+    operazione = Column(String(10), nullable=False)   # upsert | delete | reset
+    momento = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_registro_modifiche_momento", "momento"),
+    )
+
+
+# Riga unica aggiornata da ogni transazione che scrive nel registro: il suo lock
+# serializza gli scrittori fino al commit, così gli id del registro crescono
+# nell'ordine dei commit e un client non può saltare una modifica arrivata in ritardo.
+class SequenzaRegistro(Base):
+    __tablename__ = "sequenza_registro"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)   # sempre 1
+    scritture = Column(BigInteger, nullable=False, default=0)
@@ -4,6 +4,7 @@ Script per riempire il database con i dati iniziali dalle tabelle CSV.
 
 from requests import Session
 from models import *
+from schema_db import crea_schema, ANNO_BASE
 import pandas as pd
 import os
 
@@ -15,6 +16,12 @@ def csv_path(filename: str) -> str:
     """Restituisce il path assoluto del CSV nella cartella DB"""
     return os.path.join(DB_DIR, filename)
 
+# Lo schema va creato esplicitamente: l'import dei modelli non tocca più il DB
+crea_schema()
+
+# Le tabelle annuali vengono caricate sull'anno di riferimento dei CSV
+ANNO = ANNO_BASE
+
 session = Session()
 
 # Dizionario per la normalizzazione dei nomi delle regioni
@@ -138,9 +145,9 @@ for i, row in df_emiss.iterrows():
     if not record_regione:
         continue
 
-    record_emiss = session.query(EmissioniTotali).filter_by(id_regione=record_regione.id_regione).first()
+    record_emiss = session.query(EmissioniTotali).filter_by(id_regione=record_regione.id_regione, anno=ANNO).first()
     if not record_emiss:
-        record_emiss = EmissioniTotali(id_regione=record_regione.id_regione)
+        record_emiss = EmissioniTotali(id_regione=record_regione.id_regione, anno=ANNO)
         session.add(record_emiss)
 
     record_emiss.co2eq_mln_t = to_float(row["Emissioni (milioni di t CO₂ eq)"])
@@ -157,9 +164,9 @@ for record_regione in session.query(Regioni).all():
     regione_std = record_regione.nome
 
     # Recupera o crea il record edifici
-    record_edifici = session.query(Edifici).filter_by(id_regione=record_regione.id_regione).first()
+    record_edifici = session.query(Edifici).filter_by(id_regione=record_regione.id_regione, anno=ANNO).first()
     if not record_edifici:
-        record_edifici = Edifici(id_regione=record_regione.id_regione)
+        record_edifici = Edifici(id_regione=record_regione.id_regione, anno=ANNO)
         session.add(record_edifici)
 
     # Consumo medio
@@ -196,7 +203,8 @@ for i, row in df_industria.iterrows():
         continue
 
     record = session.query(Industria).filter_by(id_regione=
-        session.query(Regioni.id_regione).filter_by(nome=regione_std).scalar()
+        session.query(Regioni.id_regione).filter_by(nome=regione_std).scalar(),
+        anno=ANNO
     ).first()
 
     if record:
@@ -205,6 +213,7 @@ for i, row in df_industria.iterrows():
     else:
         nuova_industria = Industria(
             id_regione=session.query(Regioni.id_regione).filter_by(nome=regione_std).scalar(),
+            anno=ANNO,
             emissioni_per_valore_aggiunto_tco2_per_mln_eur=to_float(row["Emissioni (tCO₂eq/€ mln)"]),
             quota_elettrico_pct=to_float(row[QUOTA])
         )
@@ -222,9 +231,9 @@ for i, row in df_mix.iterrows():
     if not id_regione:
         continue
 
-    record = session.query(MixEnergetico).filter_by(id_regione=id_regione).first()
+    record = session.query(MixEnergetico).filter_by(id_regione=id_regione, anno=ANNO).first()
     if not record:
-        record = MixEnergetico(id_regione=id_regione)
+        record = MixEnergetico(id_regione=id_regione, anno=ANNO)
         session.add(record)
 
     record.carbone_pct = to_float(row["Carbone"])
@@ -298,9 +307,9 @@ for nome in REGIONI_STANDARD.values():
     if not record_reg:
         continue
 
-    record = session.query(Azioni).filter_by(id_regione=record_reg.id_regione).first()
+    record = session.query(Azioni).filter_by(id_regione=record_reg.id_regione, anno=ANNO).first()
     if not record:
-        record = Azioni(id_regione=record_reg.id_regione)
+        record = Azioni(id_regione=record_reg.id_regione, anno=ANNO)
         session.add(record)
 
     record.fotovoltaico_capacita_gw = fotovoltaico_map.get(nome)
@@ -308,6 +317,14 @@ for nome in REGIONI_STANDARD.values():
     record.quota_auto_elettriche_pct = auto_map.get(nome)
     record.risparmi_energetici_mtep_mln = risparmi_map.get(nome)
 
+# Il caricamento non passa dai servizi: un "reset" per tabella nel registro delle
+# modifiche avvisa i client di /changes e cambia l'ETag servito da tutti i worker
+for tabella in ("regioni", "morfologia", "emissioni", "edifici", "industria", "mix", "assorbimenti", "azioni"):
+    session.add(RegistroModifiche(tabella=tabella, operazione="reset"))
+sequenza = session.get(SequenzaRegistro, 1) or SequenzaRegistro(id=1, scritture=0)
+sequenza.scritture += 1
+session.add(sequenza)
+
 session.commit()
 
 
@@ -0,0 +1,68 @@
+"""
+Profiler a campionamento per singola richiesta (attivato da ProfilerMiddleware).
+
+Un thread legge a intervalli regolari gli stack di tutti i thread del processo
+(sys._current_frames) e li accumula nel formato "folded" (una riga per stack:
+frame;frame;frame conteggio), leggibile da flamegraph.pl, speedscope e simili.
+Vengono campionati sia il thread dell'event loop (routing, middleware, CORS,
+serializzazione) sia i thread del threadpool (get_db, servizi, query).
+Le richieste concorrenti possono comparire nello stesso profilo.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+# funzioni "in attesa": gli stack che finiscono qui sono thread inattivi
+FUNZIONI_INATTIVE = {"wait", "select", "poll", "epoll", "get", "_worker", "sleep", "accept"}
+
+
+def _etichetta(frame) -> str:
+    codice = frame.f_code
+    modulo = os.path.splitext(os.path.basename(codice.co_filename))[0]
+    return f"{modulo}:{codice.co_name}"
+
+
+class Campionatore:
+    def __init__(self, intervallo_s: float = 0.001):
+        self.intervallo_s = intervallo_s
+        self.stack = Counter()
+        self.campioni = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._esegui, name="can-profiler", daemon=True)
+
+    def avvia(self):
+        self._thread.start()
+        return self
+
+    def ferma(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _esegui(self):
+        mio_id = threading.get_ident()
+        while not self._stop.wait(self.intervallo_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == mio_id or frame.f_code.co_name in FUNZIONI_INATTIVE:
+                    continue
+                etichette = []
+                while frame is not None:
+                    etichette.append(_etichetta(frame))
+                    frame = frame.f_back
+                self.stack[";".join(reversed(etichette))] += 1
+            self.campioni += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stack.most_common())
+
+
+def salva_profilo(campionatore: Campionatore, cartella: str, metodo: str, path: str) -> str:
+    """Scrive il profilo in formato folded e restituisce il nome del file."""
+    os.makedirs(cartella, exist_ok=True)
+    nome = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}_{metodo}_{path.strip('/').replace('/', '_') or 'root'}.folded"
+    with open(os.path.join(cartella, nome), "w", encoding="utf-8") as f:
+        f.write(campionatore.folded())
+    return nome
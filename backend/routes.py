@@ -3,11 +3,20 @@ Definisce gli endpoint API (GET, POST, PUT, DELETE).
 Chiama le funzioni di services.py per eseguire la logica.
 """
 
-from fastapi import APIRouter, Depends
+import asyncio
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import schemas
-from database import get_db
+from formati import risposta_json, risposta_tabellare
+from database import get_db, sessione_per, statistiche_pool
+from cache import cache_risultati
+import metriche
+import geometrie
+from eventi import bus_eventi, formatta_sse, EVENTI_PING_S
+from versione import versione_dati
+from compressione import CODIFICHE, scegli_codifica
 from services import (
     RegioneService,
     MorfologiaService,
@@ -16,7 +25,19 @@ from services import (
     IndustriaService,
     MixService,
     AssorbimentiService,
-    AzioniService
+    AzioniService,
+    ProvinceService,
+    ComuniService,
+    AggregatiService,
+    ConfrontoService,
+    ClassificaService,
+    SnapshotService,
+    TabellareService,
+    LetturaRapidaService,
+    ExportService,
+    ModificheService,
+    TABELLE,
+    INDICATORI
 )
 
 router = APIRouter()
@@ -25,17 +46,31 @@ router = APIRouter()
 # REGIONI
 # =====================================================
 @router.get("/regioni", response_model=List[schemas.Regione])
-def get_all_regioni(db: Session = Depends(get_db)):
-    return RegioneService.get_all(db)
+def get_all_regioni(params: schemas.ParametriLista = Depends(), db: Session = Depends(get_db)):
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("regioni", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(LetturaRapidaService.json("regioni", db, **params.kwargs()))
 
 @router.get("/regioni/{regione_id}", response_model=schemas.Regione)
 def get_regione(regione_id: int, db: Session = Depends(get_db)):
     return RegioneService.get_by_id(regione_id, db)
 
+@router.get("/regioni/{regione_id}/profilo", response_model=schemas.RegioneProfilo)
+def get_profilo_regione(regione_id: int, db: Session = Depends(get_db)):
+    return RegioneService.get_profilo(regione_id, db)
+
+@router.get("/regioni/nome/{nome}/profilo", response_model=schemas.RegioneProfilo)
+def get_profilo_regione_by_nome(nome: str, db: Session = Depends(get_db)):
+    return RegioneService.get_profilo_by_nome(nome, db)
+
 @router.post("/regioni", response_model=schemas.Regione)
 def create_regione(regione: schemas.RegioneCreate, db: Session = Depends(get_db)):
     return RegioneService.create(regione, db)
 
+@router.post("/regioni/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_regioni(righe: List[schemas.RegioneCreate], db: Session = Depends(get_db)):
+    return RegioneService.bulk_upsert(righe, db)
+
 @router.put("/regioni/{regione_id}", response_model=schemas.Regione)
 def update_regione(regione_id: int, regione: schemas.RegioneCreate, db: Session = Depends(get_db)):
     return RegioneService.update(regione_id, regione, db)
@@ -49,81 +84,352 @@ def delete_regione(regione_id: int, db: Session = Depends(get_db)):
 # MORFOLOGIA SUOLO
 # =====================================================
 @router.get("/morfologia", response_model=List[schemas.MorfologiaSuolo])
-def get_all_morfologia(db: Session = Depends(get_db)):
-    return MorfologiaService.get_all(db)
+def get_all_morfologia(params: schemas.ParametriLista = Depends(), db: Session = Depends(get_db)):
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("morfologia", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(LetturaRapidaService.json("morfologia", db, **params.kwargs()))
 
 @router.post("/morfologia", response_model=schemas.MorfologiaSuolo)
 def create_morfologia(morf: schemas.MorfologiaSuoloCreate, db: Session = Depends(get_db)):
     return MorfologiaService.create(morf, db)
 
+@router.post("/morfologia/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_morfologia(righe: List[schemas.MorfologiaSuoloCreate], db: Session = Depends(get_db)):
+    return MorfologiaService.bulk_upsert(righe, db)
+
 
 # =====================================================
 # EMISSIONI TOTALI
 # =====================================================
 @router.get("/emissioni", response_model=List[schemas.EmissioniTotali])
-def get_all_emissioni(db: Session = Depends(get_db)):
-    return EmissioniService.get_all(db)
+def get_all_emissioni(params: schemas.ParametriLista = Depends(), db: Session = Depends(get_db)):
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("emissioni", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(LetturaRapidaService.json("emissioni", db, **params.kwargs()))
 
 @router.post("/emissioni", response_model=schemas.EmissioniTotali)
 def create_emissioni(emiss: schemas.EmissioniTotaliCreate, db: Session = Depends(get_db)):
     return EmissioniService.create(emiss, db)
 
+@router.post("/emissioni/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_emissioni(righe: List[schemas.EmissioniTotaliCreate], db: Session = Depends(get_db)):
+    return EmissioniService.bulk_upsert(righe, db)
+
 
 # =====================================================
 # EDIFICI
 # =====================================================
 @router.get("/edifici", response_model=List[schemas.Edifici])
-def get_all_edifici(db: Session = Depends(get_db)):
-    return EdificiService.get_all(db)
+def get_all_edifici(params: schemas.ParametriLista = Depends(), db: Session = Depends(get_db)):
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("edifici", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(LetturaRapidaService.json("edifici", db, **params.kwargs()))
 
 @router.post("/edifici", response_model=schemas.Edifici)
 def create_edifici(ed: schemas.EdificiCreate, db: Session = Depends(get_db)):
     return EdificiService.create(ed, db)
 
+@router.post("/edifici/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_edifici(righe: List[schemas.EdificiCreate], db: Session = Depends(get_db)):
+    return EdificiService.bulk_upsert(righe, db)
+
 
 # =====================================================
 # INDUSTRIA
 # =====================================================
 @router.get("/industria", response_model=List[schemas.Industria])
-def get_all_industria(db: Session = Depends(get_db)):
-    return IndustriaService.get_all(db)
+def get_all_industria(params: schemas.ParametriLista = Depends(), db: Session = Depends(get_db)):
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("industria", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(LetturaRapidaService.json("industria", db, **params.kwargs()))
 
 @router.post("/industria", response_model=schemas.Industria)
 def create_industria(ind: schemas.IndustriaCreate, db: Session = Depends(get_db)):
     return IndustriaService.create(ind, db)
 
+@router.post("/industria/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_industria(righe: List[schemas.IndustriaCreate], db: Session = Depends(get_db)):
+    return IndustriaService.bulk_upsert(righe, db)
+
 
 # =====================================================
 # MIX ENERGETICO
 # =====================================================
 @router.get("/mix", response_model=List[schemas.MixEnergetico])
-def get_all_mix(db: Session = Depends(get_db)):
-    return MixService.get_all(db)
+def get_all_mix(params: schemas.ParametriLista = Depends(), db: Session = Depends(get_db)):
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("mix", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(LetturaRapidaService.json("mix", db, **params.kwargs()))
 
 @router.post("/mix", response_model=schemas.MixEnergetico)
 def create_mix(mix: schemas.MixEnergeticoCreate, db: Session = Depends(get_db)):
     return MixService.create(mix, db)
 
+@router.post("/mix/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_mix(righe: List[schemas.MixEnergeticoCreate], db: Session = Depends(get_db)):
+    return MixService.bulk_upsert(righe, db)
+
 
 # =====================================================
 # ASSORBIMENTI
 # =====================================================
 @router.get("/assorbimenti", response_model=List[schemas.Assorbimenti])
-def get_all_assorbimenti(db: Session = Depends(get_db)):
-    return AssorbimentiService.get_all(db)
+def get_all_assorbimenti(params: schemas.ParametriLista = Depends(), db: Session = Depends(get_db)):
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("assorbimenti", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(LetturaRapidaService.json("assorbimenti", db, **params.kwargs()))
 
 @router.post("/assorbimenti", response_model=schemas.Assorbimenti)
 def create_assorbimenti(ass: schemas.AssorbimentiCreate, db: Session = Depends(get_db)):
     return AssorbimentiService.create(ass, db)
 
+@router.post("/assorbimenti/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_assorbimenti(righe: List[schemas.AssorbimentiCreate], db: Session = Depends(get_db)):
+    return AssorbimentiService.bulk_upsert(righe, db)
+
 
 # =====================================================
 # AZIONI
 # =====================================================
 @router.get("/azioni", response_model=List[schemas.Azioni])
-def get_all_azioni(db: Session = Depends(get_db)):
-    return AzioniService.get_all(db)
+def get_all_azioni(params: schemas.ParametriLista = Depends(), db: Session = Depends(get_db)):
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("azioni", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(LetturaRapidaService.json("azioni", db, **params.kwargs()))
 
 @router.post("/azioni", response_model=schemas.Azioni)
 def create_azioni(az: schemas.AzioniCreate, db: Session = Depends(get_db)):
-    return AzioniService.create(az, db)
\ No newline at end of file
+    return AzioniService.create(az, db)
+
+@router.post("/azioni/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_azioni(righe: List[schemas.AzioniCreate], db: Session = Depends(get_db)):
+    return AzioniService.bulk_upsert(righe, db)
+
+
+# =====================================================
+# TERRITORIO (province, comuni, aggregati)
+# =====================================================
+# Il dettaglio (province, comuni) è sempre paginato: senza ?limit= vale LIMIT_MAX
+# e la pagina successiva si chiede con ?cursor= (header X-Next-Cursor).
+def _filtri(**valori):
+    filtri = tuple((k, v) for k, v in valori.items() if v is not None)
+    return filtri or None
+
+@router.get("/province", response_model=List[schemas.Provincia])
+def get_province(params: schemas.ParametriLista = Depends(), regione: Optional[int] = Query(None, description="id_regione"),
+                 db: Session = Depends(get_db)):
+    kwargs = {**params.kwargs(schemas.LIMIT_MAX), "filtri": _filtri(id_regione=regione)}
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("province", db, **kwargs), params.formato, kwargs["limit"], ("id_provincia",))
+    return risposta_json(LetturaRapidaService.json("province", db, **kwargs))
+
+@router.post("/province", response_model=schemas.Provincia)
+def create_provincia(provincia: schemas.ProvinciaCreate, db: Session = Depends(get_db)):
+    return ProvinceService.create(provincia, db)
+
+@router.post("/province/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_province(righe: List[schemas.ProvinciaCreate], db: Session = Depends(get_db)):
+    return ProvinceService.bulk_upsert(righe, db)
+
+@router.get("/comuni", response_model=List[schemas.Comune])
+def get_comuni(params: schemas.ParametriLista = Depends(), regione: Optional[int] = Query(None, description="id_regione"),
+               provincia: Optional[int] = Query(None, description="id_provincia"), db: Session = Depends(get_db)):
+    kwargs = {**params.kwargs(schemas.LIMIT_MAX), "filtri": _filtri(id_regione=regione, id_provincia=provincia)}
+    if params.formato:
+        return risposta_tabellare(TabellareService.colonne("comuni", db, **kwargs), params.formato, kwargs["limit"], ("id_comune",))
+    return risposta_json(LetturaRapidaService.json("comuni", db, **kwargs))
+
+@router.post("/comuni", response_model=schemas.Comune)
+def create_comune(comune: schemas.ComuneCreate, db: Session = Depends(get_db)):
+    return ComuniService.create(comune, db)
+
+@router.post("/comuni/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+def bulk_comuni(righe: List[schemas.ComuneCreate], db: Session = Depends(get_db)):
+    return ComuniService.bulk_upsert(righe, db)
+
+@router.put("/comuni/{comune_id}", response_model=schemas.Comune)
+def update_comune(comune_id: int, comune: schemas.ComuneBase, db: Session = Depends(get_db)):
+    return ComuniService.update(comune_id, comune, db)
+
+@router.delete("/comuni/{comune_id}")
+def delete_comune(comune_id: int, db: Session = Depends(get_db)):
+    return ComuniService.delete(comune_id, db)
+
+@router.get("/aggregati/{livello}", response_model=List[schemas.Aggregato])
+def get_aggregati(livello: str = Path(..., pattern="^(provincia|regione|nazione)$"),
+                  id: Optional[int] = Query(None, description="id_provincia / id_regione"),
+                  db: Session = Depends(get_db)):
+    """Roll-up dei comuni già calcolati: una riga per territorio, nessuna aggregazione a query time."""
+    return risposta_json(LetturaRapidaService.json("aggregati", db, filtri=_filtri(livello=livello, id_territorio=id)))
+
+@router.post("/aggregati/ricalcola")
+def ricalcola_aggregati(db: Session = Depends(get_db)):
+    return AggregatiService.ricalcola(db)
+
+
+# =====================================================
+# CONFRONTO (N regioni x M indicatori)
+# =====================================================
+def _elenco(valore: str) -> tuple:
+    return tuple(dict.fromkeys(v.strip() for v in valore.split(",") if v.strip()))
+
+@router.get("/confronto")
+def get_confronto(regioni: str = Query(..., description="Nomi delle regioni, separati da virgola"),
+                  indicatori: str = Query(..., description="Indicatori (colonne numeriche), separati da virgola"),
+                  anno: Optional[int] = Query(None, ge=schemas.ANNO_MIN, le=schemas.ANNO_MAX,
+                                              description="Anno delle tabelle annuali (default: l'ultimo)"),
+                  db: Session = Depends(get_db)):
+    """Solo le celle richieste: una riga per regione con id_regione, nome e gli indicatori."""
+    return risposta_json((ConfrontoService.get(_elenco(regioni), _elenco(indicatori), db, anno=anno), None))
+
+@router.get("/indicatori")
+def get_indicatori():
+    """Indicatori confrontabili: nome -> tabella (endpoint) e colonna."""
+    return {nome: {"tabella": tabella, "colonna": colonna} for nome, (tabella, colonna) in INDICATORI.items()}
+
+
+# =====================================================
+# CLASSIFICHE (materializzate)
+# =====================================================
+@router.get("/classifica/{indicatore}", response_model=List[schemas.PosizioneClassifica])
+def get_classifica(indicatore: str, regione: Optional[str] = Query(None, description="Solo la regione indicata (nome)"),
+                   db: Session = Depends(get_db)):
+    """Posizione (1 = valore più alto), percentile e z-score di ogni regione, già calcolati."""
+    return risposta_json((ClassificaService.get(indicatore, db, regione=regione), None))
+
+@router.post("/classifica/ricalcola")
+def ricalcola_classifiche(db: Session = Depends(get_db)):
+    return ClassificaService.ricalcola(db)
+
+
+# =====================================================
+# EXPORT (NDJSON / CSV in streaming)
+# =====================================================
+@router.get("/export/{tabella}")
+def export_tabella(request: Request, tabella: str = Path(..., pattern="^(" + "|".join(TABELLE) + ")$"),
+                   formato: Optional[str] = Query(None, pattern="^(ndjson|csv)$", description="ndjson (predefinito) o csv"),
+                   params: schemas.ParametriLista = Depends()):
+    """
+    Tutte le righe della tabella (tutti gli anni, salvo ?anno= / ?da=&a=), inviate man mano
+    che vengono lette. ?fields= limita le colonne, ?cursor= riprende un export interrotto.
+    Il formato si sceglie con ?formato= oppure con Accept: text/csv.
+    """
+    if formato is None:
+        formato = "csv" if "text/csv" in (request.headers.get("accept") or "") else "ndjson"
+    righe = ExportService.righe(tabella, lambda: sessione_per(request), formato,
+                                campi=params.campi, cursor=params.cursor, periodo=params.periodo)
+    estensione = "csv" if formato == "csv" else "ndjson"
+    return StreamingResponse(
+        righe,
+        media_type=ExportService.FORMATI[formato],
+        headers={"Content-Disposition": f'attachment; filename="{tabella}.{estensione}"'},
+    )
+
+
+# =====================================================
+# EVENTI (Server-Sent Events sulle scritture)
+# =====================================================
+@router.get("/eventi")
+async def get_eventi(request: Request, last_event_id: Optional[str] = Header(None, include_in_schema=False)):
+    """
+    Flusso SSE con un evento {"table", "id_regione", "version"} per ogni scrittura;
+    "table": "*" significa che il client deve considerare cambiato tutto.
+    Alla riconnessione il browser manda Last-Event-ID e riceve gli eventi persi.
+    """
+    dopo = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    coda = bus_eventi.iscrivi(dopo, versione_dati.corrente())
+
+    async def flusso():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    evento = await asyncio.wait_for(coda.get(), EVENTI_PING_S)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield b": ping\n\n"       # tiene aperta la connessione attraverso i proxy
+                    continue
+                yield formatta_sse(evento)
+        finally:
+            bus_eventi.disiscrivi(coda)
+
+    return StreamingResponse(flusso(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# =====================================================
+# MODIFICHE (sincronizzazione incrementale dal registro)
+# =====================================================
+@router.get("/changes")
+def get_changes(since: int = Query(0, ge=0, description="Valore di version della risposta precedente"),
+                limit: int = Query(schemas.LIMIT_MAX, ge=1, le=schemas.LIMIT_MAX, description="Voci del registro per pagina"),
+                db: Session = Depends(get_db)):
+    """
+    Righe inserite, aggiornate o eliminate dopo la versione since, una volta per chiave:
+    {"op": "upsert", "key", "row"}, {"op": "delete", "key"} oppure {"op": "reset"}
+    (tabella ricostruita, da riscaricare). Con "more": true si richiede subito la pagina
+    successiva con since=version. 410 se la versione è uscita dal registro.
+    """
+    return Response(content=ModificheService.get(since, db, limit), media_type="application/json",
+                    headers={"Cache-Control": "no-cache"})
+
+@router.get("/changes/version")
+def get_changes_version(db: Session = Depends(get_db)):
+    """Versione attuale del registro: da leggere prima di un download completo (/export)."""
+    return {"version": ModificheService.versione(db)}
+
+
+# =====================================================
+# GEOMETRIE (TopoJSON semplificato per livello di zoom)
+# =====================================================
+# I file cambiano solo con un nuovo build: cache lunga lato client/proxy e
+# ETag sul contenuto (fuori dall'ETagMiddleware, che segue la versione dei dati).
+CACHE_GEOMETRIE = "public, max-age=604800, stale-while-revalidate=86400"
+
+@router.get("/geometrie/regioni")
+def get_geometrie_regioni(zoom: float = Query(0, ge=0, le=24, description="Zoom della mappa"),
+                          accept_encoding: Optional[str] = Header(None, include_in_schema=False),
+                          if_none_match: Optional[str] = Header(None, include_in_schema=False)):
+    livello = geometrie.livello_per_zoom(zoom)
+    file = geometrie.geometria(livello)
+    if file is None:
+        raise HTTPException(status_code=503, detail="Geometrie non generate: eseguire `python geometrie.py costruisci`")
+    varianti, impronta = file
+    # variante precompressa al build: nessuna compressione per richiesta
+    codifica = scegli_codifica(accept_encoding, [c for c in CODIFICHE if c in varianti])
+    etag = f'"{impronta}-{codifica}"' if codifica else f'"{impronta}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_GEOMETRIE, "Vary": "Accept-Encoding", "X-Livello-Dettaglio": livello}
+    if if_none_match and etag in (t.strip().removeprefix("W/") for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    if codifica:
+        headers["Content-Encoding"] = codifica
+    return Response(varianti[codifica], media_type="application/json", headers=headers)
+
+
+# =====================================================
+# SNAPSHOT (bootstrap della dashboard)
+# =====================================================
+@router.get("/snapshot")
+def get_snapshot(db: Session = Depends(get_db)):
+    """Tutte le tabelle in un unico payload colonnare, allineato su id_regione."""
+    return Response(content=SnapshotService.get(db), media_type="application/json")
+
+
+# =====================================================
+# MONITORAGGIO (cache e metriche)
+# =====================================================
+@router.get("/cache/statistiche")
+def get_statistiche_cache():
+    """Contatori della cache dei servizi: hit, miss, evizioni, invalidazioni."""
+    return cache_risultati.statistiche()
+
+@router.get("/pool")
+def get_statistiche_pool():
+    """Stato live dei pool di connessioni (in uso, libere, overflow)."""
+    return statistiche_pool()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metriche():
+    """Metriche in formato Prometheus: latenza SQL, righe, query per richiesta, cache."""
+    return PlainTextResponse(metriche.esporta(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,199 @@
+"""
+Endpoint async (ASYNC_DB=1), stessi path e stessi schemi di routes.py.
+Il router viene incluso prima di quello sincrono: le rotte definite qui hanno
+la precedenza, quelle non presenti restano servite da routes.py.
+"""
+
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+import schemas
+from formati import risposta_json, risposta_tabellare
+from database import get_async_db
+from services_async import (
+    RegioneServiceAsync,
+    MorfologiaServiceAsync,
+    EmissioniServiceAsync,
+    EdificiServiceAsync,
+    IndustriaServiceAsync,
+    MixServiceAsync,
+    AssorbimentiServiceAsync,
+    AzioniServiceAsync,
+    SnapshotServiceAsync,
+    TabellareServiceAsync,
+    LetturaRapidaServiceAsync
+)
+
+router = APIRouter()
+
+# =====================================================
+# REGIONI
+# =====================================================
+@router.get("/regioni", response_model=List[schemas.Regione])
+async def get_all_regioni(params: schemas.ParametriLista = Depends(), db: AsyncSession = Depends(get_async_db)):
+    if params.formato:
+        return risposta_tabellare(await TabellareServiceAsync.colonne("regioni", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(await LetturaRapidaServiceAsync.json("regioni", db, **params.kwargs()))
+
+@router.get("/regioni/{regione_id}", response_model=schemas.Regione)
+async def get_regione(regione_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await RegioneServiceAsync.get_by_id(regione_id, db)
+
+@router.get("/regioni/{regione_id}/profilo", response_model=schemas.RegioneProfilo)
+async def get_profilo_regione(regione_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await RegioneServiceAsync.get_profilo(regione_id, db)
+
+@router.get("/regioni/nome/{nome}/profilo", response_model=schemas.RegioneProfilo)
+async def get_profilo_regione_by_nome(nome: str, db: AsyncSession = Depends(get_async_db)):
+    return await RegioneServiceAsync.get_profilo_by_nome(nome, db)
+
+@router.post("/regioni", response_model=schemas.Regione)
+async def create_regione(regione: schemas.RegioneCreate, db: AsyncSession = Depends(get_async_db)):
+    return await RegioneServiceAsync.create(regione, db)
+
+@router.post("/regioni/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+async def bulk_regioni(righe: List[schemas.RegioneCreate], db: AsyncSession = Depends(get_async_db)):
+    return await RegioneServiceAsync.bulk_upsert(righe, db)
+
+@router.put("/regioni/{regione_id}", response_model=schemas.Regione)
+async def update_regione(regione_id: int, regione: schemas.RegioneCreate, db: AsyncSession = Depends(get_async_db)):
+    return await RegioneServiceAsync.update(regione_id, regione, db)
+
+@router.delete("/regioni/{regione_id}")
+async def delete_regione(regione_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await RegioneServiceAsync.delete(regione_id, db)
+
+
+# =====================================================
+# MORFOLOGIA SUOLO
+# =====================================================
+@router.get("/morfologia", response_model=List[schemas.MorfologiaSuolo])
+async def get_all_morfologia(params: schemas.ParametriLista = Depends(), db: AsyncSession = Depends(get_async_db)):
+    if params.formato:
+        return risposta_tabellare(await TabellareServiceAsync.colonne("morfologia", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(await LetturaRapidaServiceAsync.json("morfologia", db, **params.kwargs()))
+
+@router.post("/morfologia", response_model=schemas.MorfologiaSuolo)
+async def create_morfologia(morf: schemas.MorfologiaSuoloCreate, db: AsyncSession = Depends(get_async_db)):
+    return await MorfologiaServiceAsync.create(morf, db)
+
+@router.post("/morfologia/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+async def bulk_morfologia(righe: List[schemas.MorfologiaSuoloCreate], db: AsyncSession = Depends(get_async_db)):
+    return await MorfologiaServiceAsync.bulk_upsert(righe, db)
+
+
+# =====================================================
+# EMISSIONI TOTALI
+# =====================================================
+@router.get("/emissioni", response_model=List[schemas.EmissioniTotali])
+async def get_all_emissioni(params: schemas.ParametriLista = Depends(), db: AsyncSession = Depends(get_async_db)):
+    if params.formato:
+        return risposta_tabellare(await TabellareServiceAsync.colonne("emissioni", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(await LetturaRapidaServiceAsync.json("emissioni", db, **params.kwargs()))
+
+@router.post("/emissioni", response_model=schemas.EmissioniTotali)
+async def create_emissioni(emiss: schemas.EmissioniTotaliCreate, db: AsyncSession = Depends(get_async_db)):
+    return await EmissioniServiceAsync.create(emiss, db)
+
+@router.post("/emissioni/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+async def bulk_emissioni(righe: List[schemas.EmissioniTotaliCreate], db: AsyncSession = Depends(get_async_db)):
+    return await EmissioniServiceAsync.bulk_upsert(righe, db)
+
+
+# =====================================================
+# EDIFICI
+# =====================================================
+@router.get("/edifici", response_model=List[schemas.Edifici])
+async def get_all_edifici(params: schemas.ParametriLista = Depends(), db: AsyncSession = Depends(get_async_db)):
+    if params.formato:
+        return risposta_tabellare(await TabellareServiceAsync.colonne("edifici", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(await LetturaRapidaServiceAsync.json("edifici", db, **params.kwargs()))
+
+@router.post("/edifici", response_model=schemas.Edifici)
+async def create_edifici(ed: schemas.EdificiCreate, db: AsyncSession = Depends(get_async_db)):
+    return await EdificiServiceAsync.create(ed, db)
+
+@router.post("/edifici/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+async def bulk_edifici(righe: List[schemas.EdificiCreate], db: AsyncSession = Depends(get_async_db)):
+    return await EdificiServiceAsync.bulk_upsert(righe, db)
+
+
+# =====================================================
+# INDUSTRIA
+# =====================================================
+@router.get("/industria", response_model=List[schemas.Industria])
+async def get_all_industria(params: schemas.ParametriLista = Depends(), db: AsyncSession = Depends(get_async_db)):
+    if params.formato:
+        return risposta_tabellare(await TabellareServiceAsync.colonne("industria", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(await LetturaRapidaServiceAsync.json("industria", db, **params.kwargs()))
+
+@router.post("/industria", response_model=schemas.Industria)
+async def create_industria(ind: schemas.IndustriaCreate, db: AsyncSession = Depends(get_async_db)):
+    return await IndustriaServiceAsync.create(ind, db)
+
+@router.post("/industria/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+async def bulk_industria(righe: List[schemas.IndustriaCreate], db: AsyncSession = Depends(get_async_db)):
+    return await IndustriaServiceAsync.bulk_upsert(righe, db)
+
+
+# =====================================================
+# MIX ENERGETICO
+# =====================================================
+@router.get("/mix", response_model=List[schemas.MixEnergetico])
+async def get_all_mix(params: schemas.ParametriLista = Depends(), db: AsyncSession = Depends(get_async_db)):
+    if params.formato:
+        return risposta_tabellare(await TabellareServiceAsync.colonne("mix", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(await LetturaRapidaServiceAsync.json("mix", db, **params.kwargs()))
+
+@router.post("/mix", response_model=schemas.MixEnergetico)
+async def create_mix(mix: schemas.MixEnergeticoCreate, db: AsyncSession = Depends(get_async_db)):
+    return await MixServiceAsync.create(mix, db)
+
+@router.post("/mix/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+async def bulk_mix(righe: List[schemas.MixEnergeticoCreate], db: AsyncSession = Depends(get_async_db)):
+    return await MixServiceAsync.bulk_upsert(righe, db)
+
+
+# =====================================================
+# ASSORBIMENTI
+# =====================================================
+@router.get("/assorbimenti", response_model=List[schemas.Assorbimenti])
+async def get_all_assorbimenti(params: schemas.ParametriLista = Depends(), db: AsyncSession = Depends(get_async_db)):
+    if params.formato:
+        return risposta_tabellare(await TabellareServiceAsync.colonne("assorbimenti", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(await LetturaRapidaServiceAsync.json("assorbimenti", db, **params.kwargs()))
+
+@router.post("/assorbimenti", response_model=schemas.Assorbimenti)
+async def create_assorbimenti(ass: schemas.AssorbimentiCreate, db: AsyncSession = Depends(get_async_db)):
+    return await AssorbimentiServiceAsync.create(ass, db)
+
+@router.post("/assorbimenti/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+async def bulk_assorbimenti(righe: List[schemas.AssorbimentiCreate], db: AsyncSession = Depends(get_async_db)):
+    return await AssorbimentiServiceAsync.bulk_upsert(righe, db)
+
+
+# =====================================================
+# AZIONI
+# =====================================================
+@router.get("/azioni", response_model=List[schemas.Azioni])
+async def get_all_azioni(params: schemas.ParametriLista = Depends(), db: AsyncSession = Depends(get_async_db)):
+    if params.formato:
+        return risposta_tabellare(await TabellareServiceAsync.colonne("azioni", db, **params.kwargs()), params.formato, params.limit)
+    return risposta_json(await LetturaRapidaServiceAsync.json("azioni", db, **params.kwargs()))
+
+@router.post("/azioni", response_model=schemas.Azioni)
+async def create_azioni(az: schemas.AzioniCreate, db: AsyncSession = Depends(get_async_db)):
+    return await AzioniServiceAsync.create(az, db)
+
+@router.post("/azioni/bulk", response_model=List[schemas.EsitoBulk], response_model_exclude_none=True)
+async def bulk_azioni(righe: List[schemas.AzioniCreate], db: AsyncSession = Depends(get_async_db)):
+    return await AzioniServiceAsync.bulk_upsert(righe, db)
+
+
+# =====================================================
+# SNAPSHOT (bootstrap della dashboard)
+# =====================================================
+@router.get("/snapshot")
+async def get_snapshot(db: AsyncSession = Depends(get_async_db)):
+    """Tutte le tabelle in un unico payload colonnare, allineato su id_regione."""
+    return Response(content=await SnapshotServiceAsync.get(db), media_type="application/json")
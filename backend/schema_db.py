@@ -0,0 +1,182 @@
+"""
+Creazione e verifica dello schema del database, separate dall'import dei modelli.
+
+Lo schema si crea con un comando esplicito:
+
+    python schema_db.py crea       # crea le tabelle mancanti, applica le migrazioni e registra l'impronta
+    python schema_db.py verifica   # confronta l'impronta registrata con i modelli
+    python schema_db.py impronta   # stampa l'impronta dei modelli
+
+All'avvio dell'API (variabile SCHEMA_AVVIO) si esegue al massimo una SELECT
+sulla tabella `schema_impronta`, senza riflettere le tabelle:
+- `verifica` (predefinito): confronta l'impronta e segnala nel log se differisce;
+- `crea`: comportamento precedente, crea le tabelle mancanti (utile con SQLite in locale);
+- `nessuno`: nessun accesso al database in fase di avvio.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+import models
+from database import engine
+
+logger = logging.getLogger("can.schema")
+
+# Tabella dell'impronta: metadata separato, così non entra nell'impronta stessa
+_metadata_schema = MetaData()
+schema_impronta = Table(
+    "schema_impronta",
+    _metadata_schema,
+    Column("id", Integer, primary_key=True),
+    Column("impronta", String(64), nullable=False),
+    Column("aggiornato", DateTime, nullable=False),
+)
+
+MODALITA_AVVIO = ("verifica", "crea", "nessuno")
+
+# anno assegnato ai dati già presenti quando una tabella riceve la colonna anno
+ANNO_BASE = int(os.getenv("ANNO_BASE", "2023"))
+
+
+# ==========================================================
+# IMPRONTA
+# ==========================================================
+
+def _descrivi_tabella(tabella) -> dict:
+    """Descrizione stabile di una tabella: colonne, vincoli e indici."""
+    return {
+        "nome": tabella.name,
+        "colonne": [
+            [c.name, str(c.type), c.nullable, c.primary_key, c.unique or False,
+             sorted(fk.target_fullname for fk in c.foreign_keys)]
+            for c in tabella.columns
+        ],
+        "vincoli": sorted(
+            str(v.sqltext) for v in tabella.constraints if hasattr(v, "sqltext")
+        ),
+        "indici": sorted(
+            [i.name or "", [c.name for c in i.columns], bool(i.unique)] for i in tabella.indexes
+        ),
+    }
+
+
+def impronta(metadata=models.Base.metadata) -> str:
+    """Hash SHA-256 della struttura dei modelli (indipendente dal dialetto)."""
+    descrizione = [_descrivi_tabella(t) for t in metadata.sorted_tables]
+    testo = json.dumps(descrizione, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(testo.encode()).hexdigest()
+
+
+def impronta_registrata(bind=engine):
+    """Impronta salvata nel database, None se assente o tabella mancante."""
+    try:
+        with bind.connect() as conn:
+            return conn.execute(
+                select(schema_impronta.c.impronta).where(schema_impronta.c.id == 1)
+            ).scalar_one_or_none()
+    except SQLAlchemyError:
+        return None
+
+
+# ==========================================================
+# MIGRAZIONI
+# ==========================================================
+
+def _migra_anno(bind) -> list:
+    """
+    Porta le tabelle annuali create prima della dimensione temporale alla chiave
+    (id_regione, anno) con l'indice coprente; le righe esistenti ricevono ANNO_BASE.
+    MySQL modifica la tabella sul posto, SQLite (che non cambia la chiave primaria)
+    la ricrea copiando i dati.
+    """
+    ispettore = inspect(bind)
+    migrate = []
+    for tabella in models.Base.metadata.sorted_tables:
+        if "anno" not in tabella.c or not ispettore.has_table(tabella.name):
+            continue
+        if "anno" in {c["name"] for c in ispettore.get_columns(tabella.name)}:
+            continue
+        nome = tabella.name
+        with bind.begin() as conn:
+            if bind.dialect.name == "mysql":
+                conn.execute(text(
+                    f"ALTER TABLE {nome} ADD COLUMN anno SMALLINT NOT NULL DEFAULT {ANNO_BASE} AFTER id_regione, "
+                    f"DROP PRIMARY KEY, ADD PRIMARY KEY (id_regione, anno)"
+                ))
+                conn.execute(text(f"ALTER TABLE {nome} ALTER COLUMN anno DROP DEFAULT"))
+                for indice in tabella.indexes:
+                    indice.create(conn)
+            else:
+                colonne = ", ".join(c.name for c in tabella.c if c.name != "anno")
+                conn.execute(text(f"ALTER TABLE {nome} RENAME TO {nome}_senza_anno"))
+                tabella.create(conn)
+                conn.execute(text(
+                    f"INSERT INTO {nome} ({colonne}, anno) SELECT {colonne}, {ANNO_BASE} FROM {nome}_senza_anno"
+                ))
+                conn.execute(text(f"DROP TABLE {nome}_senza_anno"))
+        migrate.append(nome)
+        logger.info("Tabella %s: aggiunta la colonna anno (righe esistenti = %s)", nome, ANNO_BASE)
+    return migrate
+
+
+# migrazioni idempotenti, applicate in ordine da `crea`
+MIGRAZIONI = [_migra_anno]
+
+
+# ==========================================================
+# COMANDI
+# ==========================================================
+
+def crea_schema(bind=engine) -> str:
+    """Applica le migrazioni, crea le tabelle mancanti e registra l'impronta corrente."""
+    for migrazione in MIGRAZIONI:
+        migrazione(bind)
+    models.Base.metadata.create_all(bind)
+    _metadata_schema.create_all(bind)
+    valore = impronta()
+    with bind.begin() as conn:
+        conn.execute(schema_impronta.delete())
+        conn.execute(schema_impronta.insert().values(id=1, impronta=valore, aggiornato=datetime.utcnow()))
+    return valore
+
+
+def verifica_schema(bind=engine) -> bool:
+    """True se l'impronta registrata coincide con quella dei modelli."""
+    registrata = impronta_registrata(bind)
+    if registrata is None:
+        logger.warning("Impronta dello schema assente: eseguire `python schema_db.py crea`")
+        return False
+    if registrata != impronta():
+        logger.warning("Lo schema del database non corrisponde ai modelli: eseguire `python schema_db.py crea`")
+        return False
+    return True
+
+
+def avvio(modalita: str, bind=engine) -> None:
+    """Controllo dello schema all'avvio dell'API secondo SCHEMA_AVVIO."""
+    if modalita not in MODALITA_AVVIO:
+        raise ValueError(f"SCHEMA_AVVIO non valido: {modalita!r} (ammessi: {', '.join(MODALITA_AVVIO)})")
+    if modalita == "crea":
+        crea_schema(bind)
+    elif modalita == "verifica":
+        verifica_schema(bind)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    comando = sys.argv[1] if len(sys.argv) > 1 else "crea"
+    if comando == "crea":
+        print(f"Schema creato, impronta {crea_schema()}")
+    elif comando == "verifica":
+        sys.exit(0 if verifica_schema() else 1)
+    elif comando == "impronta":
+        print(impronta())
+    else:
+        sys.exit(f"Comando sconosciuto: {comando} (usa crea, verifica o impronta)")
@@ -5,8 +5,54 @@ Quindi, ci permette di definire come i dati vengono inviati e ricevuti dall'API.
 
 #Qui definiamo i modelli Pydantic per la validazione
 
+from fastapi import Header, HTTPException, Query
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Literal
+from formati import formato_tabellare
+
+LIMIT_MAX = 1000
+ANNO_MIN, ANNO_MAX = 1900, 2100
+
+
+# ---------------------
+# Parametri comuni degli endpoint di lista
+# ---------------------
+class ParametriLista:
+    """
+    Dependency per ?fields=, ?limit= e ?cursor= (paginazione keyset su id_regione,
+    "id_regione:anno" per le tabelle annuali) e per i filtri ?anno= / ?da=&a=.
+    Senza filtri le tabelle annuali restituiscono l'ultimo anno di ogni regione.
+    Dall'header Accept ricava anche l'eventuale formato tabellare (Arrow/Parquet).
+    """
+    def __init__(
+        self,
+        fields: Optional[str] = Query(None, description="Colonne da restituire, separate da virgola"),
+        limit: Optional[int] = Query(None, ge=1, le=LIMIT_MAX, description="Numero massimo di righe"),
+        cursor: Optional[str] = Query(None, pattern=r"^\d+(:\d+)?$", description="Valore di X-Next-Cursor della pagina precedente"),
+        anno: Optional[int] = Query(None, ge=ANNO_MIN, le=ANNO_MAX, description="Solo l'anno indicato"),
+        da: Optional[int] = Query(None, ge=ANNO_MIN, le=ANNO_MAX, description="Primo anno (incluso)"),
+        a: Optional[int] = Query(None, ge=ANNO_MIN, le=ANNO_MAX, description="Ultimo anno (incluso)"),
+        accept: Optional[str] = Header(None, include_in_schema=False),
+    ):
+        if anno is not None and (da is not None or a is not None):
+            raise HTTPException(status_code=400, detail="Usare ?anno= oppure ?da=&a=, non entrambi")
+        if da is not None and a is not None and da > a:
+            raise HTTPException(status_code=400, detail="Intervallo di anni non valido: da > a")
+        self.formato = formato_tabellare(accept)
+        self.campi = tuple(c.strip() for c in fields.split(",") if c.strip()) if fields else None
+        self.limit = limit
+        self.cursor = tuple(int(p) for p in cursor.split(":")) if cursor else None
+        if anno is not None:
+            self.periodo = (anno, anno)
+        elif da is not None or a is not None:
+            self.periodo = (da, a)
+        else:
+            self.periodo = None
+
+    def kwargs(self, limit_predefinito: Optional[int] = None) -> dict:
+        """Argomenti per i servizi di lettura; limit_predefinito vale se ?limit= manca."""
+        limit = self.limit if self.limit is not None else limit_predefinito
+        return {"campi": self.campi, "limit": limit, "cursor": self.cursor, "periodo": self.periodo}
 
 # ---------------------
 # Regioni
@@ -56,9 +102,11 @@ class EmissioniTotaliBase(BaseModel):
 
 class EmissioniTotaliCreate(EmissioniTotaliBase):
     id_regione: int
+    anno: int
 
 class EmissioniTotali(EmissioniTotaliBase):
     id_regione: int
+    anno: int
 
     class Config:
         orm_mode = True
@@ -75,9 +123,11 @@ class EdificiBase(BaseModel):
 
 class EdificiCreate(EdificiBase):
     id_regione: int
+    anno: int
 
 class Edifici(EdificiBase):
     id_regione: int
+    anno: int
 
     class Config:
         orm_mode = True
@@ -92,9 +142,11 @@ class IndustriaBase(BaseModel):
 
 class IndustriaCreate(IndustriaBase):
     id_regione: int
+    anno: int
 
 class Industria(IndustriaBase):
     id_regione: int
+    anno: int
 
     class Config:
         orm_mode = True
@@ -119,9 +171,11 @@ class MixEnergeticoBase(BaseModel):
 
 class MixEnergeticoCreate(MixEnergeticoBase):
     id_regione: int
+    anno: int
 
 class MixEnergetico(MixEnergeticoBase):
     id_regione: int
+    anno: int
 
     class Config:
         orm_mode = True
@@ -155,10 +209,92 @@ class AzioniBase(BaseModel):
 
 class AzioniCreate(AzioniBase):
     id_regione: int
+    anno: int
 
 class Azioni(AzioniBase):
     id_regione: int
+    anno: int
 
     class Config:
         orm_mode = True
 
+
+# ---------------------
+# Province e comuni
+# ---------------------
+class ProvinciaBase(BaseModel):
+    id_regione: int
+    sigla: str
+    nome: str
+
+class ProvinciaCreate(ProvinciaBase):
+    id_provincia: int
+
+class Provincia(ProvinciaCreate):
+    class Config:
+        orm_mode = True
+
+
+class ComuneBase(BaseModel):
+    id_provincia: int
+    nome: str
+    popolazione: Optional[int] = None
+    superficie_kmq: Optional[float] = None
+    co2eq_t: Optional[float] = None
+
+class ComuneCreate(ComuneBase):
+    id_comune: int
+
+class Comune(ComuneCreate):
+    id_regione: int
+
+    class Config:
+        orm_mode = True
+
+
+# Aggregati dei comuni (roll-up per provincia, regione e nazione)
+class Aggregato(BaseModel):
+    livello: Literal["provincia", "regione", "nazione"]
+    id_territorio: int
+    n_comuni: int
+    popolazione: int
+    superficie_kmq: float
+    co2eq_t: float
+
+
+# Posizione di una regione nella classifica di un indicatore
+class PosizioneClassifica(BaseModel):
+    id_regione: int
+    nome: str
+    valore: float
+    posizione: int
+    percentile: float
+    z_score: Optional[float] = None
+
+
+# ---------------------
+# Profilo regione (regione + tabelle collegate, ultimo anno disponibile)
+# ---------------------
+class RegioneProfilo(Regione):
+    morfologia: Optional[MorfologiaSuolo] = None
+    emissioni_totali: Optional[EmissioniTotali] = None
+    edifici: Optional[Edifici] = None
+    industria: Optional[Industria] = None
+    mix: Optional[MixEnergetico] = None
+    assorbimenti: Optional[Assorbimenti] = None
+    azioni: Optional[Azioni] = None
+
+    class Config:
+        orm_mode = True
+
+
+# ---------------------
+# Esito dei caricamenti multipli (bulk upsert)
+# ---------------------
+class EsitoBulk(BaseModel):
+    id_regione: Optional[int] = None
+    anno: Optional[int] = None
+    id_provincia: Optional[int] = None
+    id_comune: Optional[int] = None
+    nome: Optional[str] = None
+    stato: Literal["inserito", "aggiornato"]
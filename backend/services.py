@@ -3,36 +3,378 @@ Contiene la logica CRUD (Create, Read, Update, Delete).
 Le route lo chiamano per eseguire operazioni sul DB in modo pulito.
 """
 
-from sqlalchemy.orm import Session
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+import orjson
+import pandas as pd
+from sqlalchemy import select, insert, type_coerce, func, literal, and_, or_, tuple_, Float, Numeric
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.dialects import mysql, sqlite
 from fastapi import HTTPException
 import models
 import schemas
+from database import SessionLocal
+from versione import versione_dati
+from metriche import ricalcoli_classifiche
+from eventi import bus_eventi
+from cache import cache_risultati, memoizza
+
+
+logger = logging.getLogger("can.services")
+
+
+def _registra_scrittura(*tabelle, db: Session = None, regioni=None):
+    """
+    Da chiamare dopo ogni commit: segnala che i dati sono cambiati e invalida
+    la cache delle tabelle toccate (e di profili e confronti, che le includono tutte).
+    Senza argomenti (scritture su regioni) svuota l'intera cache.
+    Con la sessione db pianifica anche il ricalcolo delle classifiche degli
+    indicatori toccati (in background, vedi RicalcoloClassifiche).
+    regioni = id_regione toccati, pubblicati su /eventi (None = tutta la tabella).
+    """
+    if db is not None:
+        ricalcolo_classifiche.segnala(tabelle or None)
+    versione = versione_dati.incrementa()
+    if tabelle:
+        cache_risultati.invalida("profilo", "confronto", "classifiche", "snapshot", *tabelle)
+    else:
+        cache_risultati.svuota()
+    bus_eventi.pubblica(tabelle or ("regioni",), regioni, versione)
+
+
+# operazioni del registro delle modifiche (/changes)
+UPSERT, DELETE, RESET = "upsert", "delete", "reset"
+REGISTRO_GIORNI = int(os.getenv("REGISTRO_GIORNI", "30"))
+_ultima_pulizia = {"momento": 0.0}
+
+
+def _chiave_primaria(obj) -> tuple:
+    return tuple(getattr(obj, c.key) for c in obj.__table__.primary_key.columns)
+
+
+def _registra_modifiche(db: Session, model, chiavi, operazione: str = UPSERT):
+    """
+    Scrive nel registro delle modifiche una riga per chiave primaria (tuple di valori),
+    oppure una sola riga "reset" (chiavi=None: la tabella è stata ricostruita).
+    Va eseguita prima del commit, nella stessa transazione della scrittura:
+    se la scrittura viene annullata sparisce anche la sua traccia nel registro.
+    """
+    tabella = NOMI_TABELLE[model]
+    if chiavi is None:
+        righe = [{"tabella": tabella, "chiave": None, "operazione": RESET}]
+    else:
+        righe = [
+            {"tabella": tabella, "chiave": orjson.dumps(list(k)).decode(), "operazione": operazione}
+            for k in dict.fromkeys(chiavi)
+        ]
+    if not righe:
+        return
+    # lock sulla riga della sequenza fino al commit (vedi models.SequenzaRegistro)
+    db.execute(_istruzione_upsert(models.SequenzaRegistro, [{"id": 1, "scritture": 1}], ("id",), db, somma=True))
+    db.execute(insert(models.RegistroModifiche), righe)
+    _pulisci_registro(db)
+
+
+def _registra_oggetto(db: Session, obj, operazione: str = UPSERT):
+    """Come _registra_modifiche per un oggetto ORM (flush prima, per gli id autoincrement)."""
+    db.flush()
+    _registra_modifiche(db, type(obj), [_chiave_primaria(obj)], operazione)
+
+
+def _pulisci_registro(db: Session):
+    """Al massimo una volta l'ora elimina le voci più vecchie di REGISTRO_GIORNI (0 = mai)."""
+    adesso = time.time()
+    if REGISTRO_GIORNI <= 0 or adesso - _ultima_pulizia["momento"] < 3600:
+        return
+    _ultima_pulizia["momento"] = adesso
+    registro = models.RegistroModifiche
+    limite = datetime.utcnow() - timedelta(days=REGISTRO_GIORNI)
+    # l'ultima voce resta sempre: da lì /changes riconosce i client rimasti indietro
+    ultima = db.query(func.max(registro.id)).scalar()
+    db.execute(registro.__table__.delete().where(registro.momento < limite, registro.id < ultima))
+
+
+def _istruzione_upsert(model, righe: list, chiavi: tuple, db: Session, somma: bool = False):
+    """
+    INSERT multi-riga con aggiornamento delle righe già presenti (MySQL: ON DUPLICATE
+    KEY UPDATE, SQLite: ON CONFLICT DO UPDATE). Con somma=True i valori nuovi vengono
+    sommati a quelli esistenti invece di sostituirli (aggiornamenti incrementali).
+    """
+    tabella = model.__table__ if hasattr(model, "__table__") else model
+    aggiornabili = [k for k in righe[0] if k not in chiavi]
+    dialetto = db.get_bind().dialect.name
+    if dialetto == "mysql":
+        stmt = mysql.insert(tabella).values(righe)
+        nuovi = stmt.inserted
+    elif dialetto == "sqlite":
+        stmt = sqlite.insert(tabella).values(righe)
+        nuovi = stmt.excluded
+    else:
+        raise HTTPException(status_code=501, detail=f"Bulk upsert non supportato per {dialetto}")
+    valori = {k: (tabella.c[k] + nuovi[k]) if somma else nuovi[k] for k in aggiornabili}
+    if dialetto == "mysql":
+        return stmt.on_duplicate_key_update(valori)
+    return stmt.on_conflict_do_update(index_elements=list(chiavi), set_=valori)
+
+
+def _upsert_multiplo(model, righe: list, chiave, db: Session, prima_del_commit=None):
+    """
+    Inserisce o aggiorna tutte le righe con un solo INSERT multi-riga
+    (MySQL: ON DUPLICATE KEY UPDATE, SQLite: ON CONFLICT DO UPDATE) e un solo commit.
+    La chiave è il nome di una colonna o una tupla di colonne (es. id_regione, anno).
+    prima_del_commit(db) esegue altre scritture nella stessa transazione.
+    Lo stato di ogni riga si ricava con una SELECT delle chiavi già presenti,
+    senza refresh riga per riga. In caso di chiavi ripetute vale l'ultima riga.
+    Le chiavi primarie scritte finiscono nel registro delle modifiche.
+    """
+    chiavi = chiave if isinstance(chiave, tuple) else (chiave,)
+    per_chiave = {tuple(r[c] for c in chiavi): r for r in righe}
+    if not per_chiave:
+        return []
+    righe = list(per_chiave.values())
+    colonne = tuple_(*(getattr(model, c) for c in chiavi))
+    esistenti = set(db.query(*(getattr(model, c) for c in chiavi)).filter(colonne.in_(per_chiave)).all())
+
+    stmt = _istruzione_upsert(model, righe, chiavi, db)
+    primaria = tuple(model.__table__.primary_key.columns)
+    try:
+        db.execute(stmt)
+        if tuple(c.key for c in primaria) == chiavi:
+            _registra_modifiche(db, model, per_chiave)
+        else:
+            # upsert su una chiave UNIQUE (regioni per nome): servono gli id
+            _registra_modifiche(db, model, db.query(*primaria).filter(colonne.in_(per_chiave)).all())
+        if prima_del_commit is not None:
+            prima_del_commit(db)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Caricamento annullato: {e.orig}")
+
+    return [
+        {**dict(zip(chiavi, k)), "stato": "aggiornato" if k in esistenti else "inserito"}
+        for k in per_chiave
+    ]
+
+
+class _FloatLettura(TypeDecorator):
+    """Float in lettura per le colonne Numeric: niente Decimal, anche su SQLite."""
+    impl = Float
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else float(value)
+
+
+def _ultimo_anno(model):
+    """Subquery correlata: ultimo anno disponibile per la regione (risolta sulla chiave primaria)."""
+    recenti = model.__table__.alias()
+    return (
+        select(func.max(recenti.c.anno))
+        .where(recenti.c.id_regione == model.__table__.c.id_regione)
+        .scalar_subquery()
+    )
+
+
+def _filtra_periodo(stmt, model, periodo=None):
+    """
+    Filtro sugli anni per le tabelle annuali: periodo = (da, a), estremi inclusi
+    e facoltativi. Senza periodo resta solo l'ultimo anno di ogni regione.
+    """
+    anno = model.__table__.c.get("anno")
+    if anno is None:
+        if periodo is not None:
+            raise HTTPException(status_code=400, detail=f"Filtro per anno non disponibile per {model.__tablename__}")
+        return stmt
+    if periodo is None:
+        return stmt.where(anno == _ultimo_anno(model))
+    da, a = periodo
+    if da is not None:
+        stmt = stmt.where(anno >= da)
+    if a is not None:
+        stmt = stmt.where(anno <= a)
+    return stmt
+
+
+def _cursore(model, riga) -> str:
+    """Cursore keyset dell'ultima riga: valori della chiave primaria separati da ":"."""
+    return ":".join(str(riga[c.key]) for c in model.__table__.primary_key.columns)
+
+
+def _dopo_cursore(chiave, cursor):
+    """Condizione keyset (chiave) > cursor in ordine lessicografico, anche su un prefisso della chiave."""
+    n = min(len(chiave), len(cursor))
+    condizione = chiave[n - 1] > cursor[n - 1]
+    for colonna, valore in reversed(list(zip(chiave[:n - 1], cursor[:n - 1]))):
+        condizione = or_(colonna > valore, and_(colonna == valore, condizione))
+    return condizione
+
+
+def _select_proiezione(model, campi=None, limit=None, cursor=None, come_float=False, periodo=None, filtri=None):
+    """
+    SELECT con proiezione e paginazione keyset sulla chiave primaria (id_regione,
+    id_regione + anno, id_comune, ...): solo le colonne richieste (più la chiave),
+    a partire dalla prima riga successiva al cursore. filtri = coppie (colonna, valore).
+    Con come_float le colonne Numeric vengono lette come float invece che Decimal.
+    """
+    tabella = model.__table__
+    chiave = list(tabella.primary_key.columns)
+    if campi:
+        non_validi = [c for c in campi if c not in tabella.c]
+        if non_validi:
+            raise HTTPException(status_code=400, detail=f"Campi non validi: {', '.join(non_validi)}")
+        colonne = chiave + [tabella.c[c] for c in campi if tabella.c[c] not in chiave]
+    else:
+        colonne = list(tabella.c)
+    if come_float:
+        colonne = [
+            type_coerce(c, _FloatLettura).label(c.key) if isinstance(c.type, Numeric) else c
+            for c in colonne
+        ]
+
+    stmt = _filtra_periodo(select(*colonne).order_by(*chiave), model, periodo)
+    for colonna, valore in filtri or ():
+        stmt = stmt.where(tabella.c[colonna] == valore)
+    if cursor is not None:
+        stmt = stmt.where(_dopo_cursore(chiave, cursor))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def _leggi_colonne(model, db: Session, campi=None, limit=None, cursor=None, periodo=None, filtri=None) -> dict:
+    """Risultato in forma colonnare (nome colonna -> lista di valori), float per i Numeric."""
+    risultato = db.execute(_select_proiezione(model, campi, limit, cursor, come_float=True, periodo=periodo, filtri=filtri))
+    nomi = list(risultato.keys())
+    righe = risultato.all()
+    valori = list(zip(*righe)) if righe else [()] * len(nomi)
+    return {nome: list(v) for nome, v in zip(nomi, valori)}
+
+
+def _json_rapido(model, db: Session, campi=None, limit=None, cursor=None, periodo=None, filtri=None):
+    """
+    Percorso di lettura senza ORM: SELECT Core con float al posto dei Decimal,
+    righe come mapping serializzate subito in JSON con orjson.
+    Restituisce (corpo JSON, cursore successivo o None).
+    """
+    stmt = _select_proiezione(model, campi, limit, cursor, come_float=True, periodo=periodo, filtri=filtri)
+    righe = db.execute(stmt).mappings().all()
+    prossimo = _cursore(model, righe[-1]) if limit is not None and righe and len(righe) == limit else None
+    return orjson.dumps([dict(r) for r in righe], default=float), prossimo
+
+
+def _riga(obj) -> dict:
+    """Colonne di un oggetto ORM come dict (cacheabile, indipendente dalla sessione)."""
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
 
 # ==============================
 # REGIONI
 # ==============================
 
 PROBLEMA = "Regione non trovata"
-class RegioneService:
-    @staticmethod
-    def get_all(db: Session):
-        return db.query(models.Regioni).all()
 
+# tabelle collegate caricate insieme alla regione (LEFT OUTER JOIN nella stessa SELECT);
+# per quelle annuali solo la riga dell'ultimo anno, così il JOIN resta una riga per regione
+PROFILO_OPZIONI = [
+    joinedload(models.Regioni.morfologia),
+    joinedload(models.Regioni.emissioni_totali.and_(models.EmissioniTotali.anno == _ultimo_anno(models.EmissioniTotali))),
+    joinedload(models.Regioni.edifici.and_(models.Edifici.anno == _ultimo_anno(models.Edifici))),
+    joinedload(models.Regioni.industria.and_(models.Industria.anno == _ultimo_anno(models.Industria))),
+    joinedload(models.Regioni.mix.and_(models.MixEnergetico.anno == _ultimo_anno(models.MixEnergetico))),
+    joinedload(models.Regioni.assorbimenti),
+    joinedload(models.Regioni.azioni.and_(models.Azioni.anno == _ultimo_anno(models.Azioni))),
+]
+
+PROFILO_RELAZIONI = ("morfologia", "emissioni_totali", "edifici", "industria", "mix", "assorbimenti", "azioni")
+
+
+def _collegata(regione, relazione):
+    """Riga collegata alla regione: per le relazioni annuali la prima (ultimo anno caricato)."""
+    valore = getattr(regione, relazione)
+    if isinstance(valore, list):
+        return valore[0] if valore else None
+    return valore
+
+
+def _profilo(regione) -> dict:
+    dati = _riga(regione)
+    for relazione in PROFILO_RELAZIONI:
+        riga = _collegata(regione, relazione)
+        dati[relazione] = _riga(riga) if riga is not None else None
+    return schemas.RegioneProfilo.model_validate(dati).model_dump()
+
+class RegioneService:
     @staticmethod
+    @memoizza("regioni")
     def get_by_id(regione_id: int, db: Session):
         regione = db.query(models.Regioni).filter(models.Regioni.id_regione == regione_id).first()
         if not regione:
             raise HTTPException(status_code=404, detail=PROBLEMA)
-        return regione
+        return _riga(regione)
+
+    @staticmethod
+    @memoizza("profilo")
+    def get_profilo(regione_id: int, db: Session):
+        """Regione con tutte le tabelle collegate (ultimo anno), caricate in una sola query (JOIN)."""
+        regione = (
+            db.query(models.Regioni)
+            .options(*PROFILO_OPZIONI)
+            .filter(models.Regioni.id_regione == regione_id)
+            .first()
+        )
+        if not regione:
+            raise HTTPException(status_code=404, detail=PROBLEMA)
+        return _profilo(regione)
+
+    @staticmethod
+    @memoizza("profilo")
+    def get_profilo_by_nome(nome: str, db: Session):
+        """Come get_profilo, ma cerca la regione per nome (colonna UNIQUE)."""
+        regione = (
+            db.query(models.Regioni)
+            .options(*PROFILO_OPZIONI)
+            .filter(models.Regioni.nome == nome)
+            .first()
+        )
+        if not regione:
+            raise HTTPException(status_code=404, detail=PROBLEMA)
+        return _profilo(regione)
 
     @staticmethod
     def create(regione: schemas.RegioneCreate, db: Session):
         db_regione = models.Regioni(**regione.dict())
         db.add(db_regione)
+        _registra_oggetto(db, db_regione)
         db.commit()
+        _registra_scrittura(db=db, regioni=[db_regione.id_regione])
         db.refresh(db_regione)
         return db_regione
 
+    @staticmethod
+    def bulk_upsert(regioni: list, db: Session):
+        """Upsert per nome (colonna UNIQUE); gli id si leggono con una sola SELECT finale."""
+        esiti = _upsert_multiplo(models.Regioni, [r.dict() for r in regioni], "nome", db)
+        if esiti:
+            nomi = [e["nome"] for e in esiti]
+            ids = dict(
+                db.query(models.Regioni.nome, models.Regioni.id_regione)
+                .filter(models.Regioni.nome.in_(nomi))
+                .all()
+            )
+            for esito in esiti:
+                esito["id_regione"] = ids.get(esito["nome"])
+            _registra_scrittura(db=db, regioni=ids.values())
+        return esiti
+
     @staticmethod
     def update(regione_id: int, regione: schemas.RegioneCreate, db: Session):
         db_regione = db.query(models.Regioni).filter(models.Regioni.id_regione == regione_id).first()
@@ -40,7 +382,9 @@ class RegioneService:
             raise HTTPException(status_code=404, detail=PROBLEMA)
         for key, value in regione.dict().items():
             setattr(db_regione, key, value)
+        _registra_oggetto(db, db_regione)
         db.commit()
+        _registra_scrittura(db=db, regioni=[regione_id])
         db.refresh(db_regione)
         return db_regione
 
@@ -50,7 +394,9 @@ class RegioneService:
         if not regione:
             raise HTTPException(status_code=404, detail=PROBLEMA)
         db.delete(regione)
+        _registra_oggetto(db, regione, DELETE)
         db.commit()
+        _registra_scrittura(db=db, regioni=[regione_id])
         return {"message": "Regione eliminata con successo"}
 
 
@@ -58,176 +404,832 @@ class RegioneService:
 # MORFOLOGIA SUOLO
 # ==============================
 class MorfologiaService:
-    @staticmethod
-    def get_all(db: Session):
-        query = (
-            db.query(models.MorfologiaSuolo, models.Regioni.nome.label("nome"))
-            .join(models.Regioni, models.MorfologiaSuolo.id_regione == models.Regioni.id_regione)
-            .all()
-        )
-        return [
-            {
-                "id_regione": r.MorfologiaSuolo.id_regione,
-                "nome": r.nome,
-                "pianura_pct": r.MorfologiaSuolo.pianura_pct,
-                "collina_pct": r.MorfologiaSuolo.collina_pct,
-                "montagna_pct": r.MorfologiaSuolo.montagna_pct,
-                "agricolo_pct": r.MorfologiaSuolo.agricolo_pct,
-                "urbano_pct": r.MorfologiaSuolo.urbano_pct,
-                "forestale_pct": r.MorfologiaSuolo.forestale_pct
-            }
-            for r in query
-        ]
-
     @staticmethod
     def create(morf: schemas.MorfologiaSuoloCreate, db: Session):
         db_morf = models.MorfologiaSuolo(**morf.dict())
         db.add(db_morf)
+        _registra_oggetto(db, db_morf)
         db.commit()
+        _registra_scrittura("morfologia", db=db, regioni=[morf.id_regione])
         db.refresh(db_morf)
         return db_morf
 
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        esiti = _upsert_multiplo(models.MorfologiaSuolo, [r.dict() for r in righe], "id_regione", db)
+        if esiti:
+            _registra_scrittura("morfologia", db=db, regioni={r.id_regione for r in righe})
+        return esiti
 
 # ==============================
 # EMISSIONI TOTALI
 # ==============================
 class EmissioniService:
-    @staticmethod
-    def get_all(db: Session):
-        return db.query(models.EmissioniTotali).all()
-
     @staticmethod
     def create(emiss: schemas.EmissioniTotaliCreate, db: Session):
         db_emiss = models.EmissioniTotali(**emiss.dict())
         db.add(db_emiss)
+        _registra_oggetto(db, db_emiss)
         db.commit()
+        _registra_scrittura("emissioni", db=db, regioni=[emiss.id_regione])
         db.refresh(db_emiss)
         return db_emiss
 
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        esiti = _upsert_multiplo(models.EmissioniTotali, [r.dict() for r in righe], ("id_regione", "anno"), db)
+        if esiti:
+            _registra_scrittura("emissioni", db=db, regioni={r.id_regione for r in righe})
+        return esiti
 
 # ==============================
 # EDIFICI
 # ==============================
 class EdificiService:
-    @staticmethod
-    def get_all(db: Session):
-        query = (
-            db.query(models.Edifici, models.Regioni.nome.label("nome"))
-            .join(models.Regioni, models.Edifici.id_regione == models.Regioni.id_regione)
-            .all()
-        )
-        return [
-            {
-                "id_regione": r.Edifici.id_regione,
-                "nome": r.nome,
-                "consumo_medio_kwh_m2y": r.Edifici.consumo_medio_kwh_m2y,
-                "emissioni_procapite_tco2_ab": r.Edifici.emissioni_procapite_tco2_ab,
-                "quota_elettrico_pct": r.Edifici.quota_elettrico_pct,
-                "quota_ape_classe_a_pct": r.Edifici.quota_ape_classe_a_pct
-            }
-            for r in query
-        ]
-
     @staticmethod
     def create(ed: schemas.EdificiCreate, db: Session):
         db_ed = models.Edifici(**ed.dict())
         db.add(db_ed)
+        _registra_oggetto(db, db_ed)
         db.commit()
+        _registra_scrittura("edifici", db=db, regioni=[ed.id_regione])
         db.refresh(db_ed)
         return db_ed
 
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        esiti = _upsert_multiplo(models.Edifici, [r.dict() for r in righe], ("id_regione", "anno"), db)
+        if esiti:
+            _registra_scrittura("edifici", db=db, regioni={r.id_regione for r in righe})
+        return esiti
 
 # ==============================
 # INDUSTRIA
 # ==============================
 class IndustriaService:
-    @staticmethod
-    def get_all(db: Session):
-        query = (
-            db.query(models.Industria, models.Regioni.nome.label("nome"))
-            .join(models.Regioni, models.Industria.id_regione == models.Regioni.id_regione)
-            .all()
-        )
-        return [
-            {
-                "id_regione": r.Industria.id_regione,
-                "nome": r.nome,
-                "emissioni_per_valore_aggiunto_tco2_per_mln_eur": r.Industria.emissioni_per_valore_aggiunto_tco2_per_mln_eur,
-                "quota_elettrico_pct": r.Industria.quota_elettrico_pct
-            }
-            for r in query
-        ]
-
     @staticmethod
     def create(ind: schemas.IndustriaCreate, db: Session):
         db_ind = models.Industria(**ind.dict())
         db.add(db_ind)
+        _registra_oggetto(db, db_ind)
         db.commit()
+        _registra_scrittura("industria", db=db, regioni=[ind.id_regione])
         db.refresh(db_ind)
         return db_ind
 
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        esiti = _upsert_multiplo(models.Industria, [r.dict() for r in righe], ("id_regione", "anno"), db)
+        if esiti:
+            _registra_scrittura("industria", db=db, regioni={r.id_regione for r in righe})
+        return esiti
 
 # ==============================
 # MIX ENERGETICO
 # ==============================
 class MixService:
-    @staticmethod
-    def get_all(db: Session):
-        query = (
-            db.query(models.MixEnergetico, models.Regioni.nome.label("nome"))
-            .join(models.Regioni, models.MixEnergetico.id_regione == models.Regioni.id_regione)
-            .all()
-        )
-        return [
-            {
-                "id_regione": r.MixEnergetico.id_regione,
-                "nome": r.nome,
-                "carbone_pct": r.MixEnergetico.carbone_pct,
-                "petrolio_pct": r.MixEnergetico.petrolio_pct,
-                "gas_pct": r.MixEnergetico.gas_pct,
-                "rinnovabili_pct": r.MixEnergetico.rinnovabili_pct
-            }
-            for r in query
-        ]
-
     @staticmethod
     def create(mix: schemas.MixEnergeticoCreate, db: Session):
         db_mix = models.MixEnergetico(**mix.dict())
         db.add(db_mix)
+        _registra_oggetto(db, db_mix)
         db.commit()
+        _registra_scrittura("mix", db=db, regioni=[mix.id_regione])
         db.refresh(db_mix)
         return db_mix
 
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        esiti = _upsert_multiplo(models.MixEnergetico, [r.dict() for r in righe], ("id_regione", "anno"), db)
+        if esiti:
+            _registra_scrittura("mix", db=db, regioni={r.id_regione for r in righe})
+        return esiti
 
 # ==============================
 # ASSORBIMENTI
 # ==============================
 class AssorbimentiService:
-    @staticmethod
-    def get_all(db: Session):
-        return db.query(models.Assorbimenti).all()
-
     @staticmethod
     def create(ass: schemas.AssorbimentiCreate, db: Session):
         db_ass = models.Assorbimenti(**ass.dict())
         db.add(db_ass)
+        _registra_oggetto(db, db_ass)
         db.commit()
+        _registra_scrittura("assorbimenti", db=db, regioni=[ass.id_regione])
         db.refresh(db_ass)
         return db_ass
 
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        esiti = _upsert_multiplo(models.Assorbimenti, [r.dict() for r in righe], "id_regione", db)
+        if esiti:
+            _registra_scrittura("assorbimenti", db=db, regioni={r.id_regione for r in righe})
+        return esiti
 
 # ==============================
 # AZIONI
 # ==============================
 class AzioniService:
-    @staticmethod
-    def get_all(db: Session):
-        return db.query(models.Azioni).all()
-
     @staticmethod
     def create(az: schemas.AzioniCreate, db: Session):
         db_az = models.Azioni(**az.dict())
         db.add(db_az)
+        _registra_oggetto(db, db_az)
         db.commit()
+        _registra_scrittura("azioni", db=db, regioni=[az.id_regione])
         db.refresh(db_az)
-        return db_az
\ No newline at end of file
+        return db_az
+
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        esiti = _upsert_multiplo(models.Azioni, [r.dict() for r in righe], ("id_regione", "anno"), db)
+        if esiti:
+            _registra_scrittura("azioni", db=db, regioni={r.id_regione for r in righe})
+        return esiti
+
+# ==============================
+# TERRITORIO (province, comuni e aggregati)
+# ==============================
+
+PROVINCIA_NON_TROVATA = "Provincia non trovata"
+COMUNE_NON_TROVATO = "Comune non trovato"
+MISURE_COMUNE = ("popolazione", "superficie_kmq", "co2eq_t")
+LIVELLI_AGGREGATI = ("provincia", "regione", "nazione")
+
+
+def _contributo(comune: dict, segno: int = 1) -> dict:
+    """Contributo di un comune agli aggregati (segno -1 per toglierlo)."""
+    return {
+        "n_comuni": segno,
+        "popolazione": segno * int(comune.get("popolazione") or 0),
+        "superficie_kmq": segno * Decimal(str(comune.get("superficie_kmq") or 0)),
+        "co2eq_t": segno * Decimal(str(comune.get("co2eq_t") or 0)),
+    }
+
+
+def _incrementa_aggregati(db: Session, variazioni: list):
+    """
+    Applica ai roll-up le variazioni [(id_provincia, id_regione, contributo), ...]
+    con un solo INSERT che somma ai valori esistenti (provincia, regione e nazione).
+    Va eseguita prima del commit, nella stessa transazione della scrittura sui comuni.
+    Le righe rimaste senza comuni vengono eliminate (tombstone nel registro delle modifiche).
+    """
+    somme = {}
+    for id_provincia, id_regione, contributo in variazioni:
+        for chiave in (("provincia", id_provincia), ("regione", id_regione), ("nazione", 0)):
+            totale = somme.setdefault(chiave, dict.fromkeys(contributo, 0))
+            for misura, valore in contributo.items():
+                totale[misura] += valore
+    if not somme:
+        return
+    tabella = models.AggregatiTerritorio.__table__
+    chiave = tuple_(tabella.c.livello, tabella.c.id_territorio)
+    righe = [{"livello": l, "id_territorio": i, **totale} for (l, i), totale in somme.items()]
+    db.execute(_istruzione_upsert(models.AggregatiTerritorio, righe, ("livello", "id_territorio"), db, somma=True))
+    vuote = {
+        tuple(r) for r in db.execute(
+            select(tabella.c.livello, tabella.c.id_territorio).where(chiave.in_(list(somme)), tabella.c.n_comuni <= 0)
+        )
+    }
+    if vuote:
+        db.execute(tabella.delete().where(chiave.in_(list(vuote))))
+    _registra_modifiche(db, models.AggregatiTerritorio, [k for k in somme if k not in vuote])
+    _registra_modifiche(db, models.AggregatiTerritorio, vuote, DELETE)
+
+
+def _ricalcola_aggregati(db: Session):
+    """
+    Ricostruisce tutti i roll-up dai comuni con tre INSERT ... SELECT ... GROUP BY (senza commit).
+    Nel registro delle modifiche diventa un "reset" della tabella.
+    """
+    tabella = models.AggregatiTerritorio.__table__
+    comuni = models.Comuni.__table__.c
+    db.execute(tabella.delete())
+    _registra_modifiche(db, models.AggregatiTerritorio, None)
+    misure = [
+        func.count(),
+        func.coalesce(func.sum(comuni.popolazione), 0),
+        func.coalesce(func.sum(comuni.superficie_kmq), 0),
+        func.coalesce(func.sum(comuni.co2eq_t), 0),
+    ]
+    for livello, id_territorio in (("provincia", comuni.id_provincia), ("regione", comuni.id_regione), ("nazione", None)):
+        gruppo = select(literal(livello), id_territorio if id_territorio is not None else literal(0), *misure)
+        if id_territorio is not None:
+            gruppo = gruppo.group_by(id_territorio)
+        else:
+            gruppo = gruppo.having(func.count() > 0)
+        db.execute(tabella.insert().from_select(
+            ["livello", "id_territorio", "n_comuni", *MISURE_COMUNE], gruppo
+        ))
+
+
+class ProvinceService:
+    @staticmethod
+    def create(provincia: schemas.ProvinciaCreate, db: Session):
+        db_provincia = models.Province(**provincia.dict())
+        db.add(db_provincia)
+        try:
+            _registra_oggetto(db, db_provincia)
+            db.commit()
+        except IntegrityError as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=f"Provincia non valida: {e.orig}")
+        _registra_scrittura("province", db=db, regioni=[provincia.id_regione])
+        db.refresh(db_provincia)
+        return db_provincia
+
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        """
+        Upsert per id_provincia. Se una provincia cambia regione si aggiornano
+        i suoi comuni e si ricalcolano gli aggregati, nella stessa transazione.
+        """
+        dati = [r.dict() for r in righe]
+        attuali = dict(
+            db.query(models.Province.id_provincia, models.Province.id_regione)
+            .filter(models.Province.id_provincia.in_([d["id_provincia"] for d in dati]))
+            .all()
+        )
+        spostate = {
+            d["id_provincia"]: d["id_regione"] for d in dati
+            if d["id_provincia"] in attuali and attuali[d["id_provincia"]] != d["id_regione"]
+        }
+
+        def sposta_comuni(db):
+            spostati = db.query(models.Comuni.id_comune).filter(models.Comuni.id_provincia.in_(spostate)).all()
+            for id_provincia, id_regione in spostate.items():
+                db.query(models.Comuni).filter(models.Comuni.id_provincia == id_provincia).update({"id_regione": id_regione})
+            _registra_modifiche(db, models.Comuni, spostati)
+            _ricalcola_aggregati(db)
+
+        esiti = _upsert_multiplo(models.Province, dati, "id_provincia", db, sposta_comuni if spostate else None)
+        if esiti:
+            _registra_scrittura("province", *(("comuni", "aggregati") if spostate else ()), db=db,
+                                regioni={d["id_regione"] for d in dati} | {attuali[i] for i in spostate})
+        return esiti
+
+
+class ComuniService:
+    @staticmethod
+    def _regioni(id_province, db: Session) -> dict:
+        """id_provincia -> id_regione; 404 se una provincia non esiste."""
+        richieste = set(id_province)
+        trovate = dict(
+            db.query(models.Province.id_provincia, models.Province.id_regione)
+            .filter(models.Province.id_provincia.in_(richieste))
+            .all()
+        )
+        mancanti = richieste - set(trovate)
+        if mancanti:
+            raise HTTPException(status_code=404, detail=f"{PROVINCIA_NON_TROVATA}: {', '.join(map(str, sorted(mancanti)))}")
+        return trovate
+
+    @staticmethod
+    def _commit(db: Session, regioni):
+        try:
+            db.commit()
+        except IntegrityError as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=f"Comune non valido: {e.orig}")
+        _registra_scrittura("comuni", "aggregati", db=db, regioni=regioni)
+
+    @staticmethod
+    def create(comune: schemas.ComuneCreate, db: Session):
+        dati = comune.dict()
+        dati["id_regione"] = ComuniService._regioni([dati["id_provincia"]], db)[dati["id_provincia"]]
+        db_comune = models.Comuni(**dati)
+        db.add(db_comune)
+        _registra_oggetto(db, db_comune)
+        _incrementa_aggregati(db, [(dati["id_provincia"], dati["id_regione"], _contributo(dati))])
+        ComuniService._commit(db, [dati["id_regione"]])
+        db.refresh(db_comune)
+        return db_comune
+
+    @staticmethod
+    def update(comune_id: int, comune: schemas.ComuneBase, db: Session):
+        db_comune = db.get(models.Comuni, comune_id)
+        if not db_comune:
+            raise HTTPException(status_code=404, detail=COMUNE_NON_TROVATO)
+        vecchio = _riga(db_comune)
+        dati = comune.dict()
+        dati["id_regione"] = ComuniService._regioni([dati["id_provincia"]], db)[dati["id_provincia"]]
+        for key, value in dati.items():
+            setattr(db_comune, key, value)
+        _registra_oggetto(db, db_comune)
+        _incrementa_aggregati(db, [
+            (vecchio["id_provincia"], vecchio["id_regione"], _contributo(vecchio, -1)),
+            (dati["id_provincia"], dati["id_regione"], _contributo(dati)),
+        ])
+        ComuniService._commit(db, [vecchio["id_regione"], dati["id_regione"]])
+        db.refresh(db_comune)
+        return db_comune
+
+    @staticmethod
+    def delete(comune_id: int, db: Session):
+        db_comune = db.get(models.Comuni, comune_id)
+        if not db_comune:
+            raise HTTPException(status_code=404, detail=COMUNE_NON_TROVATO)
+        vecchio = _riga(db_comune)
+        db.delete(db_comune)
+        _registra_oggetto(db, db_comune, DELETE)
+        _incrementa_aggregati(db, [(vecchio["id_provincia"], vecchio["id_regione"], _contributo(vecchio, -1))])
+        ComuniService._commit(db, [vecchio["id_regione"]])
+        return {"message": "Comune eliminato con successo"}
+
+    @staticmethod
+    def bulk_upsert(righe: list, db: Session):
+        """
+        Upsert per id_comune con una SELECT dei valori precedenti: gli aggregati
+        ricevono la differenza (nuovo - vecchio) nella stessa transazione.
+        """
+        per_id = {r.id_comune: r.dict() for r in righe}
+        if not per_id:
+            return []
+        regioni = ComuniService._regioni([d["id_provincia"] for d in per_id.values()], db)
+        colonne = models.Comuni.__table__.c
+        precedenti = {
+            r["id_comune"]: dict(r)
+            for r in db.execute(select(colonne).where(colonne.id_comune.in_(per_id))).mappings()
+        }
+        variazioni = []
+        for id_comune, dati in per_id.items():
+            dati["id_regione"] = regioni[dati["id_provincia"]]
+            vecchio = precedenti.get(id_comune)
+            if vecchio:
+                variazioni.append((vecchio["id_provincia"], vecchio["id_regione"], _contributo(vecchio, -1)))
+            variazioni.append((dati["id_provincia"], dati["id_regione"], _contributo(dati)))
+
+        esiti = _upsert_multiplo(
+            models.Comuni, list(per_id.values()), "id_comune", db,
+            lambda db: _incrementa_aggregati(db, variazioni),
+        )
+        _registra_scrittura("comuni", "aggregati", db=db, regioni={id_regione for _, id_regione, _ in variazioni})
+        return esiti
+
+
+class AggregatiService:
+    @staticmethod
+    def ricalcola(db: Session):
+        """Ricostruzione completa dei roll-up (dopo import esterni o per verifica)."""
+        _ricalcola_aggregati(db)
+        db.commit()
+        _registra_scrittura("aggregati", db=db)
+        return {"message": "Aggregati ricalcolati"}
+
+# ==============================
+# SNAPSHOT (tutte le tabelle, formato colonnare)
+# ==============================
+
+# chiave nel payload -> relazione su models.Regioni (per le tabelle annuali l'ultimo anno)
+SNAPSHOT_TABELLE = {
+    "morfologia": "morfologia",
+    "emissioni": "emissioni_totali",
+    "edifici": "edifici",
+    "industria": "industria",
+    "mix": "mix",
+    "assorbimenti": "assorbimenti",
+    "azioni": "azioni",
+}
+
+
+def _colonne(model):
+    return [c.key for c in model.__table__.columns if c.key != "id_regione"]
+
+
+def _valore_json(v):
+    return float(v) if isinstance(v, Decimal) else v
+
+
+class SnapshotService:
+    """
+    Costruisce l'intero dataset in formato colonnare: un array per colonna,
+    righe allineate sull'array "id_regione" (None dove la tabella non ha dati).
+    Le tabelle annuali contengono l'ultimo anno di ogni regione (colonna "anno").
+    Il JSON viene generato una sola volta per versione dei dati e tenuto nella cache
+    delle letture: le richieste concorrenti attendono la stessa costruzione senza
+    tenere un lock durante le query (anche sul loop asyncio con ASYNC_DB=1).
+    """
+    @staticmethod
+    def get(db: Session) -> bytes:
+        versione = versione_dati.corrente()
+        return cache_risultati.leggi(("snapshot", versione), lambda: SnapshotService._costruisci(versione, db))
+
+    @staticmethod
+    def _costruisci(versione: int, db: Session) -> bytes:
+        regioni = (
+            db.query(models.Regioni)
+            .options(*PROFILO_OPZIONI)
+            .order_by(models.Regioni.id_regione)
+            .all()
+        )
+        tabelle = {"regioni": {col: [] for col in _colonne(models.Regioni)}}
+        for chiave, relazione in SNAPSHOT_TABELLE.items():
+            model = getattr(models.Regioni, relazione).property.mapper.class_
+            tabelle[chiave] = {col: [] for col in _colonne(model)}
+
+        for regione in regioni:
+            for col, valori in tabelle["regioni"].items():
+                valori.append(_valore_json(getattr(regione, col)))
+            for chiave, relazione in SNAPSHOT_TABELLE.items():
+                riga = _collegata(regione, relazione)
+                for col, valori in tabelle[chiave].items():
+                    valori.append(_valore_json(getattr(riga, col)) if riga is not None else None)
+
+        payload = {
+            "versione": versione,
+            "id_regione": [r.id_regione for r in regioni],
+            "tabelle": tabelle,
+        }
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+# ==============================
+# LETTURE RAPIDE (JSON pre-serializzato, Arrow / Parquet)
+# ==============================
+
+# nome dell'endpoint -> modello
+TABELLE = {
+    "regioni": models.Regioni,
+    "morfologia": models.MorfologiaSuolo,
+    "emissioni": models.EmissioniTotali,
+    "edifici": models.Edifici,
+    "industria": models.Industria,
+    "mix": models.MixEnergetico,
+    "assorbimenti": models.Assorbimenti,
+    "azioni": models.Azioni,
+    "province": models.Province,
+    "comuni": models.Comuni,
+    "aggregati": models.AggregatiTerritorio,
+}
+NOMI_TABELLE = {model: nome for nome, model in TABELLE.items()}
+
+
+class TabellareService:
+    @staticmethod
+    def colonne(tabella: str, db: Session, campi=None, limit=None, cursor=None, periodo=None, filtri=None) -> dict:
+        return cache_risultati.leggi(
+            (tabella, "colonne", campi, limit, cursor, periodo, filtri),
+            lambda: _leggi_colonne(TABELLE[tabella], db, campi, limit, cursor, periodo, filtri),
+        )
+
+
+class LetturaRapidaService:
+    """
+    Liste già serializzate in JSON (bytes), da restituire così come sono:
+    niente idratazione ORM, niente Decimal, niente seconda validazione del response_model.
+    """
+    @staticmethod
+    def json(tabella: str, db: Session, campi=None, limit=None, cursor=None, periodo=None, filtri=None):
+        return cache_risultati.leggi(
+            (tabella, "json", campi, limit, cursor, periodo, filtri),
+            lambda: _json_rapido(TABELLE[tabella], db, campi, limit, cursor, periodo, filtri),
+        )
+
+
+# ==============================
+# EXPORT IN STREAMING (NDJSON / CSV)
+# ==============================
+
+RIGHE_PER_BLOCCO = 1000
+
+
+def _blocco_ndjson(nomi, righe) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(nomi, r)), option=orjson.OPT_APPEND_NEWLINE) for r in righe)
+
+
+def _blocco_csv(nomi, righe) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(righe)
+    return buffer.getvalue().encode("utf-8")
+
+
+class ExportService:
+    FORMATI = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+    @staticmethod
+    def righe(tabella: str, apri_sessione, formato: str = "ndjson", campi=None, cursor=None, periodo=None):
+        """
+        Generatore dei blocchi di byte dell'export, senza cache e senza limite di righe.
+        Apre e chiude da sé la sessione (quella della route è già chiusa quando parte
+        lo streaming) e legge con un cursore lato server (yield_per): in memoria c'è
+        un solo blocco di RIGHE_PER_BLOCCO righe alla volta. Le tabelle annuali
+        esportano tutti gli anni se non si indica un periodo.
+        """
+        model = TABELLE[tabella]
+        if periodo is None and "anno" in model.__table__.c:
+            periodo = (None, None)
+        # costruita prima di aprire la sessione: i campi non validi danno 400 subito
+        stmt = _select_proiezione(model, campi, cursor=cursor, come_float=True, periodo=periodo)
+        blocco = _blocco_csv if formato == "csv" else _blocco_ndjson
+
+        def genera():
+            db = apri_sessione()
+            try:
+                risultato = db.execute(stmt.execution_options(yield_per=RIGHE_PER_BLOCCO))
+                nomi = list(risultato.keys())
+                if formato == "csv":
+                    yield _blocco_csv(nomi, [nomi])
+                for righe in risultato.partitions():
+                    yield blocco(nomi, righe)
+            finally:
+                db.close()
+
+        return genera()
+
+
+# ==============================
+# CONFRONTO (N regioni x M indicatori)
+# ==============================
+
+# tabelle con indicatori numerici confrontabili, in ordine di precedenza dei nomi
+TABELLE_INDICATORI = ("regioni", "morfologia", "emissioni", "edifici", "industria", "mix", "azioni")
+
+
+def _registro_indicatori() -> dict:
+    """
+    Nome indicatore -> (endpoint, colonna) per ogni colonna Numeric delle tabelle
+    di TABELLE_INDICATORI. Se il nome è già usato da una tabella precedente
+    si aggiunge il suffisso dell'endpoint (es. quota_elettrico_pct_industria).
+    """
+    registro = {}
+    for endpoint in TABELLE_INDICATORI:
+        for colonna in TABELLE[endpoint].__table__.c:
+            if not isinstance(colonna.type, Numeric):
+                continue
+            nome = colonna.key if colonna.key not in registro else f"{colonna.key}_{endpoint}"
+            registro[nome] = (endpoint, colonna.key)
+    return registro
+
+
+INDICATORI = _registro_indicatori()
+
+
+class ConfrontoService:
+    @staticmethod
+    @memoizza("confronto")
+    def get(regioni: tuple, indicatori: tuple, db: Session, anno=None) -> bytes:
+        """
+        Solo le celle richieste, con una sola SELECT: regioni in LEFT JOIN con le
+        tabelle che contengono gli indicatori (ultimo anno o anno indicato).
+        Le righe seguono l'ordine delle regioni richieste.
+        """
+        sconosciuti = [i for i in indicatori if i not in INDICATORI]
+        if sconosciuti:
+            raise HTTPException(status_code=400, detail=f"Indicatori non validi: {', '.join(sconosciuti)}")
+
+        tabella_regioni = models.Regioni.__table__
+        colonne = [tabella_regioni.c.id_regione, tabella_regioni.c.nome]
+        join = tabella_regioni
+        unite = {"regioni": tabella_regioni}
+        for indicatore in indicatori:
+            endpoint, colonna = INDICATORI[indicatore]
+            if endpoint not in unite:
+                model = TABELLE[endpoint]
+                tabella = model.__table__
+                condizione = tabella.c.id_regione == tabella_regioni.c.id_regione
+                if "anno" in tabella.c:
+                    condizione = and_(condizione, tabella.c.anno == (anno if anno is not None else _ultimo_anno(model)))
+                join = join.outerjoin(tabella, condizione)
+                unite[endpoint] = tabella
+            colonne.append(type_coerce(unite[endpoint].c[colonna], _FloatLettura).label(indicatore))
+
+        stmt = select(*colonne).select_from(join).where(tabella_regioni.c.nome.in_(regioni))
+        righe = {r["nome"]: dict(r) for r in db.execute(stmt).mappings()}
+        mancanti = [r for r in regioni if r not in righe]
+        if mancanti:
+            raise HTTPException(status_code=404, detail=f"Regioni non trovate: {', '.join(mancanti)}")
+        return orjson.dumps([righe[r] for r in regioni])
+
+
+# ==============================
+# CLASSIFICHE (materializzate)
+# ==============================
+
+def _ricalcola_classifiche(db: Session, tabelle=None):
+    """
+    Ricalcola posizione, percentile e z-score degli indicatori delle tabelle indicate
+    (tutti se tabelle è None) con un solo passaggio vettoriale su un DataFrame
+    regioni x indicatori, poi sostituisce le righe in `classifiche` e fa commit.
+    Base dati: ultimo anno di ogni regione per le tabelle annuali.
+    Restituisce False se le tabelle non hanno indicatori (nessuna scrittura).
+    """
+    per_tabella = {}
+    for nome, (endpoint, colonna) in INDICATORI.items():
+        if tabelle is None or endpoint in tabelle:
+            per_tabella.setdefault(endpoint, {})[colonna] = nome
+    if not per_tabella:
+        return False
+
+    # indice esplicito: una tabella vuota lascia le sue colonne (tutte NaN), così le
+    # righe vecchie dei suoi indicatori vengono comunque cancellate
+    valori = pd.DataFrame(index=pd.Index([], name="id_regione"))
+    for endpoint, colonne in per_tabella.items():
+        stmt = _select_proiezione(TABELLE[endpoint], campi=tuple(colonne), come_float=True)
+        parziale = pd.DataFrame(db.execute(stmt).mappings().all(), columns=["id_regione", *colonne])
+        parziale = parziale.set_index("id_regione")[list(colonne)].rename(columns=colonne)
+        valori = valori.join(parziale, how="outer")
+    valori = valori.astype(float)
+
+    posizione = valori.rank(ascending=False, method="min")
+    percentile = valori.rank(method="max", pct=True) * 100
+    deviazione = valori.std(ddof=0).replace(0, float("nan"))
+    z_score = (valori - valori.mean()) / deviazione
+
+    lunghe = pd.concat(
+        [
+            pd.DataFrame({"indicatore": nome, "valore": valori[nome], "posizione": posizione[nome],
+                          "percentile": percentile[nome], "z_score": z_score[nome]})
+            for nome in valori.columns
+        ]
+    ).dropna(subset=["valore"]).reset_index()
+    lunghe["posizione"] = lunghe["posizione"].astype(int)
+    lunghe["z_score"] = lunghe["z_score"].astype(object).where(lunghe["z_score"].notna(), None)
+    righe = lunghe.to_dict("records")
+
+    tabella = models.Classifiche.__table__
+    db.execute(tabella.delete().where(tabella.c.indicatore.in_(list(valori.columns))))
+    if righe:
+        db.execute(tabella.insert(), righe)
+    # le classifiche servite cambiano: nuova versione condivisa (ETag) anche senza righe nel registro
+    db.execute(_istruzione_upsert(models.SequenzaRegistro, [{"id": 1, "scritture": 1}], ("id",), db, somma=True))
+    db.commit()
+    return True
+
+
+CLASSIFICHE_RITARDO_S = float(os.getenv("CLASSIFICHE_RITARDO_S", "0.5"))
+
+
+class RicalcoloClassifiche:
+    """
+    Ricalcolo delle classifiche fuori dalle richieste di scrittura.
+
+    Le scritture segnalano le tabelle toccate; un solo thread le accumula per
+    CLASSIFICHE_RITARDO_S secondi e le ricalcola insieme con una sessione propria
+    sul primario, quindi un caricamento a raffica costa un ricalcolo e la risposta
+    non attende pandas. Al termine passa da _registra_scrittura("classifiche").
+    Un errore finisce nel log (logger can.services) e in
+    can_rankings_recomputes_total{esito="errore"}; la scrittura successiva o
+    POST /classifica/ricalcola riprovano.
+    """
+
+    def __init__(self, ritardo: float = CLASSIFICHE_RITARDO_S):
+        self.ritardo = ritardo
+        self._condizione = threading.Condition()
+        self._tabelle = set()       # None = tutti gli indicatori
+        self._in_corso = False
+
+    def segnala(self, tabelle=None):
+        """Tabelle scritte (None = tutte); quelle senza indicatori (province, comuni...) si ignorano."""
+        if tabelle is not None:
+            tabelle = [t for t in tabelle if t in TABELLE_INDICATORI]
+            if not tabelle:
+                return
+        with self._condizione:
+            if tabelle is None:
+                self._tabelle.add(None)
+            else:
+                self._tabelle.update(tabelle)
+            if not self._in_corso:
+                self._in_corso = True
+                threading.Thread(target=self._esegui, name="can-classifiche", daemon=True).start()
+
+    def attendi(self, timeout: float = None) -> bool:
+        """Attende la fine dei ricalcoli pianificati (test e spegnimento); False se scade il timeout."""
+        with self._condizione:
+            return self._condizione.wait_for(lambda: not self._in_corso, timeout)
+
+    def _esegui(self):
+        time.sleep(self.ritardo)
+        while True:
+            with self._condizione:
+                tabelle, self._tabelle = self._tabelle, set()
+                if not tabelle:
+                    self._in_corso = False
+                    self._condizione.notify_all()
+                    return
+            try:
+                with SessionLocal() as db:
+                    ricalcolate = _ricalcola_classifiche(db, None if None in tabelle else tabelle)
+            except Exception:
+                ricalcoli_classifiche.incrementa(esito="errore")
+                logger.exception("Ricalcolo delle classifiche non riuscito (tabelle: %s)",
+                                 "tutte" if None in tabelle else ", ".join(sorted(tabelle)))
+                continue
+            if ricalcolate:
+                ricalcoli_classifiche.incrementa(esito="ok")
+                _registra_scrittura("classifiche")
+
+
+ricalcolo_classifiche = RicalcoloClassifiche()
+
+
+class ClassificaService:
+    @staticmethod
+    @memoizza("classifiche")
+    def get(indicatore: str, db: Session, regione=None) -> bytes:
+        """
+        Classifica già calcolata di un indicatore, ordinata per posizione
+        (oppure la sola riga della regione indicata per nome).
+        """
+        if indicatore not in INDICATORI:
+            raise HTTPException(status_code=404, detail=f"Indicatore non valido: {indicatore}")
+        classifiche = models.Classifiche.__table__
+        regioni = models.Regioni.__table__
+        stmt = (
+            select(classifiche.c.id_regione, regioni.c.nome, classifiche.c.valore, classifiche.c.posizione,
+                   classifiche.c.percentile, classifiche.c.z_score)
+            .join(regioni, regioni.c.id_regione == classifiche.c.id_regione)
+            .where(classifiche.c.indicatore == indicatore)
+            .order_by(classifiche.c.posizione, classifiche.c.id_regione)
+        )
+        if regione is not None:
+            stmt = stmt.where(regioni.c.nome == regione)
+        righe = [dict(r) for r in db.execute(stmt).mappings()]
+        if regione is not None and not righe:
+            raise HTTPException(status_code=404, detail=f"Nessun valore di {indicatore} per {regione}")
+        return orjson.dumps(righe)
+
+    @staticmethod
+    def ricalcola(db: Session):
+        _ricalcola_classifiche(db)
+        _registra_scrittura("classifiche")
+        return {"message": "Classifiche ricalcolate"}
+
+    @staticmethod
+    def inizializza():
+        """
+        All'avvio dell'API: se la tabella è vuota (primo avvio, dati caricati da
+        popola_tabelle.py) pianifica il ricalcolo completo, senza bloccare l'avvio.
+        """
+        try:
+            with SessionLocal() as db:
+                vuota = db.execute(select(models.Classifiche.indicatore).limit(1)).first() is None
+        except SQLAlchemyError:
+            logger.warning("Classifiche non verificate all'avvio", exc_info=True)
+            return
+        if vuota:
+            ricalcolo_classifiche.segnala()
+
+
+# ==============================
+# REGISTRO DELLE MODIFICHE (sincronizzazione incrementale)
+# ==============================
+
+class ModificheService:
+    """
+    Modifiche successive a una versione (id del registro), compattate per chiave:
+    di ogni riga resta solo l'ultima operazione, con i valori attuali per gli upsert
+    e la sola chiave per le eliminazioni (tombstone). Un "reset" indica una tabella
+    ricostruita per intero, da riscaricare con /export/{tabella}.
+    """
+    @staticmethod
+    def versione(db: Session) -> int:
+        return db.query(func.max(models.RegistroModifiche.id)).scalar() or 0
+
+    @staticmethod
+    def get(since: int, db: Session, limit: int = schemas.LIMIT_MAX) -> bytes:
+        registro = models.RegistroModifiche
+        primo, ultimo = db.query(func.min(registro.id), func.max(registro.id)).one()
+        if since > (ultimo or 0) or (primo is not None and since < primo - 1):
+            raise HTTPException(status_code=410, detail="Versione non più disponibile nel registro: risincronizzare da /export")
+
+        voci = db.execute(
+            select(registro.id, registro.tabella, registro.chiave, registro.operazione)
+            .where(registro.id > since).order_by(registro.id).limit(limit + 1)
+        ).all()
+        altre = len(voci) > limit
+        voci = voci[:limit]
+
+        ultime = {}
+        for voce in voci:
+            if voce.operazione == RESET:
+                ultime = {k: v for k, v in ultime.items() if k[0] != voce.tabella}
+            ultime[(voce.tabella, voce.chiave)] = voce
+        modifiche = sorted(ultime.values(), key=lambda v: v.id)
+
+        attuali = {}
+        for tabella in {v.tabella for v in modifiche if v.operazione == UPSERT}:
+            model = TABELLE[tabella]
+            primaria = list(model.__table__.primary_key.columns)
+            chiavi = [tuple(orjson.loads(v.chiave)) for v in modifiche if v.tabella == tabella and v.operazione == UPSERT]
+            stmt = _select_proiezione(model, come_float=True, periodo=(None, None) if "anno" in model.__table__.c else None)
+            for riga in db.execute(stmt.where(tuple_(*primaria).in_(chiavi))).mappings():
+                attuali[(tabella, tuple(riga[c.key] for c in primaria))] = dict(riga)
+
+        risultato = []
+        for voce in modifiche:
+            if voce.operazione == RESET:
+                risultato.append({"table": voce.tabella, "op": RESET})
+                continue
+            model = TABELLE[voce.tabella]
+            valori = tuple(orjson.loads(voce.chiave))
+            chiave = dict(zip((c.key for c in model.__table__.primary_key.columns), valori))
+            riga = attuali.get((voce.tabella, valori)) if voce.operazione == UPSERT else None
+            if riga is None:
+                # eliminata (anche da una modifica successiva a questa pagina): tombstone
+                risultato.append({"table": voce.tabella, "op": DELETE, "key": chiave})
+            else:
+                risultato.append({"table": voce.tabella, "op": UPSERT, "key": chiave, "row": riga})
+
+        versione = voci[-1].id if voci else since
+        return orjson.dumps({"since": since, "version": versione, "more": altre, "changes": risultato}, default=float)
@@ -0,0 +1,89 @@
+"""
+Versioni async dei servizi, usate dalle rotte di routes_async.py (ASYNC_DB=1).
+
+Ogni metodo esegue il corrispondente metodo sincrono di services.py dentro
+AsyncSession.run_sync: la logica (query, cache, invalidazioni) resta una sola,
+ma l'I/O verso il DB passa dal driver async e non occupa thread del threadpool.
+"""
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from services import (
+    RegioneService,
+    MorfologiaService,
+    EmissioniService,
+    EdificiService,
+    IndustriaService,
+    MixService,
+    AssorbimentiService,
+    AzioniService,
+    SnapshotService,
+    TabellareService,
+    LetturaRapidaService
+)
+
+
+def _async(metodo):
+    """Adatta un metodo di servizio (sessione come ultimo argomento) a una AsyncSession."""
+    async def wrapper(*args, **kwargs):
+        *argomenti, db = args
+        return await db.run_sync(lambda sessione: metodo(*argomenti, sessione, **kwargs))
+    wrapper.__name__ = metodo.__name__
+    wrapper.__doc__ = metodo.__doc__
+    return staticmethod(wrapper)
+
+
+class RegioneServiceAsync:
+    get_by_id = _async(RegioneService.get_by_id)
+    get_profilo = _async(RegioneService.get_profilo)
+    get_profilo_by_nome = _async(RegioneService.get_profilo_by_nome)
+    create = _async(RegioneService.create)
+    bulk_upsert = _async(RegioneService.bulk_upsert)
+    update = _async(RegioneService.update)
+    delete = _async(RegioneService.delete)
+
+
+class MorfologiaServiceAsync:
+    create = _async(MorfologiaService.create)
+    bulk_upsert = _async(MorfologiaService.bulk_upsert)
+
+
+class EmissioniServiceAsync:
+    create = _async(EmissioniService.create)
+    bulk_upsert = _async(EmissioniService.bulk_upsert)
+
+
+class EdificiServiceAsync:
+    create = _async(EdificiService.create)
+    bulk_upsert = _async(EdificiService.bulk_upsert)
+
+
+class IndustriaServiceAsync:
+    create = _async(IndustriaService.create)
+    bulk_upsert = _async(IndustriaService.bulk_upsert)
+
+
+class MixServiceAsync:
+    create = _async(MixService.create)
+    bulk_upsert = _async(MixService.bulk_upsert)
+
+
+class AssorbimentiServiceAsync:
+    create = _async(AssorbimentiService.create)
+    bulk_upsert = _async(AssorbimentiService.bulk_upsert)
+
+
+class AzioniServiceAsync:
+    create = _async(AzioniService.create)
+    bulk_upsert = _async(AzioniService.bulk_upsert)
+
+
+class SnapshotServiceAsync:
+    get = _async(SnapshotService.get)
+
+
+class TabellareServiceAsync:
+    colonne = _async(TabellareService.colonne)
+
+
+class LetturaRapidaServiceAsync:
+    json = _async(LetturaRapidaService.json)
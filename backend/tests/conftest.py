@@ -0,0 +1,74 @@
+"""
+Configurazione comune dei test: database SQLite temporaneo (mai quello di
+URL_PASSWORD_DB dell'ambiente), schema creato all'avvio dell'app, limiti per
+client disattivati (i test del limitatore costruiscono il middleware a parte) e
+versione condivisa dell'ETag riletta a ogni richiesta.
+
+I test della modalità async (ASYNC_DB=1) e delle repliche girano in un processo
+separato, perché ASYNC_DB e REPLICHE_URL_DB vengono letti all'import di database.py.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+CARTELLA_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CARTELLA_BACKEND)
+
+_CARTELLA_DB = tempfile.mkdtemp(prefix="can_test_")
+os.environ["URL_PASSWORD_DB"] = f"sqlite:///{os.path.join(_CARTELLA_DB, 'test.db')}"
+os.environ["SCHEMA_AVVIO"] = "crea"
+os.environ["LIMITE_RICHIESTE_S"] = "0"
+os.environ["ETAG_VERIFICA_S"] = "0"
+os.environ.pop("REPLICHE_URL_DB", None)
+os.environ.pop("ASYNC_DB", None)
+
+
+@pytest.fixture(scope="session")
+def app():
+    from main import app
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """TestClient su un database vuoto, con cache e versione dei dati azzerate."""
+    from fastapi.testclient import TestClient
+    import models
+    from cache import cache_risultati
+    from database import engine
+    from services import ricalcolo_classifiche
+
+    with TestClient(app) as c:
+        ricalcolo_classifiche.attendi(10)
+        models.Base.metadata.drop_all(engine)
+        models.Base.metadata.create_all(engine)
+        cache_risultati.svuota()
+        yield c
+        ricalcolo_classifiche.attendi(10)
+
+
+def esegui_processo(codice: str, timeout: float = 60, **ambiente_extra) -> str:
+    """
+    Esegue il codice in un interprete separato con un database nuovo e le variabili
+    d'ambiente indicate (lette all'import di database.py); restituisce lo stdout.
+    """
+    ambiente = dict(os.environ)
+    ambiente["URL_PASSWORD_DB"] = f"sqlite:///{tempfile.mktemp(suffix='.db', dir=_CARTELLA_DB)}"
+    ambiente["PYTHONPATH"] = CARTELLA_BACKEND
+    ambiente.update(ambiente_extra)
+    try:
+        esito = subprocess.run([sys.executable, "-c", codice], cwd=CARTELLA_BACKEND, env=ambiente,
+                               capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        pytest.fail(f"Processo bloccato oltre {timeout} s (deadlock del loop?)")
+    assert esito.returncode == 0, esito.stderr[-3000:]
+    return esito.stdout
+
+
+def esegui_async(codice: str, timeout: float = 60) -> str:
+    """Come esegui_processo con ASYNC_DB=1. Un blocco del loop fa scadere il timeout (test fallito)."""
+    return esegui_processo(codice, timeout, ASYNC_DB="1")
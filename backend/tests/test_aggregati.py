@@ -0,0 +1,48 @@
+"""Roll-up dei comuni (aggregati_territorio) aggiornati a ogni scrittura."""
+
+
+def _territorio(client):
+    id_regione = client.post("/regioni", json={"nome": "Umbria"}).json()["id_regione"]
+    for id_provincia, sigla in ((54, "PG"), (55, "TR")):
+        client.post("/province", json={"id_provincia": id_provincia, "id_regione": id_regione,
+                                       "sigla": sigla, "nome": sigla})
+    for id_comune, id_provincia, popolazione in ((54039, 54, 160000), (54001, 54, 3000), (55032, 55, 105000)):
+        client.post("/comuni", json={"id_comune": id_comune, "id_provincia": id_provincia,
+                                     "nome": str(id_comune), "popolazione": popolazione})
+    return id_regione
+
+
+def _per_territorio(client, livello):
+    return {r["id_territorio"]: r for r in client.get(f"/aggregati/{livello}").json()}
+
+
+def test_somme_per_livello(client):
+    id_regione = _territorio(client)
+    province = _per_territorio(client, "provincia")
+    assert (province[54]["n_comuni"], province[54]["popolazione"]) == (2, 163000)
+    assert _per_territorio(client, "regione")[id_regione]["n_comuni"] == 3
+    assert _per_territorio(client, "nazione")[0]["popolazione"] == 268000
+
+
+def test_riga_eliminata_senza_comuni(client):
+    id_regione = _territorio(client)
+    version = client.get("/changes/version").json()["version"]
+
+    assert client.delete("/comuni/55032").status_code == 200
+    assert set(_per_territorio(client, "provincia")) == {54}
+    assert _per_territorio(client, "regione")[id_regione]["n_comuni"] == 2
+
+    modifiche = client.get("/changes", params={"since": version}).json()["changes"]
+    assert {"table": "aggregati", "op": "delete", "key": {"livello": "provincia", "id_territorio": 55}} in modifiche
+
+    for id_comune in (54039, 54001):
+        client.delete(f"/comuni/{id_comune}")
+    for livello in ("provincia", "regione", "nazione"):
+        assert _per_territorio(client, livello) == {}
+
+
+def test_comune_spostato_svuota_la_provincia(client):
+    _territorio(client)
+    client.put("/comuni/55032", json={"id_provincia": 54, "nome": "Terni", "popolazione": 105000})
+    province = _per_territorio(client, "provincia")
+    assert set(province) == {54} and province[54]["n_comuni"] == 3
@@ -0,0 +1,49 @@
+"""Dimensione temporale delle tabelle annuali: ultimo anno per regione, ?anno=, ?da=&a=."""
+
+import pytest
+
+
+def _serie(client):
+    """Regione A con dati 2020-2023, regione B ferma al 2021."""
+    a, b = (e["id_regione"] for e in client.post("/regioni/bulk", json=[{"nome": "A"}, {"nome": "B"}]).json())
+    client.post("/emissioni/bulk", json=[
+        {"id_regione": a, "anno": anno, "co2eq_mln_t": float(anno)} for anno in (2020, 2021, 2022, 2023)
+    ] + [
+        {"id_regione": b, "anno": anno, "co2eq_mln_t": float(anno)} for anno in (2020, 2021)
+    ])
+    return a, b
+
+
+def _anni(client, **params):
+    risposta = client.get("/emissioni", params=params)
+    assert risposta.status_code == 200
+    return [(r["id_regione"], r["anno"]) for r in risposta.json()]
+
+
+def test_ultimo_anno_di_ogni_regione(client):
+    a, b = _serie(client)
+    assert _anni(client) == [(a, 2023), (b, 2021)]
+    profilo = client.get(f"/regioni/{b}/profilo").json()
+    assert profilo["emissioni_totali"]["anno"] == 2021
+
+
+def test_filtri_per_anno(client):
+    a, b = _serie(client)
+    assert _anni(client, anno=2021) == [(a, 2021), (b, 2021)]
+    assert _anni(client, anno=2023) == [(a, 2023)]
+    assert _anni(client, da=2021, a=2022) == [(a, 2021), (a, 2022), (b, 2021)]
+    assert _anni(client, da=2022) == [(a, 2022), (a, 2023)]
+    assert _anni(client, a=2020) == [(a, 2020), (b, 2020)]
+
+
+@pytest.mark.parametrize("percorso, params, stato", [
+    ("/emissioni", {"anno": 2021, "da": 2020}, 400),
+    ("/emissioni", {"da": 2022, "a": 2021}, 400),
+    ("/emissioni", {"anno": 1800}, 422),
+    ("/morfologia", {"anno": 2021}, 400),
+])
+def test_filtri_non_validi(client, percorso, params, stato):
+    risposta = client.get(percorso, params=params)
+    assert risposta.status_code == stato
+    if stato == 400:
+        assert isinstance(risposta.json()["detail"], str)
@@ -0,0 +1,47 @@
+"""Caricamenti in blocco (POST /{tabella}/bulk): esiti per riga, upsert, registro delle modifiche."""
+
+
+def test_regioni_upsert_per_nome(client):
+    risposta = client.post("/regioni/bulk", json=[{"nome": "Lazio", "pil": 1.0}, {"nome": "Molise"}])
+    assert risposta.status_code == 200
+    esiti = risposta.json()
+    assert [(e["nome"], e["stato"]) for e in esiti] == [("Lazio", "inserito"), ("Molise", "inserito")]
+    assert all(set(e) == {"nome", "id_regione", "stato"} for e in esiti)
+    id_lazio = esiti[0]["id_regione"]
+
+    esiti = client.post("/regioni/bulk", json=[{"nome": "Lazio", "pil": 2.0}, {"nome": "Sardegna"}]).json()
+    assert {e["nome"]: e["stato"] for e in esiti} == {"Lazio": "aggiornato", "Sardegna": "inserito"}
+    assert esiti[0]["id_regione"] == id_lazio
+    assert client.get(f"/regioni/{id_lazio}").json()["pil"] == 2.0
+
+
+def test_emissioni_chiave_composta(client):
+    id_regione = client.post("/regioni", json={"nome": "Puglia"}).json()["id_regione"]
+    version = client.get("/changes/version").json()["version"]
+
+    righe = [
+        {"id_regione": id_regione, "anno": 2022, "co2eq_mln_t": 1.0},
+        {"id_regione": id_regione, "anno": 2023, "co2eq_mln_t": 2.0},
+        {"id_regione": id_regione, "anno": 2023, "co2eq_mln_t": 3.0},  # chiave ripetuta: vale l'ultima
+    ]
+    esiti = client.post("/emissioni/bulk", json=righe).json()
+    assert esiti == [
+        {"id_regione": id_regione, "anno": 2022, "stato": "inserito"},
+        {"id_regione": id_regione, "anno": 2023, "stato": "inserito"},
+    ]
+    valori = {r["anno"]: r["co2eq_mln_t"] for r in client.get("/emissioni", params={"da": 2022}).json()}
+    assert valori == {2022: 1.0, 2023: 3.0}
+
+    modifiche = client.get("/changes", params={"since": version}).json()["changes"]
+    assert {(m["table"], m["key"]["anno"]) for m in modifiche if m["table"] == "emissioni"} == \
+        {("emissioni", 2022), ("emissioni", 2023)}
+
+    esiti = client.post("/emissioni/bulk", json=[{"id_regione": id_regione, "anno": 2023, "co2eq_mln_t": 4.0}]).json()
+    assert esiti[0]["stato"] == "aggiornato"
+
+
+def test_lista_vuota_e_riga_non_valida(client):
+    assert client.post("/emissioni/bulk", json=[]).json() == []
+    risposta = client.post("/emissioni/bulk", json=[{"id_regione": 1, "co2eq_mln_t": 1.0}])
+    assert risposta.status_code == 422
+    assert client.get("/emissioni").json() == []
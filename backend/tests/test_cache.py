@@ -0,0 +1,117 @@
+"""Cache delle letture: LRU/TTL, invalidazione e coalescenza (single-flight)."""
+
+import json
+import threading
+import time
+
+import pytest
+
+from cache import CacheRisultati
+from tests.conftest import esegui_async
+
+
+def _in_parallelo(funzione, n):
+    risultati, errori = [], []
+
+    def esegui():
+        try:
+            risultati.append(funzione())
+        except Exception as e:
+            errori.append(e)
+
+    thread = [threading.Thread(target=esegui) for _ in range(n)]
+    for t in thread:
+        t.start()
+    for t in thread:
+        t.join(10)
+    return risultati, errori
+
+
+def test_hit_dopo_miss():
+    cache = CacheRisultati()
+    assert cache.leggi(("mix", 1), lambda: "a") == "a"
+    assert cache.leggi(("mix", 1), lambda: "b") == "a"
+    stat = cache.statistiche()
+    assert (stat["hit"], stat["miss"]) == (1, 1)
+
+
+def test_invalidazione_per_tabella():
+    cache = CacheRisultati()
+    cache.leggi(("mix", 1), lambda: "a")
+    cache.leggi(("edifici", 1), lambda: "a")
+    cache.invalida("mix")
+    assert cache.leggi(("mix", 1), lambda: "b") == "b"
+    assert cache.leggi(("edifici", 1), lambda: "b") == "a"
+
+
+def test_letture_concorrenti_una_sola_esecuzione():
+    cache = CacheRisultati()
+    chiamate = []
+
+    def lenta():
+        chiamate.append(1)
+        time.sleep(0.2)
+        return len(chiamate)
+
+    risultati, errori = _in_parallelo(lambda: cache.leggi(("regioni", "json"), lenta), 30)
+    assert not errori
+    assert risultati == [1] * 30
+    assert len(chiamate) == 1
+    assert cache.statistiche()["coalescenti"] == 29
+
+
+def test_errore_propagato_e_non_in_cache():
+    cache = CacheRisultati()
+
+    def errore():
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    risultati, errori = _in_parallelo(lambda: cache.leggi(("mix", "e"), errore), 5)
+    assert not risultati and len(errori) == 5
+    assert cache.leggi(("mix", "e"), lambda: "ok") == "ok"
+
+
+def test_invalidazione_durante_il_calcolo():
+    cache = CacheRisultati()
+    iniziato = threading.Event()
+
+    def vecchia():
+        iniziato.set()
+        time.sleep(0.2)
+        return "vecchio"
+
+    t = threading.Thread(target=lambda: cache.leggi(("mix", 1), vecchia))
+    t.start()
+    iniziato.wait(5)
+    cache.invalida("mix")
+    # dopo l'invalidazione non si aggancia al calcolo vecchio e il suo risultato non resta in cache
+    assert cache.leggi(("mix", 1), lambda: "nuovo") == "nuovo"
+    t.join(5)
+    assert cache.leggi(("mix", 1), lambda: "altro") == "nuovo"
+
+
+def test_coalescenza_modalita_async():
+    """Richieste concorrenti a cache fredda con ASYNC_DB=1: niente blocco del loop."""
+    uscita = esegui_async("""
+import asyncio, json, httpx
+from main import app
+from schema_db import avvio
+avvio("crea")
+
+async def main():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+        await c.post("/regioni", json={"nome": "Lazio"})
+        risposte = await asyncio.gather(*[c.get("/regioni", params={"limit": 5}) for _ in range(8)])
+        stat = (await c.get("/cache/statistiche")).json()
+        print(json.dumps({"status": [r.status_code for r in risposte],
+                          "corpi": len({r.text for r in risposte}), "stat": stat}))
+
+asyncio.run(main())
+""", timeout=30)
+    esito = json.loads(uscita.strip().splitlines()[-1])
+    assert esito["status"] == [200] * 8
+    assert esito["corpi"] == 1
+    # una sola SELECT: le altre richieste hanno atteso il suo risultato sul loop
+    assert esito["stat"]["miss"] == 1
+    assert esito["stat"]["coalescenti"] == 7
@@ -0,0 +1,86 @@
+"""Sincronizzazione incrementale: /changes e /changes/version dal registro delle modifiche."""
+
+import json
+
+from tests.conftest import esegui_async
+
+
+def _changes(client, since, **params):
+    risposta = client.get("/changes", params={"since": since, **params})
+    assert risposta.status_code == 200, risposta.text
+    return risposta.json()
+
+
+def test_upsert_con_valori_attuali_una_volta_per_chiave(client):
+    inizio = client.get("/changes/version").json()["version"]
+    id_lazio = client.post("/regioni", json={"nome": "Lazio"}).json()["id_regione"]
+    client.put(f"/regioni/{id_lazio}", json={"nome": "Lazio", "pil": 200.5})
+
+    pagina = _changes(client, inizio)
+    assert pagina["version"] > inizio and pagina["more"] is False
+    assert pagina["changes"] == [
+        {"table": "regioni", "op": "upsert", "key": {"id_regione": id_lazio},
+         "row": {"id_regione": id_lazio, "nome": "Lazio", "superficie_kmq": None,
+                 "densita_demografica": None, "pil": 200.5}},
+    ]
+    assert _changes(client, pagina["version"])["changes"] == []
+
+
+def test_tombstone_dopo_eliminazione(client):
+    id_umbria = client.post("/regioni", json={"nome": "Umbria"}).json()["id_regione"]
+    versione = client.get("/changes/version").json()["version"]
+    client.delete(f"/regioni/{id_umbria}")
+    modifiche = _changes(client, versione)["changes"]
+    assert modifiche == [{"table": "regioni", "op": "delete", "key": {"id_regione": id_umbria}}]
+
+
+def test_reset_dopo_ricalcolo_aggregati(client):
+    versione = client.get("/changes/version").json()["version"]
+    client.post("/aggregati/ricalcola")
+    assert {"table": "aggregati", "op": "reset"} in _changes(client, versione)["changes"]
+
+
+def test_paginazione(client):
+    for nome in ("Lazio", "Umbria", "Molise"):
+        client.post("/regioni", json={"nome": nome})
+    prima = _changes(client, 0, limit=2)
+    assert prima["more"] is True and len(prima["changes"]) == 2
+    seconda = _changes(client, prima["version"], limit=2)
+    assert seconda["more"] is False
+    assert [c["row"]["nome"] for c in prima["changes"] + seconda["changes"]] == ["Lazio", "Umbria", "Molise"]
+
+
+def test_versione_fuori_dal_registro(client):
+    client.post("/regioni", json={"nome": "Lazio"})
+    futura = client.get("/changes/version").json()["version"] + 10
+    assert client.get("/changes", params={"since": futura}).status_code == 410
+
+
+def test_scritture_e_letture_modalita_async():
+    """Con ASYNC_DB=1: registro, ETag condiviso (304) e classifiche ricalcolate in background."""
+    uscita = esegui_async("""
+import asyncio, json, httpx
+from main import app
+from schema_db import avvio
+from services import ricalcolo_classifiche
+avvio("crea")
+
+async def main():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+        ids = [(await c.post("/regioni", json={"nome": n, "pil": p})).json()["id_regione"]
+               for n, p in (("Lazio", 200.0), ("Umbria", 25.0))]
+        modifiche = (await c.get("/changes", params={"since": 0})).json()["changes"]
+        prima = await c.get("/regioni")
+        ripetuta = await c.get("/regioni", headers={"If-None-Match": prima.headers["etag"]})
+        await asyncio.to_thread(ricalcolo_classifiche.attendi, 10)
+        classifica = (await c.get("/classifica/pil")).json()
+        print(json.dumps({"chiavi": [m["key"]["id_regione"] for m in modifiche], "ids": ids,
+                          "status": [prima.status_code, ripetuta.status_code],
+                          "classifica": [r["nome"] for r in classifica]}))
+
+asyncio.run(main())
+""", timeout=60)
+    esito = json.loads(uscita.strip().splitlines()[-1])
+    assert esito["chiavi"] == esito["ids"]
+    assert esito["status"] == [200, 304]
+    assert esito["classifica"] == ["Lazio", "Umbria"]
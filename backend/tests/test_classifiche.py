@@ -0,0 +1,71 @@
+"""Classifiche materializzate: ricalcolo in background dopo le scritture."""
+
+from sqlalchemy import text
+
+import models
+from database import SessionLocal, engine
+from services import _ricalcola_classifiche, ricalcolo_classifiche
+
+
+def _regioni(client, valori):
+    ids = {}
+    for nome, co2 in valori.items():
+        ids[nome] = client.post("/regioni", json={"nome": nome}).json()["id_regione"]
+        client.post("/emissioni", json={"id_regione": ids[nome], "anno": 2023, "co2eq_mln_t": co2})
+    return ids
+
+
+def test_classifica_dopo_le_scritture(client):
+    _regioni(client, {"Lazio": 30.0, "Umbria": 6.0, "Piemonte": 28.0})
+    assert ricalcolo_classifiche.attendi(10)
+
+    righe = client.get("/classifica/co2eq_mln_t").json()
+    assert [(r["nome"], r["posizione"]) for r in righe] == [("Lazio", 1), ("Piemonte", 2), ("Umbria", 3)]
+
+
+def test_get_non_scrive(client):
+    """Con la tabella vuota la GET risponde senza ricalcolare (lo fanno l'avvio e le scritture)."""
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO regioni (nome) VALUES ('Lazio')"))
+    assert client.get("/classifica/pil").json() == []
+    with SessionLocal() as db:
+        assert db.query(models.Classifiche).count() == 0
+
+
+def test_ricalcola_cambia_versione(client):
+    _regioni(client, {"Lazio": 30.0})
+    assert ricalcolo_classifiche.attendi(10)
+    etag = client.get("/classifica/co2eq_mln_t").headers["etag"]
+
+    assert client.post("/classifica/ricalcola").status_code == 200
+    assert client.get("/classifica/co2eq_mln_t", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_tabella_svuotata_cancella_le_righe_vecchie(client):
+    ids = _regioni(client, {"Lazio": 30.0, "Umbria": 6.0})
+    assert ricalcolo_classifiche.attendi(10)
+    with engine.begin() as conn:
+        conn.execute(models.Classifiche.__table__.insert(),
+                     [{"indicatore": "pianura_pct", "id_regione": ids["Lazio"], "valore": 20.0, "posizione": 1,
+                       "percentile": 100.0, "z_score": None}])
+
+    # morfologia (prima nell'ordine degli indicatori) non ha righe, emissioni sì
+    with SessionLocal() as db:
+        _ricalcola_classifiche(db, ("morfologia", "emissioni"))
+    assert client.get("/classifica/pianura_pct").json() == []
+    assert len(client.get("/classifica/co2eq_mln_t").json()) == 2
+
+
+def test_scritture_senza_indicatori_non_ricalcolano(client):
+    from versione import versione_dati
+
+    id_regione = client.post("/regioni", json={"nome": "Umbria"}).json()["id_regione"]
+    assert ricalcolo_classifiche.attendi(10)
+    prima = versione_dati.corrente()
+    client.post("/province", json={"id_provincia": 54, "id_regione": id_regione, "sigla": "PG", "nome": "Perugia"})
+    client.post("/comuni", json={"id_comune": 54039, "id_provincia": 54, "nome": "Perugia", "popolazione": 1})
+    assert ricalcolo_classifiche.attendi(10)
+    # solo le due scritture: nessun ricalcolo (e quindi nessun evento o svuotamento della cache) in più
+    assert versione_dati.corrente() == prima + 2
+    with SessionLocal() as db:
+        assert _ricalcola_classifiche(db, ("province", "comuni", "aggregati")) is False
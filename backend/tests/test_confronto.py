@@ -0,0 +1,51 @@
+"""Confronto server-side N regioni x M indicatori (/confronto) ed elenco degli indicatori."""
+
+
+def _dati(client):
+    client.post("/regioni/bulk", json=[{"nome": "Lazio", "pil": 10.0}, {"nome": "Molise", "pil": 1.0}])
+    ids = {r["nome"]: r["id_regione"] for r in client.get("/regioni").json()}
+    client.post("/emissioni/bulk", json=[
+        {"id_regione": ids["Lazio"], "anno": 2022, "co2eq_mln_t": 40.0},
+        {"id_regione": ids["Lazio"], "anno": 2023, "co2eq_mln_t": 38.0},
+        {"id_regione": ids["Molise"], "anno": 2022, "co2eq_mln_t": 2.0},
+    ])
+    client.post("/industria/bulk", json=[
+        {"id_regione": ids["Lazio"], "anno": 2023, "quota_elettrico_pct": 30.0},
+    ])
+    return ids
+
+
+def test_celle_richieste_in_ordine(client):
+    ids = _dati(client)
+    risposta = client.get("/confronto", params={"regioni": "Molise, Lazio,Molise",
+                                                "indicatori": "co2eq_mln_t,pil,quota_elettrico_pct_industria"})
+    assert risposta.status_code == 200
+    assert risposta.headers["content-type"] == "application/json"
+    assert risposta.json() == [
+        {"id_regione": ids["Molise"], "nome": "Molise", "co2eq_mln_t": 2.0, "pil": 1.0,
+         "quota_elettrico_pct_industria": None},
+        {"id_regione": ids["Lazio"], "nome": "Lazio", "co2eq_mln_t": 38.0, "pil": 10.0,
+         "quota_elettrico_pct_industria": 30.0},
+    ]
+
+
+def test_anno_indicato(client):
+    _dati(client)
+    righe = client.get("/confronto", params={"regioni": "Lazio,Molise", "indicatori": "co2eq_mln_t",
+                                             "anno": 2022}).json()
+    assert [r["co2eq_mln_t"] for r in righe] == [40.0, 2.0]
+
+
+def test_errori(client):
+    _dati(client)
+    risposta = client.get("/confronto", params={"regioni": "Lazio", "indicatori": "pil,colore"})
+    assert risposta.status_code == 400 and "colore" in risposta.json()["detail"]
+    risposta = client.get("/confronto", params={"regioni": "Lazio,Atlantide", "indicatori": "pil"})
+    assert risposta.status_code == 404 and "Atlantide" in risposta.json()["detail"]
+    assert client.get("/confronto", params={"regioni": "Lazio"}).status_code == 422
+
+
+def test_elenco_indicatori(client):
+    indicatori = client.get("/indicatori").json()
+    assert indicatori["co2eq_mln_t"] == {"tabella": "emissioni", "colonna": "co2eq_mln_t"}
+    assert indicatori["quota_elettrico_pct_industria"] == {"tabella": "industria", "colonna": "quota_elettrico_pct"}
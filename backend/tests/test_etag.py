@@ -0,0 +1,86 @@
+"""GET condizionali: ETag e Last-Modified dalla versione dei dati condivisa tra i worker."""
+
+from sqlalchemy import text
+
+from database import engine
+from middleware import etag_corrente
+
+
+def test_304_con_if_none_match(client):
+    client.post("/regioni", json={"nome": "Lazio"})
+    prima = client.get("/regioni")
+    etag = prima.headers["etag"]
+    assert prima.status_code == 200 and prima.headers["last-modified"]
+
+    ripetuta = client.get("/regioni", headers={"If-None-Match": etag})
+    assert ripetuta.status_code == 304
+    assert ripetuta.headers["etag"] == etag and ripetuta.content == b""
+
+    condizionale = client.get("/regioni", headers={"If-Modified-Since": prima.headers["last-modified"]})
+    assert condizionale.status_code == 304
+
+
+def test_etag_cambia_dopo_una_scrittura(client):
+    client.post("/regioni", json={"nome": "Lazio"})
+    etag = client.get("/regioni").headers["etag"]
+
+    client.post("/regioni", json={"nome": "Piemonte"})
+    dopo = client.get("/regioni", headers={"If-None-Match": etag})
+    assert dopo.status_code == 200
+    assert dopo.headers["etag"] != etag
+    assert {r["nome"] for r in dopo.json()} == {"Lazio", "Piemonte"}
+
+
+def test_varianti_tabellari_distinte():
+    assert etag_corrente(3) == '"v3"'
+    assert etag_corrente(3, "arrow") != etag_corrente(3)
+
+
+def test_scrittura_di_un_altro_processo(client):
+    """Un altro worker scrive sul DB: niente 304 con l'ETag vecchio e niente dati vecchi dalla cache."""
+    client.post("/regioni", json={"nome": "Lazio"})
+    etag = client.get("/regioni").headers["etag"]
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO regioni (nome) VALUES ('Umbria')"))
+        conn.execute(text("UPDATE sequenza_registro SET scritture = scritture + 1 WHERE id = 1"))
+
+    dopo = client.get("/regioni", headers={"If-None-Match": etag})
+    assert dopo.status_code == 200
+    assert dopo.headers["etag"] != etag
+    assert "Umbria" in {r["nome"] for r in dopo.json()}
+
+
+def test_senza_etag_per_changes(client):
+    assert "etag" not in client.get("/changes/version").headers
+
+
+def test_riletture_concorrenti_una_sola_query(monkeypatch):
+    import asyncio
+    import time as tempo
+    from middleware import VersioneCondivisa
+
+    letture = []
+
+    def lenta():
+        letture.append(1)
+        tempo.sleep(0.1)
+        return 7
+
+    versione = VersioneCondivisa(intervallo=60)
+    monkeypatch.setattr(versione, "_leggi", lenta)
+
+    async def prova():
+        return await asyncio.gather(*[versione.corrente() for _ in range(10)])
+
+    assert asyncio.run(prova()) == [7] * 10
+    assert len(letture) == 1
+
+
+def test_lettura_della_versione_fuori_dalle_metriche(client):
+    """La SELECT della versione non ha la route della richiesta né conta nelle sue query."""
+    client.get("/scanner/probe")
+    testo = client.get("/metrics").text
+    assert 'can_db_queries_per_request_count{route="non_trovata"}' in testo
+    assert 'can_db_queries_per_request_sum{route="non_trovata"} 0' in testo
+    assert "probe" not in testo
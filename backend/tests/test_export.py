@@ -0,0 +1,55 @@
+"""Export in streaming (/export/{tabella}): NDJSON e CSV, tutti gli anni, ripresa con ?cursor=."""
+
+import csv
+import io
+import json
+
+import services
+
+
+def _emissioni(client):
+    ids = [e["id_regione"] for e in client.post("/regioni/bulk", json=[{"nome": "A"}, {"nome": "B"}]).json()]
+    client.post("/emissioni/bulk", json=[
+        {"id_regione": i, "anno": anno, "co2eq_mln_t": anno / 100} for i in ids for anno in (2021, 2022, 2023)
+    ])
+    return ids
+
+
+def _ndjson(risposta):
+    return [json.loads(riga) for riga in risposta.text.splitlines()]
+
+
+def test_ndjson_tutti_gli_anni_a_blocchi(client, monkeypatch):
+    ids = _emissioni(client)
+    monkeypatch.setattr(services, "RIGHE_PER_BLOCCO", 2)
+    risposta = client.get("/export/emissioni")
+    assert risposta.status_code == 200
+    assert risposta.headers["content-type"] == "application/x-ndjson"
+    assert risposta.headers["content-disposition"] == 'attachment; filename="emissioni.ndjson"'
+    righe = _ndjson(risposta)
+    assert [(r["id_regione"], r["anno"]) for r in righe] == [(i, a) for i in ids for a in (2021, 2022, 2023)]
+    assert righe[0] == {"id_regione": ids[0], "anno": 2021, "co2eq_mln_t": 20.21}
+
+
+def test_csv_da_parametro_o_accept(client):
+    ids = _emissioni(client)
+    for risposta in (client.get("/export/emissioni", params={"formato": "csv", "anno": 2022}),
+                     client.get("/export/emissioni", params={"anno": 2022}, headers={"Accept": "text/csv"})):
+        assert risposta.status_code == 200
+        assert risposta.headers["content-type"] == "text/csv; charset=utf-8"
+        assert risposta.headers["content-disposition"] == 'attachment; filename="emissioni.csv"'
+        righe = list(csv.reader(io.StringIO(risposta.text)))
+        assert righe == [["id_regione", "anno", "co2eq_mln_t"]] + [[str(i), "2022", "20.22"] for i in ids]
+
+
+def test_ripresa_con_cursore_e_campi(client):
+    ids = _emissioni(client)
+    righe = _ndjson(client.get("/export/emissioni", params={"cursor": f"{ids[0]}:2023", "fields": "anno"}))
+    assert righe == [{"id_regione": ids[1], "anno": anno} for anno in (2021, 2022, 2023)]
+
+
+def test_errori(client):
+    assert client.get("/export/segreti").status_code == 422
+    assert client.get("/export/emissioni", params={"formato": "xml"}).status_code == 422
+    risposta = client.get("/export/emissioni", params={"fields": "colore"})
+    assert risposta.status_code == 400 and "colore" in risposta.json()["detail"]
@@ -0,0 +1,59 @@
+"""Formati tabellari negoziati con Accept: Arrow (IPC stream) e Parquet, 406 senza pyarrow."""
+
+import io
+
+import pytest
+
+import formati
+from formati import MEDIA_ARROW, MEDIA_PARQUET, formato_tabellare
+
+
+def _dati(client):
+    ids = [e["id_regione"] for e in client.post("/regioni/bulk", json=[{"nome": "A"}, {"nome": "B"}]).json()]
+    client.post("/emissioni/bulk", json=[{"id_regione": i, "anno": 2023, "co2eq_mln_t": 1.5 * i} for i in ids])
+    return ids
+
+
+@pytest.mark.parametrize("accept, atteso", [
+    (None, None),
+    ("application/json", None),
+    (MEDIA_ARROW, "arrow"),
+    (f"{MEDIA_PARQUET};q=0.9, application/json", "parquet"),
+    (f"application/json, {MEDIA_ARROW}", None),
+    (f"*/*, {MEDIA_ARROW}", None),
+])
+def test_formato_tabellare(accept, atteso):
+    assert formato_tabellare(accept) == atteso
+
+
+def test_arrow(client):
+    pa = pytest.importorskip("pyarrow")
+    ids = _dati(client)
+    risposta = client.get("/emissioni", headers={"Accept": MEDIA_ARROW})
+    assert risposta.status_code == 200
+    assert risposta.headers["content-type"] == MEDIA_ARROW
+    assert "Accept" in risposta.headers["vary"]
+    tabella = pa.ipc.open_stream(risposta.content).read_all()
+    assert tabella.column_names == ["id_regione", "anno", "co2eq_mln_t"]
+    assert tabella.column("co2eq_mln_t").to_pylist() == [1.5 * i for i in ids]
+
+
+def test_parquet_con_proiezione_e_cursore(client):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+    ids = _dati(client)
+    risposta = client.get("/emissioni", params={"fields": "co2eq_mln_t", "limit": 1},
+                          headers={"Accept": MEDIA_PARQUET})
+    assert risposta.status_code == 200
+    assert risposta.headers["content-type"] == MEDIA_PARQUET
+    assert risposta.headers["x-next-cursor"] == f"{ids[0]}:2023"
+    tabella = pq.read_table(io.BytesIO(risposta.content))
+    assert tabella.to_pylist() == [{"id_regione": ids[0], "anno": 2023, "co2eq_mln_t": 1.5 * ids[0]}]
+
+
+def test_senza_pyarrow_406(client, monkeypatch):
+    _dati(client)
+    monkeypatch.setattr(formati, "pa", None)
+    risposta = client.get("/emissioni", headers={"Accept": MEDIA_ARROW})
+    assert risposta.status_code == 406
+    assert client.get("/emissioni", headers={"Accept": "application/json"}).status_code == 200
@@ -0,0 +1,97 @@
+"""Limiti per client (token bucket, 429) e tetto di concorrenza (503)."""
+
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import limiti
+from limiti import BucketLocali, LimitiMiddleware, leggi_regole, regola_per
+
+
+async def _ok(request):
+    if request.query_params.get("lenta"):
+        await asyncio.sleep(0.3)
+    return PlainTextResponse("ok")
+
+
+def _client(**opzioni):
+    app = Starlette(routes=[Route("/regioni", _ok), Route("/export/comuni", _ok), Route("/metrics", _ok)])
+    return TestClient(LimitiMiddleware(app, **opzioni))
+
+
+def test_regole_per_prefisso():
+    regole = leggi_regole("/export/=1:5,/regioni=50")
+    assert regola_per("/export/comuni", regole) == ("/export/", 1.0, 5.0)
+    assert regola_per("/regioni", regole) == ("/regioni", 50.0, 50.0)
+    assert regola_per("/mix", regole)[0] == "*"
+
+
+def test_429_oltre_il_burst():
+    client = _client(regole=[("/regioni", 1, 3)], bucket=BucketLocali())
+    stati = [client.get("/regioni").status_code for _ in range(5)]
+    assert stati == [200, 200, 200, 429, 429]
+    rifiutata = client.get("/regioni")
+    assert int(rifiutata.headers["retry-after"]) >= 1
+    # bucket separato per gruppo di route
+    assert client.get("/export/comuni").status_code == 200
+    # il monitoraggio non è mai limitato
+    assert all(client.get("/metrics").status_code == 200 for _ in range(5))
+
+
+def test_chiave_esente(monkeypatch):
+    monkeypatch.setattr(limiti, "LIMITI_ESENTI", {"dashboard"})
+    client = _client(regole=[("/regioni", 1, 1)], bucket=BucketLocali())
+    assert all(client.get("/regioni", headers={"X-API-Key": "dashboard"}).status_code == 200 for _ in range(5))
+
+
+def test_chiavi_non_configurate_ignorate(monkeypatch):
+    """Una chiave nuova a ogni richiesta non dà un bucket nuovo: conta l'IP."""
+    monkeypatch.setattr(limiti, "LIMITI_CHIAVI", {"partner"})
+    client = _client(regole=[("/regioni", 1, 2)], bucket=BucketLocali())
+    stati = [client.get("/regioni", headers={"X-API-Key": f"k{i}"}).status_code for i in range(4)]
+    assert stati == [200, 200, 429, 429]
+    # la chiave configurata ha il suo bucket
+    assert client.get("/regioni", headers={"X-API-Key": "partner"}).status_code == 200
+
+
+def test_sorgente_metriche_registrata_una_volta():
+    from metriche import esporta
+    for _ in range(3):
+        _client()
+    assert esporta().count("# TYPE can_http_concurrency_limit gauge") == 1
+
+
+def test_503_oltre_la_concorrenza():
+    client = _client(regole=[("/", 0, 0)], concorrenza=1, attesa_s=0)
+
+    async def prova():
+        import httpx
+        trasporto = httpx.ASGITransport(app=client.app)
+        async with httpx.AsyncClient(transport=trasporto, base_url="http://t") as c:
+            return await asyncio.gather(c.get("/regioni?lenta=1"), c.get("/regioni?lenta=1"))
+
+    stati = sorted(r.status_code for r in asyncio.run(prova()))
+    assert stati == [200, 503]
+
+
+def test_bucket_attesa_per_un_gettone():
+    bucket = BucketLocali()
+    attese = [asyncio.run(bucket.consuma("c", 1, 5)) for _ in range(6)]
+    assert attese[:5] == [0.0] * 5
+    assert 0 < attese[-1] <= 1
+
+
+def test_pulizia_con_il_tasso_di_ogni_bucket():
+    """Un bucket lento svuotato non va eliminato solo perché la richiesta corrente ha un tasso alto."""
+    bucket = BucketLocali(max_client=1)
+
+    async def prova():
+        for _ in range(5):
+            await bucket.consuma("/export/|lento", 0.01, 5)
+        await bucket.consuma("*|veloce", 1000, 1)      # supera max_client: pulizia
+        return await bucket.consuma("/export/|lento", 0.01, 5)
+
+    assert asyncio.run(prova()) > 0
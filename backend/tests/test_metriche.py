@@ -0,0 +1,45 @@
+"""Strumentazione delle query SQL (metriche.strumenta_engine)."""
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from metriche import esporta, strumenta_engine
+
+
+def test_query_fallite_non_lasciano_istanti_di_inizio():
+    engine = create_engine("sqlite://")
+    strumenta_engine(engine)
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM tabella_inesistente"))
+        assert conn.info.get("can_inizio_query") == []
+        # la query successiva misura la propria durata, non quella di una fallita
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        assert conn.info["can_inizio_query"] == []
+
+
+def test_esportazione_prometheus(client):
+    client.get("/regioni")
+    testo = client.get("/metrics").text
+    assert "# TYPE can_http_request_seconds histogram" in testo
+    assert 'route="/regioni"' in testo
+    assert esporta().endswith("\n")
+
+
+def test_nessuna_serie_per_path_non_instradati(client):
+    for i in range(3):
+        client.get(f"/scanner/probe{i}")
+    testo = client.get("/metrics").text
+    assert "probe" not in testo
+
+
+def test_route_corrente_senza_template():
+    from metriche import richiesta_corrente, route_corrente
+    token = richiesta_corrente.set({"scope": {"path": "/regioni/nome/Foo0/profilo"}, "query": 0})
+    try:
+        assert route_corrente() == "non_instradata"
+    finally:
+        richiesta_corrente.reset(token)
+    assert route_corrente() == "-"
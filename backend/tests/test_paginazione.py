@@ -0,0 +1,52 @@
+"""Proiezione (?fields=) e paginazione keyset (?limit=, ?cursor=, header X-Next-Cursor) delle liste."""
+
+
+def _pagine(client, percorso, **params):
+    """Tutte le pagine seguendo X-Next-Cursor; restituisce le liste di righe."""
+    pagine = []
+    while True:
+        risposta = client.get(percorso, params=params)
+        assert risposta.status_code == 200
+        pagine.append(risposta.json())
+        if "x-next-cursor" not in risposta.headers:
+            return pagine
+        params["cursor"] = risposta.headers["x-next-cursor"]
+
+
+def test_proiezione_con_chiave(client):
+    client.post("/regioni/bulk", json=[{"nome": "Lazio", "pil": 1.0}, {"nome": "Molise", "pil": 2.0}])
+    righe = client.get("/regioni", params={"fields": "pil"}).json()
+    assert [set(r) for r in righe] == [{"id_regione", "pil"}] * 2
+
+    risposta = client.get("/regioni", params={"fields": "pil,colore"})
+    assert risposta.status_code == 400
+    assert "colore" in risposta.json()["detail"]
+
+
+def test_pagine_regioni(client):
+    client.post("/regioni/bulk", json=[{"nome": f"R{i}"} for i in range(5)])
+    pagine = _pagine(client, "/regioni", limit=2)
+    assert [len(p) for p in pagine] == [2, 2, 1]
+    ids = [r["id_regione"] for p in pagine for r in p]
+    assert ids == sorted(ids) and len(set(ids)) == 5
+
+    senza_limite = client.get("/regioni")
+    assert "x-next-cursor" not in senza_limite.headers and len(senza_limite.json()) == 5
+
+
+def test_cursore_composto_tabelle_annuali(client):
+    ids = [e["id_regione"] for e in client.post("/regioni/bulk", json=[{"nome": "A"}, {"nome": "B"}]).json()]
+    client.post("/emissioni/bulk", json=[
+        {"id_regione": i, "anno": anno, "co2eq_mln_t": 1.0} for i in ids for anno in (2021, 2022, 2023)
+    ])
+    risposta = client.get("/emissioni", params={"da": 2021, "limit": 4})
+    assert risposta.headers["x-next-cursor"] == f"{ids[1]}:2021"
+
+    righe = [(r["id_regione"], r["anno"]) for p in _pagine(client, "/emissioni", da=2021, limit=4) for r in p]
+    assert righe == [(i, anno) for i in sorted(ids) for anno in (2021, 2022, 2023)]
+
+
+def test_parametri_non_validi(client):
+    assert client.get("/regioni", params={"cursor": "abc"}).status_code == 422
+    assert client.get("/regioni", params={"limit": 0}).status_code == 422
+    assert client.get("/regioni", params={"limit": 100000}).status_code == 422
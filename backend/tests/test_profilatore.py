@@ -0,0 +1,52 @@
+"""Profiler per singola richiesta: attivato solo dal token, profilo folded salvato su file."""
+
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from middleware import ProfilerMiddleware
+
+
+def _lavoro(request):
+    fine = time.perf_counter() + 0.05
+    while time.perf_counter() < fine:
+        pass
+    return PlainTextResponse("ok")
+
+
+def _client(cartella):
+    app = Starlette(routes=[Route("/regioni/{id}", _lavoro)])
+    return TestClient(ProfilerMiddleware(app, token="segreto", cartella=str(cartella)))
+
+
+def test_senza_token_nessun_profilo(tmp_path):
+    client = _client(tmp_path)
+    for headers in ({}, {"X-Profilo": "sbagliato"}):
+        risposta = client.get("/regioni/1", headers=headers)
+        assert risposta.status_code == 200
+        assert "x-profilo-file" not in risposta.headers
+    assert client.get("/regioni/1", params={"profilo": "sbagliato"}).headers.get("x-profilo-file") is None
+    assert not os.listdir(tmp_path)
+
+
+def test_profilo_da_header(tmp_path):
+    risposta = _client(tmp_path).get("/regioni/1", headers={"X-Profilo": "segreto"})
+    assert risposta.status_code == 200 and risposta.text == "ok"
+    nome = risposta.headers["x-profilo-file"]
+    assert nome.endswith("_GET_regioni_1.folded")
+    assert int(risposta.headers["x-profilo-campioni"]) > 0
+
+    with open(tmp_path / nome, encoding="utf-8") as f:
+        righe = f.read().splitlines()
+    # formato folded: "frame;frame;... conteggio", con la funzione della route tra gli stack
+    assert all(riga.rsplit(" ", 1)[1].isdigit() for riga in righe)
+    assert any("_lavoro" in riga for riga in righe)
+
+
+def test_profilo_da_query(tmp_path):
+    risposta = _client(tmp_path).get("/regioni/2", params={"profilo": "segreto"})
+    assert os.listdir(tmp_path) == [risposta.headers["x-profilo-file"]]
@@ -0,0 +1,31 @@
+"""Migrazione dallo schema del dump originale (senza anno né tabelle nuove) con `crea`."""
+
+from sqlalchemy import create_engine, inspect, text
+
+import schema_db
+
+
+def test_crea_porta_lo_schema_del_dump_ai_modelli(tmp_path):
+    bind = create_engine(f"sqlite:///{tmp_path / 'dump.db'}")
+    with bind.begin() as conn:
+        conn.execute(text("CREATE TABLE regioni (id_regione INTEGER PRIMARY KEY, nome VARCHAR(80) UNIQUE NOT NULL, "
+                          "superficie_kmq NUMERIC(12,2), densita_demografica NUMERIC(12,2), pil NUMERIC(14,2))"))
+        conn.execute(text("CREATE TABLE mix_energetico (id_regione INTEGER PRIMARY KEY REFERENCES regioni(id_regione), "
+                          "carbone_pct NUMERIC(5,2), petrolio_pct NUMERIC(5,2), gas_pct NUMERIC(5,2), "
+                          "rinnovabili_pct NUMERIC(5,2))"))
+        conn.execute(text("INSERT INTO regioni (id_regione, nome) VALUES (1, 'Lazio')"))
+        conn.execute(text("INSERT INTO mix_energetico VALUES (1, 10, 20, 30, 40)"))
+
+    assert not schema_db.verifica_schema(bind)
+    schema_db.crea_schema(bind)
+
+    ispettore = inspect(bind)
+    assert "anno" in {c["name"] for c in ispettore.get_columns("mix_energetico")}
+    for tabella in ("province", "comuni", "aggregati_territorio", "classifiche", "registro_modifiche"):
+        assert ispettore.has_table(tabella)
+    with bind.connect() as conn:
+        assert conn.execute(text("SELECT anno FROM mix_energetico")).scalar() == schema_db.ANNO_BASE
+    assert schema_db.verifica_schema(bind)
+    # idempotente: un secondo avvio del servizio di migrazione non cambia nulla
+    schema_db.crea_schema(bind)
+    assert schema_db.verifica_schema(bind)
@@ -0,0 +1,35 @@
+"""Snapshot colonnare (/snapshot): contenuto, rigenerazione dopo le scritture, modalità async."""
+
+import json
+
+from tests.conftest import esegui_async
+
+
+def test_snapshot_segue_le_scritture(client):
+    client.post("/regioni", json={"nome": "Lazio"})
+    primo = client.get("/snapshot").json()
+    assert primo["tabelle"]["regioni"]["nome"] == ["Lazio"]
+
+    client.post("/regioni", json={"nome": "Umbria"})
+    secondo = client.get("/snapshot").json()
+    assert secondo["versione"] > primo["versione"]
+    assert secondo["tabelle"]["regioni"]["nome"] == ["Lazio", "Umbria"]
+
+
+def test_snapshot_concorrenti_modalita_async():
+    uscita = esegui_async("""
+import asyncio, json, httpx
+from main import app
+from schema_db import avvio
+avvio("crea")
+
+async def main():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as c:
+        await c.post("/regioni", json={"nome": "Lazio"})
+        risposte = await asyncio.gather(*[c.get("/snapshot") for _ in range(6)])
+        print(json.dumps({"status": [r.status_code for r in risposte], "corpi": len({r.text for r in risposte})}))
+
+asyncio.run(main())
+""", timeout=30)
+    esito = json.loads(uscita.strip().splitlines()[-1])
+    assert esito == {"status": [200] * 6, "corpi": 1}
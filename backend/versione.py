@@ -0,0 +1,30 @@
+"""
+Versione dei dati serviti dall'API.
+Il contatore aumenta a ogni scrittura fatta dai servizi (create, update, delete)
+e permette di capire se i dati sono cambiati senza interrogare il DB.
+
+Nota: il contatore vive nel processo. Con più worker uvicorn ognuno ha il suo,
+quindi va usato per invalidare dati in memoria, non come identificativo globale.
+"""
+
+import threading
+import time
+
+
+class VersioneDati:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valore = 0
+        self.ultima_modifica = time.time()
+
+    def corrente(self) -> int:
+        return self.valore
+
+    def incrementa(self) -> int:
+        with self._lock:
+            self.valore += 1
+            self.ultima_modifica = time.time()
+            return self.valore
+
+
+versione_dati = VersioneDati()
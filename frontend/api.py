@@ -9,12 +9,19 @@ Autori: Team CAN - Carlotta Forlino, Andrea Calabrò e Nicolò Giraudo
 Versione: 1.0.0
 """
 import os
+import json
 import requests
 import time
 import pandas as pd
 from dotenv import load_dotenv
 import threading
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+MEDIA_ARROW = "application/vnd.apache.arrow.stream"
 # --- CONFIGURAZIONE BASE ---
 BASE_URL = "http://backend:8000"
 from pathlib import Path
@@ -24,12 +31,34 @@ from dotenv import load_dotenv
 env_path = Path(__file__).resolve().parent / "meteo.env"
 load_dotenv(dotenv_path=env_path)
 WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY")
+# chiave della dashboard verso il backend (CAN_API_KEY): con la stessa chiave in
+# LIMITI_ESENTI del backend le sue richieste non consumano il limite per client
+CAN_API_KEY = os.environ.get("CAN_API_KEY")
+HEADERS_API = {"X-API-Key": CAN_API_KEY} if CAN_API_KEY else {}
+if not CAN_API_KEY:
+    print("[API] CAN_API_KEY non impostata: le richieste di tutti gli utenti della dashboard "
+          "condividono il limite per client del backend (stesso IP)")
 meteo_lock = threading.Lock()
 
 # ===========================
 # FUNZIONI DI RICHIESTA DATI
 # ===========================
 
+def _richiedi_df(endpoint, timeout=None):
+    """
+    Scarica un endpoint di lista come DataFrame.
+    Se pyarrow è disponibile chiede il formato Arrow: le colonne arrivano già
+    tipizzate e si evita il parsing JSON riga per riga.
+    """
+    if pa is None:
+        return pd.DataFrame(requests.get(f"{BASE_URL}/{endpoint}", headers=HEADERS_API, timeout=timeout).json())
+    resp = requests.get(f"{BASE_URL}/{endpoint}", headers={**HEADERS_API, "Accept": MEDIA_ARROW}, timeout=timeout)
+    resp.raise_for_status()
+    if resp.headers.get("Content-Type", "").startswith(MEDIA_ARROW):
+        return pa.ipc.open_stream(resp.content).read_pandas()
+    return pd.DataFrame(resp.json())
+
+
 def get_regioni(max_retry=10, delay=3):
     """
     Restituisce il DataFrame con tutte le regioni italiane.
@@ -37,8 +66,7 @@ def get_regioni(max_retry=10, delay=3):
     """
     for attempt in range(max_retry):
         try:
-            resp = requests.get(f"{BASE_URL}/regioni", timeout=5).json()
-            return pd.DataFrame(resp)
+            return _richiedi_df("regioni", timeout=5)
         except requests.exceptions.ConnectionError as e:
             print(f"[API] Tentativo {attempt + 1}/{max_retry} - Backend non ancora pronto: {e}")
             if attempt < max_retry - 1:
@@ -53,8 +81,7 @@ def get_regioni(max_retry=10, delay=3):
 def get_morfologia():
     """Restituisce i dati sulla morfologia del suolo."""
     try:
-        resp = requests.get(f"{BASE_URL}/morfologia").json()
-        return pd.DataFrame(resp)
+        return _richiedi_df("morfologia")
     except Exception as e:
         print(f"[API] Errore caricando morfologia: {e}")
         return pd.DataFrame()
@@ -63,8 +90,7 @@ def get_morfologia():
 def get_assorbimenti():
     """Restituisce i dati sugli assorbimenti regionali."""
     try:
-        resp = requests.get(f"{BASE_URL}/assorbimenti").json()
-        return pd.DataFrame(resp)
+        return _richiedi_df("assorbimenti")
     except Exception as e:
         print(f"[API] Errore caricando assorbimenti: {e}")
         return pd.DataFrame()
@@ -72,8 +98,7 @@ def get_assorbimenti():
 def get_emissioni():
     """Restituisce i dati sulle emissioni totali regionali."""
     try:
-        resp = requests.get(f"{BASE_URL}/emissioni").json()
-        return pd.DataFrame(resp)
+        return _richiedi_df("emissioni")
     except Exception as e:
         print(f"[API] Errore caricando emissioni totali: {e}")
         return pd.DataFrame()
@@ -81,8 +106,7 @@ def get_emissioni():
 def get_mix():
     """Restituisce i dati del mix energetico regionale."""
     try:
-        resp = requests.get(f"{BASE_URL}/mix").json()
-        return pd.DataFrame(resp)
+        return _richiedi_df("mix")
     except Exception as e:
         print(f"[API] Errore caricando mix: {e}")
         return pd.DataFrame()
@@ -91,8 +115,7 @@ def get_mix():
 def get_edifici():
     """Restituisce i dati energetici e ambientali sugli edifici."""
     try:
-        resp = requests.get(f"{BASE_URL}/edifici").json()
-        df = pd.DataFrame(resp)
+        df = _richiedi_df("edifici")
         regioni = get_regioni()
         return df.merge(regioni, on="id_regione", how="inner", validate="one_to_one").rename(columns={"nome": "Regione"})
     except Exception as e:
@@ -103,8 +126,7 @@ def get_edifici():
 def get_industria():
     """Restituisce i dati sulle emissioni e l’energia del settore industriale."""
     try:
-        resp = requests.get(f"{BASE_URL}/industria").json()
-        return pd.DataFrame(resp)
+        return _richiedi_df("industria")
     except Exception as e:
         print(f"[API] Errore caricando industria: {e}")
         return pd.DataFrame()
@@ -113,13 +135,112 @@ def get_industria():
 def get_azioni():
     """Restituisce i dati sulle azioni positive regionali (FER, auto, risparmi)."""
     try:
-        resp = requests.get(f"{BASE_URL}/azioni").json()
-        return pd.DataFrame(resp)
+        return _richiedi_df("azioni")
     except Exception as e:
         print(f"[API] Errore caricando azioni: {e}")
         return pd.DataFrame()
 
 
+# Cache brevissima del profilo: le callback di edifici, mix, industria e azioni
+# scattano insieme allo stesso cambio di regione e condividono così una sola richiesta.
+# Il TTL vale anche con il flusso /eventi connesso: gli eventi sono per processo del backend,
+# quindi con più worker le scritture gestite dagli altri arrivano solo con la rivalidazione.
+PROFILO_TTL = 5
+_profilo_cache = {}
+profilo_lock = threading.Lock()
+
+
+def get_profilo(nome_regione, sezione=None):
+    """
+    Restituisce il profilo completo di una regione (una sola richiesta al backend).
+
+    Args:
+        nome_regione (str): Nome della regione.
+        sezione (str, optional): Tabella collegata da estrarre
+            ("mix", "edifici", "industria", "azioni", ...).
+
+    Returns:
+        pd.DataFrame: Una riga con i dati richiesti e la colonna "Regione",
+        oppure un DataFrame vuoto se la regione o la sezione non esistono.
+    """
+    if not nome_regione:
+        return pd.DataFrame()
+    with profilo_lock:
+        cached = _profilo_cache.get(nome_regione)
+        if cached and time.time() - cached[0] < PROFILO_TTL:
+            profilo = cached[1]
+        else:
+            # Scaduto il TTL si rivalida con l'ETag: se i dati non sono cambiati
+            # il backend risponde 304 senza corpo e senza interrogare il DB.
+            headers = {**HEADERS_API, "If-None-Match": cached[2]} if cached and cached[2] else HEADERS_API
+            try:
+                resp = requests.get(f"{BASE_URL}/regioni/nome/{nome_regione}/profilo", headers=headers, timeout=5)
+            except Exception as e:
+                print(f"[API] Errore caricando profilo {nome_regione}: {e}")
+                return pd.DataFrame()
+            if resp.status_code == 304:
+                profilo = cached[1]
+            elif resp.status_code == 200:
+                profilo = resp.json()
+            else:
+                # errori (404, 429, 503...) mai in cache: la prossima chiamata riprova
+                print(f"[API] Profilo {nome_regione} non disponibile: HTTP {resp.status_code}")
+                return pd.DataFrame()
+            _profilo_cache[nome_regione] = (time.time(), profilo, resp.headers.get("ETag"))
+
+    if not profilo:
+        return pd.DataFrame()
+    record = profilo.get(sezione) if sezione else profilo
+    if not record:
+        return pd.DataFrame()
+    return pd.DataFrame([{**record, "Regione": profilo["nome"]}])
+
+
+# ===========================
+# NOTIFICHE DAL BACKEND (SSE)
+# ===========================
+# Una sola connessione a /eventi per processo: a ogni scrittura segnalata dal backend
+# si svuota subito la cache dei profili, senza attendere il TTL.
+EVENTI_RIPROVA_S = 3
+
+
+def _svuota_cache():
+    with profilo_lock:
+        _profilo_cache.clear()
+
+
+def _ascolta_eventi():
+    ultimo_id = None
+    while True:
+        try:
+            headers = {**HEADERS_API, "Accept": "text/event-stream"}
+            if ultimo_id:
+                headers["Last-Event-ID"] = ultimo_id   # il backend rimanda gli eventi persi
+            with requests.get(f"{BASE_URL}/eventi", headers=headers, stream=True, timeout=(5, 60)) as resp:
+                resp.raise_for_status()
+                dati = []
+                for riga in resp.iter_lines(chunk_size=None, decode_unicode=True):
+                    if riga.startswith("id:"):
+                        ultimo_id = riga[3:].strip()
+                    elif riga.startswith("data:"):
+                        dati.append(riga[5:].strip())
+                    elif not riga and dati:
+                        evento = json.loads("\n".join(dati))
+                        dati = []
+                        print(f"[API] Dati aggiornati: {evento['table']} (regione {evento['id_regione']})")
+                        _svuota_cache()
+        except Exception as e:
+            print(f"[API] Flusso eventi interrotto: {e}")
+        # disconnessi: si scarta ciò che potrebbe essere cambiato nel frattempo
+        _svuota_cache()
+        time.sleep(EVENTI_RIPROVA_S)
+
+
+def avvia_ascolto_eventi():
+    """Avvia in background l'ascolto di /eventi (si riconnette da solo)."""
+    threading.Thread(target=_ascolta_eventi, name="eventi-backend", daemon=True).start()
+
+
 # ===========================
 # UTILITÀ AGGIUNTIVE
 # ===========================
@@ -127,7 +248,7 @@ def get_azioni():
 def check_api_connection():
     """Verifica che il backend FastAPI sia raggiungibile."""
     try:
-        resp = requests.get(BASE_URL)
+        resp = requests.get(BASE_URL, headers=HEADERS_API)
         if resp.status_code == 200:
             print("[API] Connessione al backend OK ✅")
         else:
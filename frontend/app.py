@@ -17,6 +17,8 @@ Versione: 1.0.0
 from dash import Dash, html
 import dash_bootstrap_components as dbc
 import os
+from .compressione import registra as registra_compressione
+from .api import avvia_ascolto_eventi
 
 # ===========================
 # IMPORT COMPONENTI (layout)
@@ -44,6 +46,10 @@ app = Dash(
 app.title = "CAN Dashboard"
 server = app.server  # per compatibilità con eventuale deploy
 
+# gzip/brotli: assets precompressi (al build o al primo avvio) e risposte dinamiche
+# compresse al volo, comprese le figure delle callback
+registra_compressione(app)
+
 # ===========================
 # LAYOUT COMPLETO DELL'APP
 # ===========================
@@ -63,6 +69,9 @@ app.layout = dbc.Container(fluid=True, children=[
     legend_offcanvas_mobile,
 ])
 
+# Invalidazione delle cache su notifica del backend (Server-Sent Events)
+avvia_ascolto_eventi()
+
 # ===========================
 # IMPORT CALLBACKS
 # ===========================
@@ -6,8 +6,7 @@ fotovoltaico, FER, auto elettriche e risparmi energetici.
 """
 from dash import Input, Output
 from ..app import app
-from ..api import get_azioni
-from ..data_utils import df_regioni
+from ..api import get_profilo
 
 
 @app.callback(
@@ -27,10 +26,7 @@ def update_azioni(selected_region):
     Returns:
         tuple: 4 stringhe (fotovoltaico, FER, auto elettriche, risparmi energetici)
     """
-    df_azioni = get_azioni().merge(df_regioni, on="id_regione")
-    df_azioni.rename(columns={"nome": "Regione"}, inplace=True)
-
-    record = df_azioni[df_azioni["Regione"] == selected_region]
+    record = get_profilo(selected_region, "azioni")
     if record.empty:
         return "-", "-", "-", "-"
 
@@ -12,7 +12,7 @@ import requests
 from dash import Input, Output
 from ..app import app
 from ..data_utils import df_regioni
-from ..api import BASE_URL
+from ..api import BASE_URL, HEADERS_API
 
 
 # 1️⃣ Dropdown sinistro → aggiorna opzioni del destro
@@ -80,41 +80,30 @@ def update_confronto(regione1, regione2, categoria):
     if not (regione1 and regione2 and categoria):
         return px.bar()
 
-    endpoint_map = {
-        "superficie_kmq": "regioni", "densita_demografica": "regioni", "pil": "regioni",
-        "carbone_pct": "mix", "petrolio_pct": "mix", "gas_pct": "mix", "rinnovabili_pct": "mix",
-        "consumo_medio_kwh_m2y": "edifici", "emissioni_procapite_tco2_ab": "edifici",
-        "quota_elettrico_pct": "edifici", "quota_ape_classe_a_pct": "edifici",
-        "emissioni_per_valore_aggiunto_tco2_per_mln_eur": "industria",
-        "quota_elettrico_pct_industria": "industria",
-        "pianura_pct": "morfologia", "collina_pct": "morfologia", "montagna_pct": "morfologia",
-        "agricolo_pct": "morfologia", "urbano_pct": "morfologia", "forestale_pct": "morfologia"
-    }
-    endpoint = endpoint_map.get(categoria)
-    if not endpoint:
-        return px.bar(title="Categoria non supportata")
-
-    # Recupero dati
+    # Il backend risolve l'indicatore nella sua tabella e restituisce solo
+    # le celle richieste (una riga per regione), senza scaricare la tabella intera
+    regioni = [regione1, regione2]
     try:
-        dati = requests.get(f"{BASE_URL}/{endpoint}").json()
-        df = pd.DataFrame(dati)
+        resp = requests.get(
+            f"{BASE_URL}/confronto",
+            params={"regioni": ",".join(regioni), "indicatori": categoria},
+            headers=HEADERS_API,
+            timeout=5,
+        )
+        if resp.status_code == 400:
+            return px.bar(title="Categoria non supportata")
+        if resp.status_code == 404:
+            return px.bar(title="Dati non trovati per le regioni selezionate")
+        resp.raise_for_status()
+        df_sel = pd.DataFrame(resp.json())
     except Exception as e:
         return px.bar(title=f"Errore nel recupero dati: {e}")
 
-    if df.empty:
-        return px.bar(title=f"Nessun dato disponibile per {endpoint}")
-
-    if categoria == "quota_elettrico_pct_industria" and "quota_elettrico_pct" in df.columns:
-        df["quota_elettrico_pct_industria"] = df["quota_elettrico_pct"]
-
-    df[categoria] = pd.to_numeric(df[categoria], errors="coerce").fillna(0)
-    if "nome" not in df.columns and "id_regione" in df.columns:
-        df = df.merge(df_regioni[["id_regione", "nome"]], on="id_regione", how="left")
-
-    df_sel = df[df["nome"].isin([regione1, regione2])]
     if df_sel.empty:
         return px.bar(title="Dati non trovati per le regioni selezionate")
 
+    df_sel[categoria] = pd.to_numeric(df_sel[categoria], errors="coerce").fillna(0)
+
     x_max = df_sel[categoria].max()
     fig = px.bar(
         df_sel,
@@ -5,7 +5,7 @@ degli edifici per la regione selezionata.
 import plotly.express as px
 from dash import Input, Output
 from ..app import app
-from ..api import get_edifici
+from ..api import get_profilo
 
 
 @app.callback(
@@ -22,8 +22,7 @@ def update_edifici(selected_region):
     Returns:
         plotly.graph_objs.Figure: Grafico a barre aggiornato.
     """
-    df_edifici = get_edifici()
-    record = df_edifici[df_edifici["Regione"] == selected_region]
+    record = get_profilo(selected_region, "edifici")
     if record.empty:
         return px.bar(title="Nessun dato disponibile")
 
@@ -7,8 +7,7 @@ Visualizza la distribuzione percentuale delle fonti energetiche
 import plotly.express as px
 from dash import Input, Output
 from ..app import app
-from ..api import get_mix
-from ..data_utils import df_regioni
+from ..api import get_profilo
 
 
 @app.callback(
@@ -26,10 +25,7 @@ def update_mix(selected_region):
     Returns:
         plotly.graph_objs.Figure: Grafico a barre orizzontali.
     """
-    df_mix = get_mix().merge(df_regioni, on="id_regione")
-    df_mix.rename(columns={"nome": "Regione"}, inplace=True)
-
-    record = df_mix[df_mix["Regione"] == selected_region]
+    record = get_profilo(selected_region, "mix")
     if record.empty:
         return px.bar(title="Nessun dato disponibile")
 
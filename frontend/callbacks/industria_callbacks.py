@@ -7,8 +7,7 @@ energetico industriale in base alla regione selezionata.
 import plotly.express as px
 from dash import Input, Output
 from ..app import app
-from ..api import get_industria
-from ..data_utils import df_regioni
+from ..api import get_profilo
 
 
 @app.callback(
@@ -26,10 +25,7 @@ def update_industria(selected_region):
     Returns:
         tuple: Figure aggiornata e titolo stringa.
     """
-    df_ind = get_industria().merge(df_regioni, on="id_regione")
-    df_ind.rename(columns={"nome": "Regione"}, inplace=True)
-
-    record = df_ind[df_ind["Regione"] == selected_region]
+    record = get_profilo(selected_region, "industria")
     if record.empty:
         return px.bar(title="Nessun dato disponibile"), "Emissioni e consumo energetico dell’industria"
 
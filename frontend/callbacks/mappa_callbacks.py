@@ -8,10 +8,10 @@ Include:
 """
 
 import plotly.express as px
-from dash import Input, Output, ctx
+from dash import Input, Output, State, ctx
 from ..app import app
 from ..api import *
-from ..data_utils import geojson, prop_name_key, df_regioni, df_long, geojson_to_df_map
+from ..data_utils import geometrie_regioni, prop_name_key, df_regioni, df_long, geojson_to_df_map
 
 
 @app.callback(
@@ -22,11 +22,13 @@ from ..data_utils import geojson, prop_name_key, df_regioni, df_long, geojson_to
     Output("titolo-altimetria", "children"),
     Output("titolo-uso", "children"),
     Input("regione-dropdown", "value"),
-    Input("italia-map", "clickData")
+    Input("italia-map", "clickData"),
+    State("italia-map", "relayoutData")
 )
-def update_all(drop_val, click_data):
+def update_all(drop_val, click_data, relayout):
     """
     Aggiorna la mappa e i grafici a torta quando cambia la regione selezionata.
+    Il dettaglio dei confini segue lo zoom corrente della mappa.
     """
     selected_region = drop_val
     trigger = ctx.triggered_id
@@ -49,9 +51,10 @@ def update_all(drop_val, click_data):
     })
     df_map["sel"] = (df_map["nome"] == selected_region).astype(int)
 
+    zoom = (relayout or {}).get("map.zoom", 4.5)
     fig_map = px.choropleth_map(
         df_map,
-        geojson=geojson,
+        geojson=geometrie_regioni(zoom),
         locations="geojson_name",
         featureidkey=f"properties.{prop_name_key}",
         color="sel",
@@ -77,7 +80,8 @@ def update_all(drop_val, click_data):
         },
         customdata=df_map[["nome", "superficie_kmq", "densita_demografica", "pil"]].values
     )
-    fig_map.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, coloraxis_showscale=False)
+    # uirevision: cambiando regione la mappa mantiene zoom e posizione scelti dall'utente
+    fig_map.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, coloraxis_showscale=False, uirevision="mappa")
 
     # --------------------------
     # Grafici a torta morfologia (uso del suolo)
@@ -0,0 +1,162 @@
+"""
+Modulo compressione – gzip/brotli per il server Flask della dashboard (app.server).
+
+- I file statici di assets/ (CSS, JS, SVG, ...) vengono compressi una volta sola,
+  al build (`python compressione.py` nella cartella frontend) o al primo avvio se
+  mancano, e serviti con Content-Encoding e cache lunga.
+- Le risposte dinamiche (layout, callback con le figure Plotly) sono compresse al volo;
+  i bundle JS di Dash con impronta nell'URL sono compressi una volta per processo.
+
+brotli è opzionale: se manca si usa solo gzip.
+
+scegli_codifica() e comprimi() sono gli stessi di backend/compressione.py: le due
+immagini hanno contesti di build separati (./backend, ./frontend), quindi il modulo
+non può essere condiviso. Vanno modificati insieme.
+"""
+
+import gzip
+import mimetypes
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIONE_MIN_BYTE = int(os.getenv("COMPRESSIONE_MIN_BYTE", "1024"))
+GZIP_LIVELLO = int(os.getenv("GZIP_LIVELLO", "6"))
+BROTLI_QUALITA = int(os.getenv("BROTLI_QUALITA", "4"))
+
+CODIFICHE = ("br", "gzip") if brotli is not None else ("gzip",)
+ESTENSIONI = {"br": ".br", "gzip": ".gz"}
+STATICI_COMPRIMIBILI = (".css", ".js", ".json", ".geojson", ".svg", ".html", ".txt", ".map")
+TIPI_COMPRIMIBILI = ("application/json", "application/javascript", "text/")
+CARTELLA_ASSETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+# assets/ è servito con ?m=<mtime> nell'URL: la cache lunga si invalida da sola
+CACHE_ASSETS = "public, max-age=31536000, immutable"
+CACHE_ASSETS_SENZA_VERSIONE = "public, max-age=86400"
+
+
+def scegli_codifica(accept_encoding, disponibili=CODIFICHE):
+    """Codifica da usare secondo Accept-Encoding (valori q inclusi), None se nessuna."""
+    if not accept_encoding:
+        return None
+    pesi = {}
+    for parte in accept_encoding.lower().split(","):
+        nome, _, parametri = parte.strip().partition(";")
+        q = 1.0
+        if parametri.strip().startswith("q="):
+            try:
+                q = float(parametri.strip()[2:])
+            except ValueError:
+                q = 0.0
+        pesi[nome.strip()] = q
+    migliore, peso_migliore = None, 0.0
+    for codifica in disponibili:
+        peso = pesi.get(codifica, pesi.get("*", 0.0))
+        if peso > peso_migliore:
+            migliore, peso_migliore = codifica, peso
+    return migliore
+
+
+def comprimi(dati, codifica, massima=False):
+    """Compressione in un colpo solo; massima=True per i file statici."""
+    if codifica == "br":
+        return brotli.compress(dati, quality=11 if massima else BROTLI_QUALITA)
+    return gzip.compress(dati, compresslevel=9 if massima else GZIP_LIVELLO, mtime=0)
+
+
+def precomprimi(cartella=CARTELLA_ASSETS, solo_mancanti=False):
+    """
+    Scrive le varianti .gz/.br dei file statici comprimibili della cartella.
+    Con solo_mancanti=True rigenera solo quelle assenti o più vecchie del file.
+    """
+    scritti = []
+    for radice, _, file in os.walk(cartella):
+        for nome in file:
+            if not nome.endswith(STATICI_COMPRIMIBILI):
+                continue
+            percorso = os.path.join(radice, nome)
+            dati = None
+            for codifica in CODIFICHE:
+                destinazione = percorso + ESTENSIONI[codifica]
+                if solo_mancanti and os.path.exists(destinazione) \
+                        and os.path.getmtime(destinazione) >= os.path.getmtime(percorso):
+                    continue
+                if dati is None:
+                    with open(percorso, "rb") as f:
+                        dati = f.read()
+                with open(destinazione, "wb") as f:
+                    f.write(comprimi(dati, codifica, massima=True))
+                scritti.append(destinazione)
+    return scritti
+
+
+def registra(app):
+    """Aggancia la compressione al server Flask di un'app Dash."""
+    import flask
+
+    server = app.server
+    prefisso_assets = app.config.routes_pathname_prefix + app.config.assets_url_path.strip("/") + "/"
+    cartella = app.config.assets_folder
+    precomprimi(cartella, solo_mancanti=True)
+    bundle_compressi = {}
+
+    @server.before_request
+    def _servi_precompresso():
+        percorso = flask.request.path
+        if flask.request.method != "GET" or not percorso.startswith(prefisso_assets):
+            return None
+        relativo = percorso[len(prefisso_assets):]
+        file = os.path.realpath(os.path.join(cartella, relativo))
+        if not file.startswith(os.path.realpath(cartella) + os.sep):
+            return None
+        disponibili = [c for c in CODIFICHE if os.path.exists(file + ESTENSIONI[c])]
+        codifica = scegli_codifica(flask.request.headers.get("Accept-Encoding"), disponibili)
+        if codifica is None:
+            return None          # servito normalmente da Dash; la cache la imposta _dopo_risposta
+        tipo = mimetypes.guess_type(file)[0] or "application/octet-stream"
+        risposta = flask.send_file(file + ESTENSIONI[codifica], mimetype=tipo, conditional=True, etag=True)
+        risposta.headers["Content-Encoding"] = codifica
+        risposta.headers["Vary"] = "Accept-Encoding"
+        risposta.headers["Cache-Control"] = CACHE_ASSETS if "m" in flask.request.args else CACHE_ASSETS_SENZA_VERSIONE
+        return risposta
+
+    @server.after_request
+    def _dopo_risposta(risposta):
+        richiesta = flask.request
+        if richiesta.path.startswith(prefisso_assets) and risposta.status_code == 200:
+            risposta.headers["Cache-Control"] = CACHE_ASSETS if "m" in richiesta.args else CACHE_ASSETS_SENZA_VERSIONE
+        if (
+            risposta.status_code != 200
+            or risposta.direct_passthrough
+            or "Content-Encoding" in risposta.headers
+            or not (risposta.mimetype or "").startswith(TIPI_COMPRIMIBILI)
+        ):
+            return risposta
+        risposta.vary.add("Accept-Encoding")
+        codifica = scegli_codifica(richiesta.headers.get("Accept-Encoding"))
+        dati = risposta.get_data()
+        if codifica is None or len(dati) < COMPRESSIONE_MIN_BYTE:
+            return risposta
+        if richiesta.path.startswith(app.config.routes_pathname_prefix + "_dash-component-suites/"):
+            # bundle con impronta nell'URL: il contenuto non cambia, si comprime una volta
+            chiave = (richiesta.path, codifica)
+            if chiave not in bundle_compressi:
+                bundle_compressi[chiave] = comprimi(dati, codifica)
+            compresso = bundle_compressi[chiave]
+        else:
+            compresso = comprimi(dati, codifica)
+        risposta.set_data(compresso)
+        risposta.headers["Content-Encoding"] = codifica
+        if risposta.get_etag()[0]:
+            risposta.set_etag(risposta.get_etag()[0], weak=True)
+        return risposta
+
+
+if __name__ == "__main__":
+    cartella = sys.argv[1] if len(sys.argv) > 1 else CARTELLA_ASSETS
+    for percorso in precomprimi(cartella):
+        print(percorso)
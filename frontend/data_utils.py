@@ -3,36 +3,123 @@ Modulo data_utils - Contiene i dati condivisi e funzioni di supporto
 per le callback della CAN Dashboard.
 """
 import json
+from functools import lru_cache
 import pandas as pd
 import requests
 import os
-from .api import BASE_URL
+import time
+from .api import BASE_URL, HEADERS_API
 
 BASE_URL = "http://backend:8000"
 
-# Percorso sicuro per il geojson
+# Percorso sicuro per il geojson (usato solo se il backend non fornisce le geometrie)
 geojson_path = os.path.join(os.path.dirname(__file__), "limits_IT_regions.geojson")
-with open(geojson_path, "r", encoding="utf-8") as f:
-    geojson = json.load(f)
 prop_name_key = "reg_name"
 
+
+def topojson_a_geojson(topologia):
+    """
+    Converte il TopoJSON quantizzato del backend in una FeatureCollection:
+    somma le differenze degli archi, applica la trasformazione e ricompone
+    gli anelli (un indice negativo ~i è l'arco i percorso al contrario).
+    """
+    (sx, sy), (tx, ty) = topologia["transform"]["scale"], topologia["transform"]["translate"]
+    archi = []
+    for arco in topologia["arcs"]:
+        x = y = 0
+        punti = []
+        for dx, dy in arco:
+            x, y = x + dx, y + dy
+            punti.append([x * sx + tx, y * sy + ty])
+        archi.append(punti)
+
+    def anello(indici):
+        punti = []
+        for i in indici:
+            arco = archi[i] if i >= 0 else archi[~i][::-1]
+            punti.extend(arco if not punti else arco[1:])
+        return punti
+
+    features = []
+    for geometria in topologia["objects"]["regioni"]["geometries"]:
+        if geometria["type"] == "Polygon":
+            coordinate = [anello(a) for a in geometria["arcs"]]
+        else:
+            coordinate = [[anello(a) for a in poligono] for poligono in geometria["arcs"]]
+        features.append({
+            "type": "Feature",
+            "properties": geometria["properties"],
+            "geometry": {"type": geometria["type"], "coordinates": coordinate},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+# dopo un errore il backend non viene richiamato per questi secondi (si usa il file locale)
+GEOMETRIE_RIPROVA_S = 30
+_errore_geometrie = {"momento": float("-inf")}
+
+
+@lru_cache(maxsize=None)
+def _geojson_locale():
+    with open(geojson_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def _scarica_livello(zoom_intero):
+    """Solo le risposte riuscite restano in cache: un errore solleva e lru_cache non lo memorizza."""
+    resp = requests.get(f"{BASE_URL}/geometrie/regioni", params={"zoom": zoom_intero}, headers=HEADERS_API, timeout=5)
+    resp.raise_for_status()
+    return topojson_a_geojson(resp.json())
+
+
+def _geometrie_livello(zoom_intero):
+    if time.monotonic() - _errore_geometrie["momento"] < GEOMETRIE_RIPROVA_S:
+        return _geojson_locale()
+    try:
+        return _scarica_livello(zoom_intero)
+    except Exception as e:
+        _errore_geometrie["momento"] = time.monotonic()
+        print(f"[API] Geometrie semplificate non disponibili, uso il GeoJSON locale: {e}")
+        return _geojson_locale()
+
+
+def geometrie_regioni(zoom=4.5):
+    """
+    Confini delle regioni con il livello di dettaglio adatto allo zoom della mappa
+    (scaricati e decodificati una volta per ogni zoom intero).
+    """
+    return _geometrie_livello(int(zoom))
+
 # =========================
-# 1️⃣ CARICAMENTO REGIONI
+# 1️⃣ SNAPSHOT COLONNARE (una sola richiesta)
 # =========================
-regioni_resp = requests.get(f"{BASE_URL}/regioni").json()
-df_regioni = pd.DataFrame(regioni_resp)
+# Il backend restituisce un array per colonna, con le righe di tutte le tabelle
+# già allineate su "id_regione": i DataFrame si costruiscono senza merge.
+snapshot = requests.get(f"{BASE_URL}/snapshot", headers=HEADERS_API).json()
+snapshot_ids = snapshot["id_regione"]
+snapshot_tabelle = snapshot["tabelle"]
+
+
+def df_snapshot(*tabelle):
+    """
+    Costruisce un DataFrame affiancando le colonne delle tabelle indicate.
+    Le regioni senza dati nella prima tabella vengono scartate.
+    """
+    colonne = {"id_regione": snapshot_ids}
+    for tabella in tabelle:
+        colonne.update(snapshot_tabelle[tabella])
+    df = pd.DataFrame(colonne)
+    return df.dropna(how="all", subset=list(snapshot_tabelle[tabelle[0]])).reset_index(drop=True)
+
+
+df_regioni = df_snapshot("regioni")
 
 # =========================
 # 2️⃣ MORFOLOGIA E ASSORBIMENTI
 # =========================
-morf_resp = requests.get(f"{BASE_URL}/morfologia").json()
-assorb_resp = requests.get(f"{BASE_URL}/assorbimenti").json()
-
-df_morf = pd.DataFrame(morf_resp).merge(df_regioni, on="id_regione", how="left", validate="one_to_one")
-df_morf.rename(columns={"nome": "Regione"}, inplace=True)
-
-df_assorb = pd.DataFrame(assorb_resp).merge(df_regioni, on="id_regione", how="left", validate="one_to_one")
-df_assorb.rename(columns={"nome": "Regione"}, inplace=True)
+df_morf = df_snapshot("morfologia", "regioni").rename(columns={"nome": "Regione"})
+df_assorb = df_snapshot("assorbimenti", "regioni").rename(columns={"nome": "Regione"})
 
 # Conversione morfologia in formato long
 df_morf["geo_region"] = df_morf["Regione"]
@@ -55,24 +142,10 @@ geojson_to_df_map = {
 # =========================
 # 3️⃣ EMISSIONI TOTALI
 # =========================
-try:
-    emiss_resp = requests.get(f"{BASE_URL}/emissioni").json()
-    df_emissioni = pd.DataFrame(emiss_resp)
-
-    if not df_emissioni.empty:
-        df_emissioni = df_emissioni.merge(
-            df_regioni[["id_regione", "nome"]],
-            on="id_regione",
-            how="left"
-        )
-        df_emissioni.rename(columns={
-            "nome": "Regione",
-            "co2eq_mln_t": "emissioni_totali_mln_t"
-        }, inplace=True)
-    else:
-        print("[API] Nessun dato emissioni ricevuto")
-        df_emissioni = pd.DataFrame(columns=["id_regione", "Regione", "emissioni_totali_mln_t"])
-
-except Exception as e:
-    print(f"[API] Errore caricando emissioni totali: {e}")
-    df_emissioni = pd.DataFrame(columns=["id_regione", "Regione", "emissioni_totali_mln_t"])
\ No newline at end of file
+df_emissioni = df_snapshot("emissioni", "regioni")[["id_regione", "co2eq_mln_t", "nome"]]
+if df_emissioni.empty:
+    print("[API] Nessun dato emissioni ricevuto")
+df_emissioni = df_emissioni.rename(columns={
+    "nome": "Regione",
+    "co2eq_mln_t": "emissioni_totali_mln_t"
+})